@@ -0,0 +1,256 @@
+# batch_runner.py
+import os
+import sys
+import json
+import time
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List
+from clients import load_environment, run_async
+
+# Load environment variables from .env file
+load_environment()
+
+from perplexity_researcher import DEFAULT_MAX_CONCURRENCY, DEFAULT_TIMEOUT
+from response_cache import configure_cache
+from research_memory import configure_memory, memory_mode_for
+from query_dedup import DEFAULT_SIMILARITY_THRESHOLD
+from novelty import DEFAULT_MIN_QUERIES
+from model_router import ModelRouter, ROUTING_POLICIES, DEFAULT_ROUTING_POLICY
+from run_store import RunStore, DEFAULT_RUNS_DIR
+from metrics import get_recorder
+from pipeline import (
+    PipelineOptions,
+    run_query_stage,
+    run_research_stage_async,
+    build_corpus,
+    run_analysis_stage,
+    run_report_stage,
+)
+
+# Topics processed at the same time
+DEFAULT_TOPIC_CONCURRENCY = 4
+# Threads shared by the blocking OpenAI stages (queries, analysis, report) of all topics
+DEFAULT_STAGE_WORKERS = 8
+
+def read_topics(lines: List[str]) -> List[str]:
+    """
+    Parses topics given one per line, either as plain text or as JSON objects
+    with a "topic" field. Blank lines and lines starting with '#' are ignored;
+    malformed JSON lines are skipped with a warning.
+    """
+    topics = []
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            try:
+                topic = json.loads(line).get("topic")
+            except (ValueError, AttributeError) as e:
+                print(f"Warning: skipping line {number}, which is not a valid JSON object: {e}")
+                continue
+            if not isinstance(topic, str) or not topic.strip():
+                print(f"Warning: skipping line {number}, which has no \"topic\" string.")
+                continue
+            topics.append(topic.strip())
+        else:
+            topics.append(line)
+    return topics
+
+async def run_topic(
+    topic: str,
+    options: PipelineOptions,
+    runs_dir: str,
+    executor: ThreadPoolExecutor,
+    topic_semaphore: asyncio.Semaphore,
+    research_semaphore: asyncio.Semaphore,
+) -> dict:
+    """
+    Runs the full pipeline for one topic on the shared pool.
+
+    Returns:
+        A summary record with the topic's status, run ID, report path,
+        per-stage timings in seconds and the error, if any.
+    """
+    loop = asyncio.get_running_loop()
+    record = {"topic": topic, "run_id": None, "status": "failed", "report_path": None,
+              "timings": {}, "error": None}
+    async with topic_semaphore:
+        start = time.perf_counter()
+        try:
+            store = RunStore.create(topic, runs_dir)
+            record["run_id"] = store.run_id
+
+            stage_start = time.perf_counter()
+            queries = await loop.run_in_executor(executor, run_query_stage, store, options)
+            record["timings"]["queries"] = round(time.perf_counter() - stage_start, 3)
+            if not queries:
+                raise RuntimeError("Failed to generate queries.")
+
+            stage_start = time.perf_counter()
+            results = await run_research_stage_async(store, queries, options, research_semaphore)
+            corpus = build_corpus(store, results, options)
+            record["timings"]["research"] = round(time.perf_counter() - stage_start, 3)
+
+            stage_start = time.perf_counter()
+            analysis = await loop.run_in_executor(executor, run_analysis_stage, store, corpus, options)
+            record["timings"]["analysis"] = round(time.perf_counter() - stage_start, 3)
+            if analysis is None:
+                raise RuntimeError("Analysis failed.")
+
+            stage_start = time.perf_counter()
+            report_path = await loop.run_in_executor(executor, run_report_stage, store, corpus, analysis, options)
+            record["timings"]["report"] = round(time.perf_counter() - stage_start, 3)
+            if report_path is None:
+                raise RuntimeError("Report generation failed.")
+
+            record["status"] = "ok"
+            record["report_path"] = report_path
+        except Exception as e:
+            # One failing topic must not stop the rest of the batch
+            record["error"] = str(e)
+        if record["run_id"] is not None:
+            record["routing"] = ModelRouter(options.model_routing, store.load_routing_log()).summary()
+        record["timings"]["total"] = round(time.perf_counter() - start, 3)
+    return record
+
+async def run_batch(
+    topics: List[str],
+    options: PipelineOptions,
+    summary_path: str,
+    runs_dir: str = DEFAULT_RUNS_DIR,
+    topic_concurrency: int = DEFAULT_TOPIC_CONCURRENCY,
+    stage_workers: int = DEFAULT_STAGE_WORKERS,
+) -> List[dict]:
+    """
+    Runs every topic through one shared worker pool and appends one JSON line
+    per finished topic to `summary_path`.
+
+    Concurrency is bounded globally: at most `topic_concurrency` topics are
+    in progress, at most `options.concurrency` Perplexity requests are in
+    flight across all topics, and at most `stage_workers` OpenAI stage calls
+    run at once.
+
+    Returns:
+        The summary records, in input order.
+    """
+    topic_semaphore = asyncio.Semaphore(max(1, topic_concurrency))
+    research_semaphore = asyncio.Semaphore(max(1, options.concurrency))
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, stage_workers)) as executor, \
+            open(summary_path, "a", encoding="utf-8") as summary:
+
+        async def run_and_record(topic: str) -> dict:
+            record = await run_topic(topic, options, runs_dir, executor, topic_semaphore, research_semaphore)
+            summary.write(json.dumps(record) + "\n")
+            summary.flush()
+            print(f"\n[batch] {record['status']}: {topic} ({record['timings']['total']:.1f}s)"
+                  + (f" - {record['error']}" if record["error"] else ""))
+            return record
+
+        return await asyncio.gather(*(run_and_record(topic) for topic in topics))
+
+def parse_args(argv=None):
+    """Parses command-line options for batch mode."""
+    parser = argparse.ArgumentParser(description="Run the research agent over many topics.")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="File with one topic per line (plain text or JSONL); '-' reads stdin (default).")
+    parser.add_argument("--summary", default=None,
+                        help="JSONL file receiving one status/timing record per topic "
+                             "(default: generated_reports/batch_summary_<timestamp>.jsonl).")
+    parser.add_argument("--runs-dir", default=DEFAULT_RUNS_DIR,
+                        help=f"Directory holding per-run checkpoints (default: {DEFAULT_RUNS_DIR}).")
+    parser.add_argument("--topic-concurrency", type=int, default=DEFAULT_TOPIC_CONCURRENCY,
+                        help=f"Topics processed at the same time (default: {DEFAULT_TOPIC_CONCURRENCY}).")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help=f"Perplexity requests in flight across all topics (default: {DEFAULT_MAX_CONCURRENCY}).")
+    parser.add_argument("--stage-workers", type=int, default=DEFAULT_STAGE_WORKERS,
+                        help=f"OpenAI stage calls running at once across all topics (default: {DEFAULT_STAGE_WORKERS}).")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Per-query Perplexity timeout in seconds (default: {DEFAULT_TIMEOUT:.0f}).")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                        help=f"Similarity at which generated queries are merged (default: {DEFAULT_SIMILARITY_THRESHOLD}).")
+    parser.add_argument("--novelty-threshold", type=float, default=None,
+                        help="Stop researching a topic once results add less than this share of new text "
+                             "(default: research every query).")
+    parser.add_argument("--min-queries", type=int, default=DEFAULT_MIN_QUERIES,
+                        help=f"Results always collected per topic before stopping early (default: {DEFAULT_MIN_QUERIES}).")
+    parser.add_argument("--max-queries", type=int, default=None,
+                        help="Stop researching a topic after this many successful results (default: no limit).")
+    parser.add_argument("--report-mode", choices=["single", "sections"], default="single",
+                        help="'single' writes each report in one completion (default); 'sections' plans an "
+                             "outline and writes its sections in parallel.")
+    parser.add_argument("--model-routing", choices=sorted(ROUTING_POLICIES), default=DEFAULT_ROUTING_POLICY,
+                        help="'fixed' uses one model per stage (default); 'tiered' tries faster models first "
+                             "and escalates when a result fails its quality check.")
+    parser.add_argument("--memory", choices=["use", "store", "off"], default=None,
+                        help="Research memory of earlier runs: 'use' reuses or adds related findings "
+                             "(default), 'store' only records new results (default with --refresh-cache), "
+                             "'off' disables it (default with --no-cache).")
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument("--no-cache", action="store_true",
+                             help="Do not read or write the response cache.")
+    cache_group.add_argument("--refresh-cache", action="store_true",
+                             help="Ignore cached responses but store the fresh ones.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Entry point for batch mode."""
+    args = parse_args(argv)
+    cache_mode = "bypass" if args.no_cache else "refresh" if args.refresh_cache else None
+    if cache_mode:
+        configure_cache(mode=cache_mode)
+    # Refreshing or bypassing the cache also keeps remembered results out of the run
+    memory_mode = memory_mode_for(cache_mode, args.memory)
+    if memory_mode:
+        configure_memory(mode=memory_mode)
+
+    if args.input == "-":
+        topics = read_topics(sys.stdin.readlines())
+    else:
+        with open(args.input, "r", encoding="utf-8") as f:
+            topics = read_topics(f.readlines())
+    if not topics:
+        print("No topics given. Exiting.")
+        return
+
+    summary_path = args.summary or os.path.join(
+        "generated_reports", f"batch_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    )
+    # Live progress lines from concurrent topics would overwrite each other,
+    # so batch mode uses the non-streaming analysis and report calls
+    options = PipelineOptions(
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        dedup_threshold=args.dedup_threshold,
+        stream=False,
+        novelty_threshold=args.novelty_threshold,
+        min_queries=args.min_queries,
+        max_queries=args.max_queries,
+        report_mode=args.report_mode,
+        model_routing=args.model_routing,
+    )
+
+    print(f"Running {len(topics)} topics ({args.topic_concurrency} at a time)...")
+    start = time.perf_counter()
+    records = run_async(run_batch(
+        topics, options, summary_path, args.runs_dir, args.topic_concurrency, args.stage_workers
+    ))
+    succeeded = sum(1 for r in records if r["status"] == "ok")
+    print(f"\nBatch complete: {succeeded}/{len(records)} topics succeeded in {time.perf_counter() - start:.1f}s.")
+    print(f"Summary written to {summary_path}")
+
+    recorder = get_recorder()
+    if recorder.records:
+        print("\nModel call summary:")
+        print(recorder.format_table())
+        basename = os.path.splitext(os.path.basename(summary_path))[0] + "_metrics"
+        json_path, prom_path = recorder.write(os.path.dirname(summary_path) or ".", basename)
+        print(f"Metrics written to {json_path} and {prom_path}")
+
+if __name__ == "__main__":
+    main()
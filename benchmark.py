@@ -0,0 +1,203 @@
+# benchmark.py
+import os
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Dict, List
+
+from mock_openai_server import start_mock_server, add_config_arguments, config_from_args
+
+# Directory (relative to the working directory) where benchmark results are saved
+DEFAULT_RESULTS_DIR = "benchmark_results"
+STAGES = ("queries", "research", "analysis", "report", "end_to_end")
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            # The checkout this file belongs to, wherever the benchmark is run from
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _stats(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[int(0.5 * (len(ordered) - 1))],
+        "p95": ordered[int(round(0.95 * (len(ordered) - 1)))],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+def run_iteration(topic: str, sequential: bool, concurrency: int, router) -> Dict[str, float]:
+    """Runs the four stages once, choosing models through `router`, and returns their wall times in seconds."""
+    # Imported here so the base-URL overrides are in place before any client is built
+    from generate_research_queries import generate_queries
+    from perplexity_researcher import research_query_perplexity, research_queries_perplexity_async
+    from openai_analyzer import analyze_research_openai
+    from report_generator import generate_html_report
+    from research_corpus import ResearchCorpus
+    from token_budget import estimate_tokens
+    from clients import run_async
+
+    timings = {}
+    start = time.perf_counter()
+
+    stage_start = time.perf_counter()
+    queries = router.run("queries", estimate_tokens(topic), lambda model: generate_queries(topic, model=model))
+    timings["queries"] = time.perf_counter() - stage_start
+    if not queries:
+        raise RuntimeError("Query generation returned no queries.")
+
+    stage_start = time.perf_counter()
+    if sequential:
+        results = [
+            router.run("research", estimate_tokens(q), lambda model: research_query_perplexity(q, model))
+            for q in queries
+        ]
+    else:
+        results = run_async(research_queries_perplexity_async(queries, max_concurrency=concurrency, router=router))
+    timings["research"] = time.perf_counter() - stage_start
+    corpus = ResearchCorpus(topic, [{"query": q, "result": r} for q, r in zip(queries, results)])
+
+    stage_start = time.perf_counter()
+    analysis = router.run(
+        "analysis", corpus.tokens, lambda model: analyze_research_openai(topic, corpus.results, corpus=corpus, model=model)
+    )
+    timings["analysis"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    router.run(
+        "report",
+        corpus.tokens + estimate_tokens(analysis),
+        lambda model: generate_html_report(topic, corpus.results, analysis, corpus, model),
+    )
+    timings["report"] = time.perf_counter() - stage_start
+
+    timings["end_to_end"] = time.perf_counter() - start
+    return timings
+
+def run_benchmark(args) -> dict:
+    """Runs the configured iterations against the mock (or given) server and summarizes them."""
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = start_mock_server(config_from_args(args))
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["PERPLEXITY_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("PERPLEXITY_API_KEY", "benchmark")
+
+    from response_cache import configure_cache
+    from research_memory import configure_memory
+    from scheduler import configure_scheduler
+    from metrics import get_recorder
+    from model_router import ModelRouter
+
+    # Every iteration must reach the server, otherwise the cache would hide all latency
+    configure_cache(mode="bypass")
+    configure_memory(mode="off")
+    # Account rate limits do not apply to the mock; retries, hedging and the breaker still do
+    if server is not None:
+        configure_scheduler(limits={})
+    recorder = get_recorder()
+    recorder.reset()
+    router = ModelRouter(args.model_routing)
+
+    iterations = []
+    try:
+        for i in range(args.iterations):
+            print(f"\n=== Iteration {i+1}/{args.iterations} ===")
+            iterations.append(run_iteration(f"{args.topic} {i+1}", args.sequential, args.concurrency, router))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    return {
+        "commit": _git_commit(),
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare",)},
+        "iterations": iterations,
+        "stages": {stage: _stats([it[stage] for it in iterations]) for stage in STAGES},
+        "calls": recorder.summary(),
+        "routing": router.summary(),
+    }
+
+def format_results(result: dict) -> str:
+    lines = [f"{'Stage':<12} {'mean':>8} {'p50':>8} {'p95':>8} {'min':>8} {'max':>8}"]
+    for stage in STAGES:
+        s = result["stages"][stage]
+        lines.append(f"{stage:<12} {s['mean']:>7.3f}s {s['p50']:>7.3f}s {s['p95']:>7.3f}s {s['min']:>7.3f}s {s['max']:>7.3f}s")
+    for stage, row in result.get("routing", {}).items():
+        models = ", ".join(f"{model} x{count}" for model, count in row["models"].items())
+        lines.append(f"Routing {stage}: {models}; {row['escalations']} escalations")
+    return "\n".join(lines)
+
+def compare_results(baseline_path: str, candidate_path: str) -> str:
+    """Renders a per-stage p50/p95 comparison between two saved result files."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(candidate_path, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    lines = [
+        f"Baseline:  {baseline['commit']} {baseline.get('label') or ''} ({baseline['timestamp']})",
+        f"Candidate: {candidate['commit']} {candidate.get('label') or ''} ({candidate['timestamp']})",
+        "",
+        f"{'Stage':<12} {'base p50':>9} {'new p50':>9} {'change':>8}   {'base p95':>9} {'new p95':>9} {'change':>8}",
+    ]
+    for stage in STAGES:
+        b, c = baseline["stages"][stage], candidate["stages"][stage]
+
+        def change(key):
+            return f"{(c[key] - b[key]) / b[key] * 100:+7.1f}%" if b[key] else "     n/a"
+
+        lines.append(
+            f"{stage:<12} {b['p50']:>8.3f}s {c['p50']:>8.3f}s {change('p50')}   "
+            f"{b['p95']:>8.3f}s {c['p95']:>8.3f}s {change('p95')}"
+        )
+    return "\n".join(lines)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark against a mock OpenAI/Perplexity server.")
+    parser.add_argument("--iterations", type=int, default=5, help="Pipeline runs to time (default: 5).")
+    parser.add_argument("--topic", default="Benchmark topic", help="Topic prefix for each iteration.")
+    parser.add_argument("--sequential", action="store_true", help="Research queries sequentially.")
+    parser.add_argument("--concurrency", type=int, default=5, help="Concurrent research requests (default: 5).")
+    parser.add_argument("--base-url", default=None,
+                        help="Use an already running OpenAI-compatible server instead of starting the mock.")
+    parser.add_argument("--model-routing", choices=["fixed", "tiered"], default="fixed",
+                        help="Model routing policy for every stage (default: fixed).")
+    parser.add_argument("--label", default=None, help="Free-form label stored with the results.")
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR,
+                        help=f"Where result files are written (default: {DEFAULT_RESULTS_DIR}).")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="Compare two saved result files instead of running a benchmark.")
+    add_config_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        print(compare_results(*args.compare))
+        return
+
+    result = run_benchmark(args)
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"{result['commit']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\nBenchmark results ({args.iterations} iterations, commit {result['commit']}):")
+    print(format_results(result))
+    print(f"\nResults saved to {path}")
+    print(f"Compare with another run: python benchmark.py --compare <baseline.json> {path}")
+
+if __name__ == "__main__":
+    main()
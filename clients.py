@@ -0,0 +1,181 @@
+# clients.py
+import os
+import asyncio
+import threading
+import weakref
+from dotenv import load_dotenv
+from metrics import on_http_request, on_http_response, on_http_request_async, on_http_response_async
+from scheduler import get_scheduler
+
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+
+# Connection pool settings, overridable through the environment
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 600.0
+DEFAULT_MAX_RETRIES = 2
+
+_lock = threading.Lock()
+_environment_loaded = False
+_http_client = None
+_openai_client = None
+_perplexity_client = None
+# Async clients are bound to the event loop they were first used on
+_async_clients = weakref.WeakKeyDictionary()
+
+def load_environment():
+    """Loads variables from the .env file once per process."""
+    global _environment_loaded
+    if not _environment_loaded:
+        load_dotenv()
+        _environment_loaded = True
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def _require_key(name: str) -> str:
+    load_environment()
+    key = os.getenv(name)
+    if not key:
+        raise ValueError(f"{name} not found in environment variables. Please set it in your .env file.")
+    return key
+
+def _pool_settings():
+    """Builds the httpx limits and timeouts shared by every client."""
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(_env_float("RESEARCH_HTTP_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+        max_keepalive_connections=int(_env_float("RESEARCH_HTTP_MAX_KEEPALIVE", DEFAULT_MAX_KEEPALIVE_CONNECTIONS)),
+        keepalive_expiry=_env_float("RESEARCH_HTTP_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY),
+    )
+    timeout = httpx.Timeout(
+        _env_float("RESEARCH_HTTP_READ_TIMEOUT", DEFAULT_READ_TIMEOUT),
+        connect=_env_float("RESEARCH_HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+    )
+    return limits, timeout
+
+def _max_retries() -> int:
+    # The shared scheduler retries every call itself; stacking the SDK's
+    # retries underneath would multiply attempts and ignore its rate limits
+    if get_scheduler().enabled:
+        return 0
+    return int(_env_float("RESEARCH_HTTP_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+
+def get_http_client():
+    """
+    Returns the process-wide httpx.Client. Every synchronous OpenAI and
+    Perplexity client shares its keep-alive connection pool, so TLS handshakes
+    are paid once per host rather than once per client or request.
+    """
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            import httpx
+
+            limits, timeout = _pool_settings()
+            _http_client = httpx.Client(
+                limits=limits,
+                timeout=timeout,
+                follow_redirects=True,
+                # Let the metrics layer count retries and time to first byte
+                event_hooks={"request": [on_http_request], "response": [on_http_response]},
+            )
+        return _http_client
+
+def get_openai_client():
+    """
+    Returns the process-wide OpenAI client, creating it on first use.
+
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set.
+    """
+    global _openai_client
+    if _openai_client is None:
+        api_key = _require_key("OPENAI_API_KEY")
+        http_client = get_http_client()
+        from openai import OpenAI
+
+        with _lock:
+            if _openai_client is None:
+                # base_url defaults to OPENAI_BASE_URL when set, else the public API
+                _openai_client = OpenAI(api_key=api_key, http_client=http_client, max_retries=_max_retries())
+    return _openai_client
+
+def get_perplexity_client():
+    """
+    Returns the process-wide Perplexity client (OpenAI-compatible API),
+    creating it on first use. PERPLEXITY_BASE_URL overrides the endpoint.
+
+    Raises:
+        ValueError: If PERPLEXITY_API_KEY is not set.
+    """
+    global _perplexity_client
+    if _perplexity_client is None:
+        api_key = _require_key("PERPLEXITY_API_KEY")
+        http_client = get_http_client()
+        from openai import OpenAI
+
+        with _lock:
+            if _perplexity_client is None:
+                _perplexity_client = OpenAI(
+                    api_key=api_key,
+                    base_url=os.getenv("PERPLEXITY_BASE_URL", PERPLEXITY_BASE_URL),
+                    http_client=http_client,
+                    max_retries=_max_retries(),
+                )
+    return _perplexity_client
+
+def get_async_perplexity_client():
+    """
+    Returns the async Perplexity client for the running event loop. Async
+    connection pools cannot be shared between event loops, so one client
+    (and pool) is kept per loop.
+
+    Raises:
+        ValueError: If PERPLEXITY_API_KEY is not set.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        api_key = _require_key("PERPLEXITY_API_KEY")
+        import httpx
+        from openai import AsyncOpenAI
+
+        limits, timeout = _pool_settings()
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=os.getenv("PERPLEXITY_BASE_URL", PERPLEXITY_BASE_URL),
+            http_client=httpx.AsyncClient(
+                limits=limits,
+                timeout=timeout,
+                follow_redirects=True,
+                event_hooks={"request": [on_http_request_async], "response": [on_http_response_async]},
+            ),
+            max_retries=_max_retries(),
+        )
+        _async_clients[loop] = client
+    return client
+
+async def close_async_clients():
+    """Closes the running event loop's async client and its connection pool, if one was created."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+def run_async(coro):
+    """
+    Runs `coro` in a new event loop, like asyncio.run, and closes the async
+    clients created on that loop before it ends. Otherwise every loop (one
+    per batch, server job or research stage) would leave its client and
+    connection pool behind.
+    """
+    async def run_and_close():
+        try:
+            return await coro
+        finally:
+            await close_async_clients()
+    return asyncio.run(run_and_close())
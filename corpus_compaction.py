@@ -0,0 +1,186 @@
+# corpus_compaction.py
+import re
+import hashlib
+from typing import Dict, FrozenSet, List, Set, Tuple
+from token_budget import estimate_tokens
+
+# Share of a sentence's word shingles already present in one kept sentence
+# at or above which the sentence is dropped as a near-duplicate
+DEFAULT_SIMILARITY_THRESHOLD = 0.8
+# Number of words per shingle
+SHINGLE_WORDS = 2
+# Sentences shorter than this (in words) are only removed when exactly duplicated,
+# since short lines are often headings or list labels
+MIN_NEAR_DUPLICATE_WORDS = 6
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[])")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+def _words(text: str) -> List[str]:
+    return _NON_WORD.sub(" ", text.lower()).split()
+
+def _fingerprint(words: List[str]) -> str:
+    return hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=8).hexdigest()
+
+def _numbers(words: List[str]) -> FrozenSet[str]:
+    return frozenset(word for word in words if any(c.isdigit() for c in word))
+
+def _shingles(words: List[str]) -> Set[int]:
+    if len(words) < SHINGLE_WORDS:
+        return {hash(" ".join(words))}
+    return {hash(" ".join(words[i:i + SHINGLE_WORDS])) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+class _SentenceIndex:
+    """Inverted index from shingles to kept sentences, so each lookup only touches overlapping candidates."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.exact: Dict[str, int] = {}
+        self.postings: Dict[int, List[int]] = {}
+        self.sources: List[int] = []
+        self.numbers: List[FrozenSet[str]] = []
+
+    def find_duplicate(self, words: List[str]) -> int:
+        """
+        Returns the source query number of a kept duplicate of this sentence,
+        or -1. Near-duplicates must state the same figures: sentences that
+        differ only in a number ("grew 24 percent" and "grew 30 percent")
+        are both kept, since such discrepancies between sources matter.
+        """
+        fingerprint = _fingerprint(words)
+        if fingerprint in self.exact:
+            return self.exact[fingerprint]
+        if len(words) < MIN_NEAR_DUPLICATE_WORDS:
+            return -1
+        shingles = _shingles(words)
+        numbers = _numbers(words)
+        overlaps: Dict[int, int] = {}
+        for shingle in shingles:
+            for sentence_id in self.postings.get(shingle, ()):
+                overlaps[sentence_id] = overlaps.get(sentence_id, 0) + 1
+        for sentence_id, overlap in overlaps.items():
+            # Containment rather than Jaccard: a sentence whose content is already
+            # covered by a longer kept sentence adds nothing new
+            if overlap / len(shingles) >= self.threshold and self.numbers[sentence_id] == numbers:
+                return self.sources[sentence_id]
+        return -1
+
+    def add(self, words: List[str], source: int):
+        self.exact.setdefault(_fingerprint(words), source)
+        if len(words) < MIN_NEAR_DUPLICATE_WORDS:
+            return
+        sentence_id = len(self.sources)
+        self.sources.append(source)
+        self.numbers.append(_numbers(words))
+        for shingle in _shingles(words):
+            self.postings.setdefault(shingle, []).append(sentence_id)
+
+def compact_results(
+    results: List[Dict[str, str]],
+    similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+) -> Tuple[List[Dict[str, str]], Dict[str, object]]:
+    """
+    Removes duplicate and near-duplicate paragraphs and sentences across
+    research results, keeping the first occurrence in query order.
+
+    Each compacted result keeps its own query, and ends with a note naming the
+    earlier queries whose results already contained the omitted text, so the
+    downstream prompts retain provenance. Near-duplicate sentences are only
+    removed when they state the same numbers as the sentence they match.
+
+    Args:
+        results: Query/result pairs in query order. An optional 'number'
+                 gives the query's number (default: its position, from 1),
+                 so notes stay correct when some queries have no result.
+        similarity_threshold: Share of a sentence's word shingles found in a single
+                              earlier sentence at or above which it counts as a
+                              near-duplicate.
+
+    Returns:
+        The compacted query/result pairs, and a report with the number of
+        paragraphs and sentences removed, the estimated tokens before and
+        after, and the per-query omissions ('omitted').
+    """
+    index = _SentenceIndex(similarity_threshold)
+    seen_paragraphs: Dict[str, int] = {}
+    compacted: List[Dict[str, str]] = []
+    omitted: List[Dict[str, object]] = []
+    removed_paragraphs = removed_sentences = 0
+    tokens_before = tokens_after = 0
+
+    for position, item in enumerate(results):
+        query_number = item.get("number", position + 1)
+        result = item["result"]
+        tokens_before += estimate_tokens(result)
+        if result.startswith("Error:"):
+            compacted.append(dict(item))
+            tokens_after += estimate_tokens(result)
+            continue
+
+        duplicated_from: Dict[int, int] = {}
+        kept_paragraphs: List[str] = []
+        for paragraph in re.split(r"\n\s*\n", result):
+            paragraph_words = _words(paragraph)
+            if not paragraph_words:
+                continue
+            paragraph_key = _fingerprint(paragraph_words)
+            if paragraph_key in seen_paragraphs:
+                source = seen_paragraphs[paragraph_key]
+                duplicated_from[source] = duplicated_from.get(source, 0) + 1
+                removed_paragraphs += 1
+                continue
+            seen_paragraphs[paragraph_key] = query_number
+
+            kept_lines: List[str] = []
+            for line in paragraph.split("\n"):
+                kept_sentences: List[str] = []
+                for sentence in _SENTENCE_BOUNDARY.split(line.strip()):
+                    words = _words(sentence)
+                    if not words:
+                        if sentence:
+                            kept_sentences.append(sentence)
+                        continue
+                    source = index.find_duplicate(words)
+                    if source >= 0:
+                        duplicated_from[source] = duplicated_from.get(source, 0) + 1
+                        removed_sentences += 1
+                        continue
+                    index.add(words, query_number)
+                    kept_sentences.append(sentence)
+                if kept_sentences:
+                    kept_lines.append(" ".join(kept_sentences))
+            if kept_lines:
+                kept_paragraphs.append("\n".join(kept_lines))
+
+        text = "\n\n".join(kept_paragraphs)
+        # Duplicates within the same result need no cross-reference
+        sources = sorted(s for s in duplicated_from if s != query_number)
+        if sources:
+            references = ", ".join(f"Query {s}" for s in sources)
+            text += f"\n\n[Overlapping findings omitted; also reported under {references}.]"
+            omitted.append({"query": item["query"], "duplicated_from": sources,
+                            "units_removed": sum(duplicated_from.values())})
+        compacted.append({**item, "result": text})
+        tokens_after += estimate_tokens(text)
+
+    report = {
+        "paragraphs_removed": removed_paragraphs,
+        "sentences_removed": removed_sentences,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "omitted": omitted,
+    }
+    return compacted, report
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    test_results = [
+        {"query": "AI tutoring effectiveness", "result": "Studies show AI tutors can improve test scores by 10 to 15 percent. Results vary by subject.\n\nAdoption is growing in the United States."},
+        {"query": "AI personalized learning", "result": "Studies show that AI tutors can improve test scores by 10 to 15 percent. Adaptive curricula adjust pacing per student.\n\nAdoption is growing in the United States."},
+    ]
+    compacted_results, compaction_report = compact_results(test_results)
+    for entry in compacted_results:
+        print(f"{entry['query']}:\n{entry['result']}\n")
+    print(f"Saved ~{compaction_report['tokens_saved']} tokens "
+          f"({compaction_report['sentences_removed']} sentences, {compaction_report['paragraphs_removed']} paragraphs removed)")
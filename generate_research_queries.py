@@ -1,29 +1,29 @@
-import os
-from dotenv import load_dotenv
-from openai import OpenAI, APIError
-from typing import List
+from typing import List, Optional
+from clients import get_openai_client
+from response_cache import get_cache, make_cache_key
+from metrics import track_call, record_cache_hit
+from scheduler import create_completion
+from query_dedup import deduplicate_queries, DEFAULT_SIMILARITY_THRESHOLD
 
-# Load environment variables from .env file
-load_dotenv()
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY not found in environment variables. Please set it in your .env file.")
-
-# Initialize OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-def generate_queries(topic: str) -> List[str]:
+def generate_queries(
+    topic: str,
+    similarity_threshold: Optional[float] = DEFAULT_SIMILARITY_THRESHOLD,
+    model: str = "gpt-4.1-mini",
+) -> List[str]:
     """
     Generates research queries for a given topic using the OpenAI API.
 
     Args:
         topic: The central topic for research.
+        similarity_threshold: Similarity at or above which a query is dropped as a
+                              paraphrase of an earlier one. None disables deduplication.
+        model: The OpenAI model that writes the queries.
 
     Returns:
         A list of generated query strings. Returns an empty list if an error occurs.
     """
+    from openai import APIError
+
     system_prompt = """Instructions for Generating Focused Research Search Queries
     1.  Input Analysis:
         •   Analyze the user's topic or question to extract key concepts, themes, and subtopics.
@@ -61,40 +61,57 @@ def generate_queries(topic: str) -> List[str]:
         {"role": "user", "content": f"Generate search queries for the topic: {topic}"}
     ]
 
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.7, # Adjusted temperature for potentially more varied queries
+        "max_tokens": 500, # Reduced tokens as we only need the queries
+        "top_p": 1,
+    }
+    cache = get_cache()
+    cache_key = make_cache_key("queries", **request)
+
     try:
-        # Note: The original code used client.responses.create, which seems incorrect for OpenAI's standard API.
-        # Using client.chat.completions.create instead, which is the standard for chat models.
-        # Adjust model name if needed - assuming a GPT-4 variant is intended.
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini", # Using the requested GPT-4.1-mini model
-            messages=messages,
-            temperature=0.7, # Adjusted temperature for potentially more varied queries
-            max_tokens=500, # Reduced tokens as we only need the queries
-            top_p=1,
-        )
+        content = cache.get("queries", cache_key)
+        if content is None:
+            # Note: The original code used client.responses.create, which seems incorrect for OpenAI's standard API.
+            # Using client.chat.completions.create instead, which is the standard for chat models.
+            with track_call("queries", request["model"]) as call:
+                response = create_completion(get_openai_client(), **request)
+                call.set_usage(response.usage)
 
-        if response.choices and len(response.choices) > 0:
+            if not response.choices or len(response.choices) == 0:
+                print("Error: No response choices received from OpenAI.")
+                return []
             content = response.choices[0].message.content
             if content:
-                # Split the response into lines and filter out empty lines
-                queries = [line.strip() for line in content.strip().split('\n') if line.strip()]
-                # Further refine: remove potential numbering/bullet points
-                cleaned_queries = []
-                for query in queries:
-                    # Remove leading numbers/bullets like "1.", "• ", "- " etc.
-                    parts = query.split('.', 1)
-                    if len(parts) == 2 and parts[0].isdigit():
-                        cleaned_queries.append(parts[1].strip())
-                    elif query.startswith(('• ', '- ')):
-                         cleaned_queries.append(query[2:].strip())
-                    else:
-                         cleaned_queries.append(query)
-                return cleaned_queries
-            else:
-                print("Error: Received empty response content from OpenAI.")
-                return []
+                cache.set("queries", cache_key, content)
         else:
-            print("Error: No response choices received from OpenAI.")
+            record_cache_hit("queries", request["model"])
+            print("Using cached queries.")
+
+        if content:
+            # Split the response into lines and filter out empty lines
+            queries = [line.strip() for line in content.strip().split('\n') if line.strip()]
+            # Further refine: remove potential numbering/bullet points
+            cleaned_queries = []
+            for query in queries:
+                # Remove leading numbers/bullets like "1.", "• ", "- " etc.
+                parts = query.split('.', 1)
+                if len(parts) == 2 and parts[0].isdigit():
+                    cleaned_queries.append(parts[1].strip())
+                elif query.startswith(('• ', '- ')):
+                     cleaned_queries.append(query[2:].strip())
+                else:
+                     cleaned_queries.append(query)
+            if similarity_threshold is not None:
+                cleaned_queries, merged = deduplicate_queries(cleaned_queries, similarity_threshold)
+                for record in merged:
+                    print(f"Dropped near-duplicate query \"{record['dropped']}\" "
+                          f"(similarity {record['similarity']} to \"{record['kept']}\")")
+            return cleaned_queries
+        else:
+            print("Error: Received empty response content from OpenAI.")
             return []
 
     except APIError as e:
@@ -115,7 +132,3 @@ if __name__ == "__main__":
             print(f"{i+1}. {q}")
     else:
         print("Failed to generate queries.")
-
-# Remove the old, direct API call structure
-# client = OpenAI() - Already initialized above with API key
-# response = client.responses.create(...) - This block is now replaced by the function logic
\ No newline at end of file
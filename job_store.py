@@ -0,0 +1,267 @@
+# job_store.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+# Database holding the shared queue, next to the run directories it refers to
+DEFAULT_JOB_DB = os.path.join("runs", "jobs.sqlite3")
+# Seconds a leased task stays owned without a heartbeat before another worker may reclaim it
+DEFAULT_LEASE_SECONDS = 120.0
+# Attempts per task (including reclaimed leases and retried error results) before it is marked failed
+DEFAULT_MAX_ATTEMPTS = 3
+# Delay before a task whose attempt failed is offered again
+RETRY_DELAY = 5.0
+
+# Task kinds, in the order workers prefer them: finishing topics first keeps
+# few topics half done, and per-query research spreads one topic across workers
+TASK_KINDS = ("finalize", "research", "queries")
+# query_index of tasks that are not about a single query
+NO_QUERY = -1
+
+class JobStore:
+    """
+    Crash-safe task queue shared by worker processes through one SQLite
+    database (WAL mode).
+
+    A topic becomes a run with one "queries" task; completing it enqueues one
+    "research" task per query, and the last research task to finish enqueues
+    the run's "finalize" task (analysis and report). Workers lease tasks for
+    `lease_seconds` and renew the lease while working. A lease that expires,
+    because its worker died or hung, is reclaimed by the next worker looking
+    for work.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOB_DB, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY, topic TEXT NOT NULL, options TEXT NOT NULL,"
+                " status TEXT NOT NULL, report_path TEXT, error TEXT,"
+                " created_at REAL NOT NULL, finished_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, kind TEXT NOT NULL,"
+                " query_index INTEGER NOT NULL, status TEXT NOT NULL, owner TEXT,"
+                " lease_expires REAL, available_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT, routing TEXT, UNIQUE (run_id, kind, query_index))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, available_at)")
+            self._conn = conn
+        return self._conn
+
+    def _transaction(self, work):
+        """Runs work(conn) in an immediate (write-locked) transaction."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _enqueue(conn: sqlite3.Connection, run_id: str, kind: str, query_index: int = NO_QUERY):
+        conn.execute(
+            "INSERT OR IGNORE INTO tasks (run_id, kind, query_index, status, available_at)"
+            " VALUES (?, ?, ?, 'pending', ?)",
+            (run_id, kind, query_index, time.time()),
+        )
+
+    def submit(self, run_id: str, topic: str, options: Dict[str, object]):
+        """Registers a run and enqueues its query-generation task."""
+        def work(conn):
+            conn.execute(
+                "INSERT INTO runs (run_id, topic, options, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (run_id, topic, json.dumps(options), time.time()),
+            )
+            self._enqueue(conn, run_id, "queries")
+        self._transaction(work)
+
+    def enqueue_research(self, run_id: str, indices: List[int]):
+        """Enqueues per-query research tasks, or the finalize task when there are none."""
+        def work(conn):
+            conn.execute("UPDATE runs SET status = 'running' WHERE run_id = ?", (run_id,))
+            for index in indices:
+                self._enqueue(conn, run_id, "research", index)
+            if not indices:
+                self._enqueue(conn, run_id, "finalize")
+        self._transaction(work)
+
+    def lease(self, owner: str) -> Optional[Dict[str, object]]:
+        """
+        Leases the next available task to `owner`, reclaiming expired leases.
+        Tasks whose attempts are used up are marked failed instead.
+
+        Returns:
+            The task (id, run_id, kind, query_index, attempts, topic, options),
+            or None when nothing is available.
+        """
+        def work(conn):
+            now = time.time()
+            while True:
+                row = conn.execute(
+                    "SELECT t.id, t.run_id, t.kind, t.query_index, t.attempts, t.status, t.owner,"
+                    " r.topic, r.options FROM tasks t JOIN runs r ON r.run_id = t.run_id"
+                    " WHERE (t.status = 'pending' AND t.available_at <= ?)"
+                    " OR (t.status = 'leased' AND t.lease_expires < ?)"
+                    " ORDER BY CASE t.kind WHEN 'finalize' THEN 0 WHEN 'research' THEN 1 ELSE 2 END, t.id"
+                    " LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                task_id, run_id, kind, index, attempts, status, previous_owner, topic, options = row
+                if status == "leased":
+                    print(f"Reclaiming task {task_id} ({kind}) from {previous_owner}, whose lease expired.")
+                if attempts >= self.max_attempts:
+                    self._fail(conn, task_id, run_id, kind, f"gave up after {attempts} attempts")
+                    continue
+                conn.execute(
+                    "UPDATE tasks SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1"
+                    " WHERE id = ?",
+                    (owner, now + self.lease_seconds, task_id),
+                )
+                return {"id": task_id, "run_id": run_id, "kind": kind, "query_index": index,
+                        "attempts": attempts + 1, "topic": topic, "options": json.loads(options)}
+        return self._transaction(work)
+
+    def renew(self, task_id: int, owner: str) -> bool:
+        """Extends a lease; False if the task has meanwhile been reclaimed by another worker."""
+        def work(conn):
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, task_id, owner),
+            )
+            return cursor.rowcount == 1
+        return self._transaction(work)
+
+    def _finish_research(self, conn: sqlite3.Connection, run_id: str):
+        """Enqueues finalize once no research task of the run is still open."""
+        open_tasks = conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE run_id = ? AND kind = 'research' AND status IN ('pending', 'leased')",
+            (run_id,),
+        ).fetchone()[0]
+        if open_tasks == 0:
+            self._enqueue(conn, run_id, "finalize")
+
+    def _fail(self, conn: sqlite3.Connection, task_id: int, run_id: str, kind: str, error: str):
+        conn.execute("UPDATE tasks SET status = 'failed', error = ?, owner = NULL WHERE id = ?", (error, task_id))
+        if kind == "research":
+            # The analysis goes ahead with the results that were collected
+            self._finish_research(conn, run_id)
+        else:
+            conn.execute("UPDATE runs SET status = 'failed', error = ?, finished_at = ? WHERE run_id = ?",
+                         (f"{kind} task failed: {error}", time.time(), run_id))
+
+    def complete(self, task: Dict[str, object], owner: str, routing: Optional[List[dict]] = None) -> bool:
+        """
+        Marks a leased task done, storing its routing decisions, and enqueues
+        the run's finalize task after its last research task.
+
+        Returns:
+            False if the lease was lost to another worker; the result was
+            checkpointed anyway, so the other worker will find it.
+        """
+        def work(conn):
+            cursor = conn.execute(
+                "UPDATE tasks SET status = 'done', owner = NULL, routing = ? WHERE id = ? AND owner = ?",
+                (json.dumps(routing or []), task["id"], owner),
+            )
+            if cursor.rowcount != 1:
+                return False
+            if task["kind"] == "research":
+                self._finish_research(conn, task["run_id"])
+            return True
+        return self._transaction(work)
+
+    def release(self, task: Dict[str, object], owner: str, error: str):
+        """Hands a task whose attempt failed back to the queue, or fails it once its attempts are used up."""
+        def work(conn):
+            if task["attempts"] >= self.max_attempts:
+                self._fail(conn, task["id"], task["run_id"], task["kind"], error)
+            else:
+                conn.execute(
+                    "UPDATE tasks SET status = 'pending', owner = NULL, error = ?, available_at = ?"
+                    " WHERE id = ? AND owner = ?",
+                    (error, time.time() + RETRY_DELAY, task["id"], owner),
+                )
+        self._transaction(work)
+
+    def research_routing(self, run_id: str) -> List[dict]:
+        """Routing decisions recorded by the run's research tasks, in query order."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT routing FROM tasks WHERE run_id = ? AND kind = 'research' AND routing IS NOT NULL"
+                " ORDER BY query_index",
+                (run_id,),
+            ).fetchall()
+        return [decision for (routing,) in rows for decision in json.loads(routing)]
+
+    def finish_run(self, run_id: str, report_path: Optional[str], error: Optional[str] = None):
+        """Records a run's outcome."""
+        def work(conn):
+            conn.execute(
+                "UPDATE runs SET status = ?, report_path = ?, error = ?, finished_at = ? WHERE run_id = ?",
+                ("completed" if report_path else "failed", report_path, error, time.time(), run_id),
+            )
+        self._transaction(work)
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Number of runs per status and of tasks per kind and status."""
+        with self._lock:
+            conn = self._connect()
+            runs = dict(conn.execute("SELECT status, COUNT(*) FROM runs GROUP BY status").fetchall())
+            tasks: Dict[str, int] = {}
+            for kind, status, count in conn.execute(
+                "SELECT kind, status, COUNT(*) FROM tasks GROUP BY kind, status"
+            ).fetchall():
+                tasks[f"{kind}:{status}"] = count
+        return {"runs": runs, "tasks": tasks}
+
+    def is_idle(self) -> bool:
+        """True when no task is pending or leased."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')"
+            ).fetchone()
+        return row[0] == 0
+
+    def runs(self) -> List[Dict[str, object]]:
+        """Every run with its topic, status, report path and error."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT run_id, topic, status, report_path, error, created_at, finished_at FROM runs ORDER BY created_at"
+            ).fetchall()
+        keys = ("run_id", "topic", "status", "report_path", "error", "created_at", "finished_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    demo = JobStore(os.path.join("runs", "jobs_demo.sqlite3"), lease_seconds=1.0)
+    demo.submit(f"demo_{int(time.time())}", "Demo topic", {})
+    task = demo.lease("worker-a")
+    print("Leased:", task["kind"], "by worker-a")
+    time.sleep(1.1)
+    # worker-a never renewed its lease, so worker-b reclaims the task
+    task = demo.lease("worker-b")
+    print("Reclaimed:", task["kind"], "attempt", task["attempts"])
+    print(demo.counts())
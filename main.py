@@ -1,93 +1,123 @@
-import os
+import argparse
 from datetime import datetime
-from dotenv import load_dotenv
+from clients import load_environment
 
 # Load environment variables from .env file
-load_dotenv()
+load_environment()
 
 # Import the functions from our other modules
-from generate_research_queries import generate_queries
-from perplexity_researcher import research_query_perplexity
-from openai_analyzer import analyze_research_openai
-from report_generator import generate_html_report
+from perplexity_researcher import DEFAULT_MAX_CONCURRENCY, DEFAULT_TIMEOUT
+from response_cache import configure_cache
+from research_memory import configure_memory, memory_mode_for
+from query_dedup import DEFAULT_SIMILARITY_THRESHOLD
+from run_store import RunStore, DEFAULT_RUNS_DIR
+from pipeline import PipelineOptions, run_pipeline
+from sectioned_report import DEFAULT_SECTION_WORKERS
+from novelty import DEFAULT_MIN_QUERIES
+from model_router import ROUTING_POLICIES, DEFAULT_ROUTING_POLICY
+from metrics import get_recorder
 
-def main():
-    """Main function to orchestrate the research process."""
-    topic = input("Enter the research topic: ")
-    if not topic:
-        print("No topic entered. Exiting.")
-        return
-
-    print(f"\nGenerating research queries for: {topic}...")
-    queries = generate_queries(topic)
-
-    if not queries:
-        print("Failed to generate queries. Exiting.")
-        return
+def parse_args(argv=None):
+    """Parses command-line options for the research agent."""
+    parser = argparse.ArgumentParser(description="Automated research agent.")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Resume an earlier run, re-executing only missing or failed work.")
+    parser.add_argument("--runs-dir", default=DEFAULT_RUNS_DIR,
+                        help=f"Directory holding per-run checkpoints (default: {DEFAULT_RUNS_DIR}).")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Research queries one at a time instead of concurrently.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help=f"Maximum concurrent Perplexity requests (default: {DEFAULT_MAX_CONCURRENCY}).")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Per-query Perplexity timeout in seconds (default: {DEFAULT_TIMEOUT:.0f}).")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                        help=f"Similarity at which generated queries are merged as paraphrases "
+                             f"(default: {DEFAULT_SIMILARITY_THRESHOLD}; 1.0 keeps all but exact duplicates).")
+    parser.add_argument("--novelty-threshold", type=float, default=None,
+                        help="Stop researching once results add less than this share of new text "
+                             "(e.g. 0.25; default: research every query).")
+    parser.add_argument("--min-queries", type=int, default=DEFAULT_MIN_QUERIES,
+                        help=f"Results always collected before stopping early (default: {DEFAULT_MIN_QUERIES}).")
+    parser.add_argument("--max-queries", type=int, default=None,
+                        help="Stop researching after this many successful results (default: no limit).")
+    parser.add_argument("--no-compact", action="store_true",
+                        help="Paste research results into the prompts without removing duplicated text.")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="Wait for complete analysis and report responses instead of streaming them.")
+    parser.add_argument("--report-mode", choices=["single", "sections"], default="single",
+                        help="'single' writes the report in one completion (default); 'sections' plans an "
+                             "outline and writes its sections in parallel.")
+    parser.add_argument("--section-workers", type=int, default=DEFAULT_SECTION_WORKERS,
+                        help=f"Report sections generated at once in sections mode (default: {DEFAULT_SECTION_WORKERS}).")
+    parser.add_argument("--model-routing", choices=sorted(ROUTING_POLICIES), default=DEFAULT_ROUTING_POLICY,
+                        help="'fixed' uses one model per stage (default); 'tiered' tries faster models first "
+                             "and escalates when a result fails its quality check.")
+    parser.add_argument("--memory", choices=["use", "store", "off"], default=None,
+                        help="Research memory of earlier runs: 'use' reuses or adds related findings "
+                             "(default), 'store' only records new results (default with --refresh-cache), "
+                             "'off' disables it (default with --no-cache).")
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument("--no-cache", action="store_true",
+                             help="Do not read or write the response cache.")
+    cache_group.add_argument("--refresh-cache", action="store_true",
+                             help="Ignore cached responses but store the fresh ones.")
+    return parser.parse_args(argv)
 
-    print(f"\nGenerated {len(queries)} queries. Starting research...")
-    
-    all_results = []
-    for i, query in enumerate(queries):
-        print(f"\n[{i+1}/{len(queries)}] Researching query: {query}")
-        result = research_query_perplexity(query)
-        print("Result Preview:")
-        # Limit printing potentially long results to console
-        print(result[:300] + ('...' if len(result) > 300 else '')) 
-        all_results.append({"query": query, "result": result})
-        print("-"*40) # Separator
+def pipeline_options(args) -> PipelineOptions:
+    """Builds pipeline settings from parsed command-line options."""
+    return PipelineOptions(
+        sequential=args.sequential,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        dedup_threshold=args.dedup_threshold,
+        stream=not args.no_stream,
+        compact=not args.no_compact,
+        novelty_threshold=args.novelty_threshold,
+        min_queries=args.min_queries,
+        max_queries=args.max_queries,
+        report_mode=args.report_mode,
+        section_workers=args.section_workers,
+        model_routing=args.model_routing,
+    )
 
-    print("\nResearch complete.")
-
-    intermediate_analysis = None
-    try:
-        print("\nStarting intermediate analysis with o3-mini...")
-        intermediate_analysis = analyze_research_openai(topic, all_results)
-        print("\nIntermediate Analysis (from o3-mini) Preview:")
-        print("="*40)
-        if intermediate_analysis:
-             print(intermediate_analysis[:500] + ('...' if len(intermediate_analysis) > 500 else '')) 
-        else:
-             print("No analysis content generated.")
-        print("="*40)
-    except Exception as e:
-        print(f"\nError during OpenAI analysis: {e}")
-        # Optionally decide if you want to proceed without analysis
-        # return 
+def main(argv=None):
+    """Main function to orchestrate the research process."""
+    args = parse_args(argv)
+    cache_mode = "bypass" if args.no_cache else "refresh" if args.refresh_cache else None
+    if cache_mode:
+        configure_cache(mode=cache_mode)
+    # Refreshing or bypassing the cache also keeps remembered results out of the run
+    memory_mode = memory_mode_for(cache_mode, args.memory)
+    if memory_mode:
+        configure_memory(mode=memory_mode)
 
-    final_report_html = None
-    if intermediate_analysis is not None:
+    if args.resume:
         try:
-            print("\nGenerating final HTML report...")
-            final_report_html = generate_html_report(topic, all_results, intermediate_analysis)
-            print("\nFinal HTML report generated.")
-        except Exception as e:
-            print(f"\nError during report generation: {e}")
-            # Optionally decide if you want to proceed without the report
-            # return
+            store = RunStore.open(args.resume, args.runs_dir)
+        except FileNotFoundError as e:
+            print(e)
+            return
+        print(f"Resuming run {store.run_id} for topic: {store.topic}")
     else:
-        print("\nSkipping final report generation due to analysis failure.")
+        topic = input("Enter the research topic: ")
+        if not topic:
+            print("No topic entered. Exiting.")
+            return
+        store = RunStore.create(topic, args.runs_dir)
+        print(f"Run ID: {store.run_id} (resume with --resume {store.run_id})")
 
-    if final_report_html:
-        # Define the directory to save reports
-        reports_dir = "generated_reports"
-        # Create the directory if it doesn't exist
-        os.makedirs(reports_dir, exist_ok=True)
+    report_path = run_pipeline(store, pipeline_options(args))
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_topic = "".join(c if c.isalnum() else '_' for c in topic)
-        base_filename = f"research_report_{safe_topic}_{timestamp}.html"
-        # Construct the full path
-        filepath = os.path.join(reports_dir, base_filename)
-            
-        try:
-            with open(filepath, 'w', encoding='utf-8') as f: # Use the full filepath
-                f.write(final_report_html)
-            print(f"\nFinal research report saved to {filepath}") # Update print message
-        except IOError as e:
-            print(f"\nError saving final report to file: {e}")
-    elif intermediate_analysis is not None:
-         print("\nFinal report could not be generated, so it was not saved.")
+    recorder = get_recorder()
+    if recorder.records:
+        print("\nModel call summary:")
+        print(recorder.format_table())
+        json_path, prom_path = recorder.write(
+            store.directory, f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
+        print(f"Metrics written to {json_path} and {prom_path}")
+    if report_path is None:
+        print(f"\nRun {store.run_id} did not complete. Resume it with: python main.py --resume {store.run_id}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,316 @@
+# metrics.py
+import os
+import json
+import asyncio
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Estimated USD prices per million (input, output) tokens. Update as pricing changes.
+MODEL_PRICES = {
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "o3-mini": (1.10, 4.40),
+    "sonar": (1.00, 1.00),
+    "sonar-pro": (3.00, 15.00),
+}
+# USD per million prompt tokens served from the provider's prompt cache;
+# models not listed are billed at their normal input price
+MODEL_CACHED_INPUT_PRICES = {
+    "gpt-4.1": 0.50,
+    "gpt-4.1-mini": 0.10,
+    "gpt-4.1-nano": 0.025,
+    "o3-mini": 0.55,
+}
+# Estimated USD fee per request on top of token costs (Perplexity search fees)
+MODEL_REQUEST_FEES = {
+    "sonar": 0.005,
+    "sonar-pro": 0.006,
+}
+
+QUANTILES = (0.5, 0.99)
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Estimates the USD cost of one call; unknown models cost 0."""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    cached_price = MODEL_CACHED_INPUT_PRICES.get(model, input_price)
+    return (
+        (prompt_tokens - cached_tokens) * input_price / 1_000_000
+        + cached_tokens * cached_price / 1_000_000
+        + completion_tokens * output_price / 1_000_000
+        + MODEL_REQUEST_FEES.get(model, 0.0)
+    )
+
+def _percentile(values: List[float], quantile: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(quantile * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class CallRecord:
+    """Measurements for a single model call."""
+
+    def __init__(self, stage: str, model: str):
+        self.stage = stage
+        self.model = model
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.wall_time: Optional[float] = None
+        self.ttfb: Optional[float] = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.attempts = 0
+        self.status = "ok"
+        self.cost = 0.0
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.attempts - 1)
+
+    def mark_first_byte(self):
+        """Records the time to first byte; later calls overwrite it so retried calls report the final attempt."""
+        self.ttfb = time.perf_counter() - self._start
+
+    def set_usage(self, usage):
+        """Copies token counts from a response's `usage` object, if present."""
+        if usage is None:
+            return
+        self.prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+    def finish(self, status: str):
+        self.status = status
+        self.wall_time = time.perf_counter() - self._start
+        if status != "cached":
+            self.cost = estimate_cost(self.model, self.prompt_tokens, self.completion_tokens, self.cached_tokens)
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.stage,
+            "model": self.model,
+            "started_at": self.started_at,
+            "status": self.status,
+            "wall_time": self.wall_time,
+            "ttfb": self.ttfb,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "retries": self.retries,
+            "cost": self.cost,
+        }
+
+# The call being tracked in the current thread or task, so HTTP hooks can attribute requests to it
+_current_call: contextvars.ContextVar = contextvars.ContextVar("current_call", default=None)
+
+def on_http_request(request):
+    """httpx request hook: counts attempts (first try plus retries) for the current call."""
+    call = _current_call.get()
+    if call is not None:
+        call.attempts += 1
+
+def on_http_response(response):
+    """httpx response hook: records time to first byte (response headers) for the current call."""
+    call = _current_call.get()
+    if call is not None:
+        call.mark_first_byte()
+
+async def on_http_request_async(request):
+    on_http_request(request)
+
+async def on_http_response_async(response):
+    on_http_response(response)
+
+class MetricsRecorder:
+    """Collects CallRecords from every stage and renders summaries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records: List[CallRecord] = []
+
+    @contextmanager
+    def track_call(self, stage: str, model: str):
+        """
+        Measures one model call. Use the yielded CallRecord to attach token
+        usage from the response; exceptions mark the call as failed. Calls
+        cancelled by their caller (e.g. in-flight research after early
+        stopping) are recorded as cancelled, not as errors.
+        """
+        record = CallRecord(stage, model)
+        token = _current_call.set(record)
+        try:
+            yield record
+        except asyncio.CancelledError:
+            record.finish("cancelled")
+            raise
+        except BaseException:
+            record.finish("error")
+            raise
+        else:
+            record.finish(record.status)
+        finally:
+            _current_call.reset(token)
+            with self._lock:
+                self.records.append(record)
+
+    def record_cache_hit(self, stage: str, model: str):
+        """Records a call that was answered from the response cache."""
+        record = CallRecord(stage, model)
+        record.finish("cached")
+        with self._lock:
+            self.records.append(record)
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def _groups(self) -> Dict[Tuple[str, str], List[CallRecord]]:
+        groups: Dict[Tuple[str, str], List[CallRecord]] = {}
+        with self._lock:
+            for record in self.records:
+                groups.setdefault((record.stage, record.model), []).append(record)
+        return groups
+
+    def summary(self) -> List[dict]:
+        """Aggregates the records per stage and model."""
+        rows = []
+        for (stage, model), records in self._groups().items():
+            remote = [r for r in records if r.status != "cached"]
+            walls = [r.wall_time for r in remote if r.wall_time is not None]
+            ttfbs = [r.ttfb for r in remote if r.ttfb is not None]
+            prompt_tokens = sum(r.prompt_tokens for r in remote)
+            cached_tokens = sum(r.cached_tokens for r in remote)
+            rows.append({
+                "stage": stage,
+                "model": model,
+                "calls": len(remote),
+                "cached": len(records) - len(remote),
+                "errors": sum(1 for r in remote if r.status == "error"),
+                "cancelled": sum(1 for r in remote if r.status == "cancelled"),
+                "retries": sum(r.retries for r in remote),
+                "wall_p50": _percentile(walls, 0.5) if walls else None,
+                "wall_p99": _percentile(walls, 0.99) if walls else None,
+                "wall_total": sum(walls),
+                "ttfb_p50": _percentile(ttfbs, 0.5) if ttfbs else None,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": sum(r.completion_tokens for r in remote),
+                "cached_tokens": cached_tokens,
+                # Share of prompt tokens served from the provider's prompt (prefix) cache
+                "prompt_cache_hit_rate": cached_tokens / prompt_tokens if prompt_tokens else None,
+                "cost": sum(r.cost for r in remote),
+            })
+        return rows
+
+    def format_table(self) -> str:
+        """Renders the per-stage summary as a plain-text table."""
+        def seconds(value):
+            return f"{value:.2f}s" if value is not None else "-"
+
+        def cached_tokens(row):
+            if row["prompt_cache_hit_rate"] is None:
+                return str(row["cached_tokens"])
+            return f"{row['cached_tokens']} ({row['prompt_cache_hit_rate']:.0%})"
+
+        headers = ["Stage", "Model", "Calls", "Cached", "Errors", "Cancelled", "Retries", "p50", "p99",
+                   "TTFB p50", "Prompt tok", "Cached tok", "Compl tok", "Cost $"]
+        rows = [[
+            row["stage"], row["model"], str(row["calls"]), str(row["cached"]), str(row["errors"]),
+            str(row["cancelled"]), str(row["retries"]), seconds(row["wall_p50"]), seconds(row["wall_p99"]), seconds(row["ttfb_p50"]),
+            str(row["prompt_tokens"]), cached_tokens(row), str(row["completion_tokens"]), f"{row['cost']:.4f}",
+        ] for row in self.summary()]
+        total_cost = sum(row["cost"] for row in self.summary())
+        rows.append(["Total"] + [""] * (len(headers) - 2) + [f"{total_cost:.4f}"])
+
+        widths = [max(len(r[i]) for r in [headers] + rows) for i in range(len(headers))]
+        lines = ["  ".join(h.ljust(w) for h, w in zip(headers, widths))]
+        lines.append("  ".join("-" * w for w in widths))
+        for r in rows:
+            lines.append("  ".join(c.ljust(w) for c, w in zip(r, widths)))
+        return "\n".join(lines)
+
+    def to_json(self) -> str:
+        """Serializes the per-call records and the per-stage summary."""
+        with self._lock:
+            calls = [r.to_dict() for r in self.records]
+        return json.dumps({"calls": calls, "summary": self.summary()}, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Renders the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        groups = self._groups()
+        for name, attribute, help_text in (
+            ("research_call_duration_seconds", "wall_time", "Wall time of model calls."),
+            ("research_call_ttfb_seconds", "ttfb", "Time to first byte of model calls."),
+        ):
+            metric(name, "summary", help_text)
+            for (stage, model), records in groups.items():
+                values = [getattr(r, attribute) for r in records
+                          if r.status != "cached" and getattr(r, attribute) is not None]
+                labels = f'stage="{stage}",model="{model}"'
+                for quantile in QUANTILES:
+                    if values:
+                        lines.append(f'{name}{{{labels},quantile="{quantile}"}} {_percentile(values, quantile):.6f}')
+                lines.append(f"{name}_sum{{{labels}}} {sum(values):.6f}")
+                lines.append(f"{name}_count{{{labels}}} {len(values)}")
+
+        metric("research_calls_total", "counter", "Model calls by outcome (ok, error, cancelled, cached).")
+        for (stage, model), records in groups.items():
+            for status in ("ok", "error", "cancelled", "cached"):
+                count = sum(1 for r in records if r.status == status)
+                lines.append(f'research_calls_total{{stage="{stage}",model="{model}",status="{status}"}} {count}')
+
+        metric("research_retries_total", "counter", "HTTP retries performed for model calls.")
+        for (stage, model), records in groups.items():
+            lines.append(f'research_retries_total{{stage="{stage}",model="{model}"}} {sum(r.retries for r in records)}')
+
+        metric("research_tokens_total", "counter", "Tokens used by model calls.")
+        for (stage, model), records in groups.items():
+            for kind in ("prompt", "completion", "cached"):
+                count = sum(getattr(r, f"{kind}_tokens") for r in records)
+                lines.append(f'research_tokens_total{{stage="{stage}",model="{model}",kind="{kind}"}} {count}')
+
+        metric("research_cost_usd_total", "counter", "Estimated cost of model calls in USD.")
+        for (stage, model), records in groups.items():
+            lines.append(f'research_cost_usd_total{{stage="{stage}",model="{model}"}} {sum(r.cost for r in records):.6f}')
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str, basename: str = "metrics"):
+        """
+        Writes `<basename>.json` and `<basename>.prom` into `directory`.
+
+        Returns:
+            The paths of the two files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f"{basename}.json")
+        prom_path = os.path.join(directory, f"{basename}.prom")
+        with open(json_path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        return json_path, prom_path
+
+_recorder = MetricsRecorder()
+
+def get_recorder() -> MetricsRecorder:
+    """Returns the process-wide metrics recorder."""
+    return _recorder
+
+def track_call(stage: str, model: str):
+    """Shortcut for get_recorder().track_call(stage, model)."""
+    return _recorder.track_call(stage, model)
+
+def record_cache_hit(stage: str, model: str):
+    """Shortcut for get_recorder().record_cache_hit(stage, model)."""
+    _recorder.record_cache_hit(stage, model)
@@ -0,0 +1,337 @@
+# mock_openai_server.py
+import re
+import json
+import time
+import hashlib
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Set, Tuple
+
+FACETS = [
+    "historical origins and early development of",
+    "economic impact and market trends for",
+    "political and regulatory debates surrounding",
+    "cultural and social consequences of",
+    "scientific research findings on",
+    "regional differences across Asia, Europe and Africa in",
+    "ethical controversies and criticism of",
+    "future outlook and expert forecasts about",
+    "key figures and institutions shaping",
+    "comparative case studies involving",
+]
+
+LOREM = (
+    "Researchers have documented several developments in this area over the past decade. "
+    "Key studies point to measurable effects, while other findings remain contested. "
+    "Regional differences and historical context shape how these results are interpreted. "
+)
+
+class MockServerConfig:
+    """
+    Behaviour of the stand-in server.
+
+    Latency is drawn from a log-normal distribution with the given median and
+    shape (sigma); `model_latency` overrides the median per model. Streaming
+    responses wait for the sampled latency before the first chunk, then emit
+    `chunk_chars` characters every `chunk_interval` seconds.
+
+    Prompt caching is simulated like OpenAI's automatic prefix cache: when a
+    prompt of at least `prompt_cache_min_tokens` starts with messages already
+    sent to the same model, that prefix is reported as cached_tokens (in
+    128-token steps) and the latency shrinks by `cache_latency_discount` times
+    the cached share of the prompt.
+    """
+
+    def __init__(
+        self,
+        latency_median: float = 0.5,
+        latency_sigma: float = 0.3,
+        model_latency: Optional[Dict[str, float]] = None,
+        response_chars: int = 2000,
+        chunk_chars: int = 40,
+        chunk_interval: float = 0.01,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        query_count: int = 8,
+        seed: Optional[int] = None,
+        prompt_cache_min_tokens: int = 1024,
+        cache_latency_discount: float = 0.5,
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.model_latency = model_latency or {}
+        self.response_chars = response_chars
+        self.chunk_chars = chunk_chars
+        self.chunk_interval = chunk_interval
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.query_count = query_count
+        self.prompt_cache_min_tokens = prompt_cache_min_tokens
+        self.cache_latency_discount = cache_latency_discount
+        self._prefixes: Dict[str, Set[str]] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def sample_latency(self, model: str, cached_share: float = 0.0) -> float:
+        median = self.model_latency.get(model, self.latency_median)
+        with self._lock:
+            self.requests += 1
+            latency = median * self._random.lognormvariate(0.0, self.latency_sigma)
+        return latency * (1.0 - self.cache_latency_discount * cached_share)
+
+    def cached_prefix_tokens(self, model: str, messages: list) -> int:
+        """Records the prompt's message prefixes and returns how many of its tokens were seen before."""
+        cached = 0
+        digest = hashlib.sha256()
+        tokens = 0
+        with self._lock:
+            seen = self._prefixes.setdefault(model, set())
+            hit = True
+            for message in messages:
+                digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+                tokens += len(message.get("content") or "") // 4
+                key = digest.hexdigest()
+                if hit and key in seen:
+                    cached = tokens
+                else:
+                    hit = False
+                    seen.add(key)
+        if tokens < self.prompt_cache_min_tokens or cached < self.prompt_cache_min_tokens:
+            return 0
+        return cached // 128 * 128
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+def _filler(chars: int, seed_text: str) -> str:
+    text = (seed_text + " " + LOREM) * (chars // (len(LOREM) + len(seed_text) + 1) + 1)
+    return text[:chars]
+
+def build_response_text(config: MockServerConfig, messages: list) -> str:
+    """
+    Produces plausible content for each pipeline stage, recognised from the
+    system prompt, so the real parsing code downstream is exercised.
+    """
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    if "Search Queries" in system or "search queries" in system:
+        topic = user.rsplit(":", 1)[-1].strip()
+        return "\n".join(
+            f"{i+1}. {FACETS[i % len(FACETS)].capitalize()} {topic}" for i in range(config.query_count)
+        )
+    if "JSON object" in user[:1000]:
+        # Report outline: spread the numbered queries over a few sections
+        numbers = sorted({int(n) for m in messages for n in re.findall(r"^Query (\d+):", m.get("content") or "", re.M)})
+        sections = [
+            {"heading": f"Findings part {i+1}", "focus": "Key findings.", "queries": numbers[i::3]}
+            for i in range(min(3, len(numbers)) or 1)
+        ]
+        return json.dumps({"title": "Research Report", "sections": sections})
+    if "HTML fragment" in system:
+        heading = re.search(r"starts with <h2>(.*?)</h2>", user)
+        body = f"<p>{_filler(config.response_chars // 4, 'Section')}</p>"
+        return f"<h2>{heading.group(1)}</h2>\n{body}" if heading else body
+    # Stage instructions sit in the system prompt or, after a shared corpus, in the last message
+    if "HTML" in system or "HTML" in user[:500]:
+        body = _filler(config.response_chars, "Findings")
+        return f"<h1>Research Report</h1>\n<p>{body}</p>\n<h2>Conclusion</h2>\n<p>Summary.</p>"
+    return _filler(config.response_chars, user[:60])
+
+def _usage(messages: list, content: str, cached_tokens: int = 0) -> dict:
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """Serves /chat/completions and /v1/chat/completions (streaming and non-streaming)."""
+
+    protocol_version = "HTTP/1.1"
+    config: MockServerConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # Hedged duplicates and cancelled requests (e.g. after early stopping) hang
+    # up mid-response; that is expected, so writes to a closed socket are dropped quietly
+    _DISCONNECTS = (BrokenPipeError, ConnectionResetError)
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        except self._DISCONNECTS:
+            self.close_connection = True
+
+    def _write_chunk(self, data: bytes) -> bool:
+        """Writes one chunk of a chunked response; False once the client has disconnected."""
+        try:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+            return True
+        except self._DISCONNECTS:
+            self.close_connection = True
+            return False
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/health", "/v1/health"):
+            self._send_json(200, {"status": "ok", "requests": self.config.requests})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        model = request.get("model", "mock")
+        messages = request.get("messages", [])
+
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        cached_tokens = self.config.cached_prefix_tokens(model, messages)
+        time.sleep(self.config.sample_latency(model, cached_tokens / prompt_tokens if prompt_tokens else 0.0))
+        if self.config.should_fail():
+            headers = {"Retry-After": "1"} if self.config.error_status == 429 else None
+            self._send_json(self.config.error_status, {"error": {"message": "Injected failure", "type": "mock_error"}}, headers)
+            return
+
+        content = build_response_text(self.config, messages)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": _usage(messages, content, cached_tokens),
+            })
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+        except self._DISCONNECTS:
+            self.close_connection = True
+            return
+
+        def event(choices: list, usage: Optional[dict] = None) -> bytes:
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                       "model": model, "choices": choices}
+            if usage is not None:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+        step = max(1, self.config.chunk_chars)
+        for start in range(0, len(content), step):
+            piece = content[start:start + step]
+            if not self._write_chunk(event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])):
+                return
+            time.sleep(self.config.chunk_interval)
+        closing = [event([{"index": 0, "delta": {}, "finish_reason": "stop"}])]
+        if (request.get("stream_options") or {}).get("include_usage"):
+            closing.append(event([], _usage(messages, content, cached_tokens)))
+        for data in closing + [b"data: [DONE]\n\n", b""]:
+            if not self._write_chunk(data):
+                return
+
+def start_mock_server(config: MockServerConfig, host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Starts the mock server on a background thread.
+
+    Args:
+        config: The latency, size and error behaviour to simulate.
+        host: Interface to bind.
+        port: Port to bind; 0 picks a free port.
+
+    Returns:
+        The server (call shutdown() to stop it) and its base URL.
+    """
+    handler = type("ConfiguredMockOpenAIHandler", (MockOpenAIHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Adds the mock server behaviour options to a command-line parser."""
+    parser.add_argument("--latency-median", type=float, default=0.5,
+                        help="Median response latency in seconds (default: 0.5).")
+    parser.add_argument("--latency-sigma", type=float, default=0.3,
+                        help="Log-normal shape of the latency distribution (default: 0.3).")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="Per-model median latency override; may be repeated.")
+    parser.add_argument("--response-chars", type=int, default=2000,
+                        help="Characters per response (default: 2000).")
+    parser.add_argument("--chunk-chars", type=int, default=40,
+                        help="Characters per streamed chunk (default: 40).")
+    parser.add_argument("--chunk-interval", type=float, default=0.01,
+                        help="Seconds between streamed chunks (default: 0.01).")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests that fail (default: 0).")
+    parser.add_argument("--error-status", type=int, default=500,
+                        help="HTTP status of injected failures; 429 also sends Retry-After (default: 500).")
+    parser.add_argument("--query-count", type=int, default=8,
+                        help="Number of queries returned by the query generation stage (default: 8).")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs.")
+    parser.add_argument("--prompt-cache-min-tokens", type=int, default=1024,
+                        help="Smallest prompt eligible for the simulated prefix cache (default: 1024).")
+    parser.add_argument("--cache-latency-discount", type=float, default=0.5,
+                        help="Latency reduction for a fully cached prompt (default: 0.5).")
+
+def config_from_args(args) -> MockServerConfig:
+    """Builds a MockServerConfig from options added by add_config_arguments."""
+    model_latency = {}
+    for item in args.model_latency:
+        model, _, seconds = item.partition("=")
+        model_latency[model] = float(seconds)
+    return MockServerConfig(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        model_latency=model_latency,
+        response_chars=args.response_chars,
+        chunk_chars=args.chunk_chars,
+        chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        query_count=args.query_count,
+        seed=args.seed,
+        prompt_cache_min_tokens=args.prompt_cache_min_tokens,
+        cache_latency_discount=args.cache_latency_discount,
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in server for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server, url = start_mock_server(config_from_args(args), args.host, args.port)
+    print(f"Mock OpenAI/Perplexity server listening on {url}")
+    print(f"Point the agent at it with OPENAI_BASE_URL={url} PERPLEXITY_BASE_URL={url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,280 @@
+# model_router.py
+import re
+import time
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+from metrics import estimate_cost
+
+# Quality checks: results failing them are retried on the next candidate model
+MIN_ROUTED_QUERIES = 3
+MIN_RESEARCH_CHARS = 200
+MIN_ANALYSIS_CHARS = 500
+MIN_REPORT_CHARS = 500
+
+@dataclass
+class Candidate:
+    """A model a stage may use, with the largest input it is trusted with."""
+    model: str
+    # Inputs estimated above this many tokens skip the candidate (None: any size)
+    max_input_tokens: Optional[int] = None
+
+@dataclass
+class StageRoute:
+    """
+    The candidate models of one stage, fastest first, and the stage's budget.
+    A candidate is adequate when the input fits it and its estimated cost
+    stays within `cost_budget`; the last candidate is always adequate.
+    """
+    candidates: List[Candidate]
+    # Seconds one routed call should take; decisions record whether it was met
+    latency_budget: Optional[float] = None
+    # USD per call, estimated from the input size and `output_tokens`
+    cost_budget: Optional[float] = None
+    output_tokens: int = 1000
+
+ROUTING_POLICIES: Dict[str, Dict[str, StageRoute]] = {
+    # One model per stage, as before routing existed
+    "fixed": {
+        "queries": StageRoute([Candidate("gpt-4.1-mini")], latency_budget=10, output_tokens=500),
+        "research": StageRoute([Candidate("sonar")], latency_budget=30),
+        "analysis": StageRoute([Candidate("o3-mini")], latency_budget=120, output_tokens=5000),
+        "report": StageRoute([Candidate("gpt-4.1")], latency_budget=120, output_tokens=3000),
+    },
+    # Smaller, faster models first; escalate on failed checks or inputs too large for them
+    "tiered": {
+        "queries": StageRoute([Candidate("gpt-4.1-nano"), Candidate("gpt-4.1-mini")],
+                              latency_budget=5, output_tokens=500),
+        "research": StageRoute([Candidate("sonar"), Candidate("sonar-pro")], latency_budget=30),
+        "analysis": StageRoute([Candidate("gpt-4.1-mini", max_input_tokens=20000), Candidate("o3-mini")],
+                               latency_budget=60, output_tokens=5000),
+        "report": StageRoute([Candidate("gpt-4.1-mini", max_input_tokens=20000), Candidate("gpt-4.1")],
+                             latency_budget=90, output_tokens=3000),
+    },
+}
+DEFAULT_ROUTING_POLICY = "fixed"
+
+def is_truncated_html(text: str) -> bool:
+    """True when an HTML document or fragment stops mid-tag or before its closing tags."""
+    body = re.sub(r"\s*```\s*$", "", text).rstrip()
+    if not body:
+        return True
+    if "<html" in body.lower() and "</html>" not in body.lower():
+        return True
+    # A model cut off by max_tokens usually stops inside a tag or in running text
+    return body.rfind("<") > body.rfind(">") or not body.endswith(">")
+
+def quality_problem(stage: str, result) -> Optional[str]:
+    """
+    Applies the stage's quality check to a result.
+
+    Returns:
+        A short description of the problem, or None if the result is acceptable.
+    """
+    if result is None:
+        return "no result"
+    if isinstance(result, str) and result.startswith("Error:"):
+        return result[:120]
+    if stage == "queries":
+        if len(result) < MIN_ROUTED_QUERIES:
+            return f"only {len(result)} queries parsed"
+    elif stage == "research":
+        if len(result.strip()) < MIN_RESEARCH_CHARS:
+            return f"answer shorter than {MIN_RESEARCH_CHARS} characters"
+    elif stage == "analysis":
+        if len(result.strip()) < MIN_ANALYSIS_CHARS:
+            return f"analysis shorter than {MIN_ANALYSIS_CHARS} characters"
+    elif stage == "report":
+        if len(result.strip()) < MIN_REPORT_CHARS:
+            return f"report shorter than {MIN_REPORT_CHARS} characters"
+        if is_truncated_html(result):
+            return "truncated HTML"
+    return None
+
+# Attempt latencies per (stage, model) across every router in the process, so
+# that runs routed to small models can be compared with the largest one
+_history: Dict[str, List[float]] = {}
+_history_lock = threading.Lock()
+HISTORY_WINDOW = 200
+
+def _observe(stage: str, model: str, seconds: float):
+    with _history_lock:
+        samples = _history.setdefault(f"{stage}:{model}", [])
+        samples.append(seconds)
+        del samples[:-HISTORY_WINDOW]
+
+def _median_latency(stage: str, model: str) -> Optional[float]:
+    with _history_lock:
+        samples = sorted(_history.get(f"{stage}:{model}", ()))
+    return samples[len(samples) // 2] if samples else None
+
+class ModelRouter:
+    """
+    Picks a model per call from a routing policy and escalates to the next
+    candidate when a call fails or its result fails the stage's quality check.
+    Every decision is recorded with the latency of each attempt.
+    """
+
+    def __init__(self, policy: str = DEFAULT_ROUTING_POLICY, decisions: Optional[List[dict]] = None):
+        if policy not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown routing policy '{policy}'. Expected one of {sorted(ROUTING_POLICIES)}.")
+        self.policy = policy
+        self.routes = ROUTING_POLICIES[policy]
+        # Earlier decisions, e.g. loaded from a run's routing log, are included in the summary
+        self.decisions: List[dict] = list(decisions or [])
+        self._lock = threading.Lock()
+
+    def candidates(self, stage: str, input_tokens: int) -> List[str]:
+        """The adequate models for an input of `input_tokens`, in the order they are tried."""
+        route = self.routes[stage]
+        models = []
+        for candidate in route.candidates[:-1]:
+            if candidate.max_input_tokens is not None and input_tokens > candidate.max_input_tokens:
+                continue
+            cost = estimate_cost(candidate.model, input_tokens, route.output_tokens)
+            if route.cost_budget is not None and cost > route.cost_budget:
+                continue
+            models.append(candidate.model)
+        return models + [route.candidates[-1].model]
+
+    def _attempt_finished(self, stage: str, model: str, started: float, problem: Optional[str],
+                          attempts: List[dict], last: bool):
+        elapsed = time.perf_counter() - started
+        _observe(stage, model, elapsed)
+        attempts.append({"model": model, "latency": round(elapsed, 3), "problem": problem})
+        if problem is not None and not last:
+            print(f"    [routing] {stage}: {model} rejected ({problem}); escalating.")
+
+    def _record(self, stage: str, input_tokens: int, models: List[str], attempts: List[dict]) -> dict:
+        route = self.routes[stage]
+        latency = sum(a["latency"] for a in attempts)
+        decision = {
+            "stage": stage,
+            "policy": self.policy,
+            "input_tokens": input_tokens,
+            "candidates": models,
+            "attempts": attempts,
+            "model": attempts[-1]["model"],
+            "accepted": attempts[-1]["problem"] is None,
+            "escalations": len(attempts) - 1,
+            "latency": round(latency, 3),
+            "within_budget": None if route.latency_budget is None else latency <= route.latency_budget,
+        }
+        with self._lock:
+            self.decisions.append(decision)
+        return decision
+
+    def run(self, stage: str, input_tokens: int, attempt: Callable[[str], object]):
+        """
+        Calls `attempt(model)` for each adequate candidate until a result
+        passes the stage's quality check.
+
+        Args:
+            stage: The stage name ("queries", "research", "analysis" or "report").
+            input_tokens: Estimated input size, which rules out smaller models.
+            attempt: Runs the stage call with the given model and returns its result.
+
+        Returns:
+            The first acceptable result, or the last candidate's result if none passes.
+        """
+        models = self.candidates(stage, input_tokens)
+        attempts: List[dict] = []
+        result = None
+        for position, model in enumerate(models):
+            last = position == len(models) - 1
+            started = time.perf_counter()
+            try:
+                result = attempt(model)
+            except Exception as e:
+                self._attempt_finished(stage, model, started, f"raised {e}", attempts, last)
+                if last:
+                    self._record(stage, input_tokens, models, attempts)
+                    raise
+                continue
+            problem = quality_problem(stage, result)
+            self._attempt_finished(stage, model, started, problem, attempts, last)
+            if problem is None:
+                break
+        self._record(stage, input_tokens, models, attempts)
+        return result
+
+    async def run_async(self, stage: str, input_tokens: int, attempt: Callable[[str], Awaitable]):
+        """Async counterpart of run; `attempt(model)` returns an awaitable."""
+        models = self.candidates(stage, input_tokens)
+        attempts: List[dict] = []
+        result = None
+        for position, model in enumerate(models):
+            last = position == len(models) - 1
+            started = time.perf_counter()
+            try:
+                result = await attempt(model)
+            except Exception as e:
+                self._attempt_finished(stage, model, started, f"raised {e}", attempts, last)
+                if last:
+                    self._record(stage, input_tokens, models, attempts)
+                    raise
+                continue
+            problem = quality_problem(stage, result)
+            self._attempt_finished(stage, model, started, problem, attempts, last)
+            if problem is None:
+                break
+        self._record(stage, input_tokens, models, attempts)
+        return result
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Aggregates the decisions per stage: calls, escalations, time spent on
+        rejected attempts, and the latency saved against the stage's largest
+        model where that model's median latency has been observed in this
+        process (None otherwise). Stages with a single candidate model have no
+        alternative to compare against and carry no 'latency_saved'.
+        """
+        with self._lock:
+            decisions = list(self.decisions)
+        stages: Dict[str, dict] = {}
+        for decision in decisions:
+            stage = decision["stage"]
+            row = stages.setdefault(stage, {"calls": 0, "escalations": 0, "latency": 0.0,
+                                            "rejected_latency": 0.0, "models": {}, "latency_saved": 0.0})
+            row["calls"] += 1
+            row["escalations"] += decision["escalations"]
+            row["latency"] += decision["latency"]
+            row["rejected_latency"] += sum(a["latency"] for a in decision["attempts"][:-1])
+            row["models"][decision["model"]] = row["models"].get(decision["model"], 0) + 1
+            candidates = self.routes[stage].candidates
+            if len(candidates) == 1:
+                row.pop("latency_saved", None)
+                continue
+            baseline = _median_latency(stage, candidates[-1].model)
+            if baseline is None or row["latency_saved"] is None:
+                row["latency_saved"] = None
+            else:
+                row["latency_saved"] += baseline - decision["latency"]
+        for row in stages.values():
+            for key in ("latency", "rejected_latency", "latency_saved"):
+                if row.get(key) is not None:
+                    row[key] = round(row[key], 3)
+        return stages
+
+    def format_summary(self) -> str:
+        """Renders the per-stage summary as plain-text lines."""
+        lines = [f"Model routing ({self.policy}):"]
+        for stage, row in self.summary().items():
+            models = ", ".join(f"{model} x{count}" for model, count in row["models"].items())
+            line = (f"  {stage:<9} {row['calls']} calls ({models}); {row['escalations']} escalations "
+                    f"costing {row['rejected_latency']:.2f}s; latency {row['latency']:.2f}s")
+            if "latency_saved" in row:
+                saved = "n/a" if row["latency_saved"] is None else f"{row['latency_saved']:.2f}s"
+                line += f", saved {saved}"
+            lines.append(line)
+        return "\n".join(lines)
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    router = ModelRouter("tiered")
+    print("Analysis candidates for 5,000 tokens:", router.candidates("analysis", 5000))
+    print("Analysis candidates for 50,000 tokens:", router.candidates("analysis", 50000))
+    # A truncated report from the small model is escalated to the large one
+    drafts = {"gpt-4.1-mini": "<h1>Report</h1><p>" + "x" * 600, "gpt-4.1": "<h1>Report</h1><p>" + "x" * 600 + "</p>"}
+    router.run("report", 5000, lambda model: drafts[model])
+    print(router.format_summary())
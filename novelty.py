@@ -0,0 +1,135 @@
+# novelty.py
+import re
+from typing import Dict, List, Optional, Set
+
+# Marginal novelty below which a result counts as adding little new information
+DEFAULT_NOVELTY_THRESHOLD = 0.25
+# Successful results always collected before stopping early is considered
+DEFAULT_MIN_QUERIES = 3
+# Consecutive low-novelty results required before the remaining queries are skipped
+DEFAULT_PATIENCE = 2
+# Number of words per shingle
+SHINGLE_WORDS = 3
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+def _shingles(text: str) -> Set[int]:
+    words = _NON_WORD.sub(" ", text.lower()).split()
+    if len(words) < SHINGLE_WORDS:
+        return {hash(" ".join(words))} if words else set()
+    return {hash(" ".join(words[i:i + SHINGLE_WORDS])) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+class NoveltyMonitor:
+    """
+    Scores research results for novelty against everything collected so far
+    and decides when further queries are unlikely to add new information.
+
+    Novelty is the share of a result's word shingles not present in any
+    earlier result (1.0 for entirely new text, 0.0 for a repeat). Once at
+    least `min_queries` results are collected, `patience` consecutive results
+    below `threshold` stop the research; reaching `max_queries` results
+    always stops it.
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = DEFAULT_NOVELTY_THRESHOLD,
+        min_queries: int = DEFAULT_MIN_QUERIES,
+        max_queries: Optional[int] = None,
+        patience: int = DEFAULT_PATIENCE,
+    ):
+        self.threshold = threshold
+        self.min_queries = min_queries
+        self.max_queries = max_queries
+        self.patience = max(1, patience)
+        self.seen: Set[int] = set()
+        self.collected = 0
+        self.low_streak = 0
+        self.stopped = False
+        self.reason: Optional[str] = None
+        self.decisions: List[Dict[str, object]] = []
+
+    def score(self, text: str) -> float:
+        """Share of the text's shingles not seen in earlier results."""
+        shingles = _shingles(text)
+        if not shingles:
+            return 0.0
+        return len(shingles - self.seen) / len(shingles)
+
+    def seed(self, text: str):
+        """Adds an already collected result (e.g. from a resumed run) without logging a decision."""
+        self.seen.update(_shingles(text))
+        self.collected += 1
+
+    def observe(self, index: int, query: str, result: str) -> Dict[str, object]:
+        """
+        Scores one incoming result, adds it to the collected text and
+        records whether research should continue.
+
+        Args:
+            index: Position of the query in the query list.
+            query: The query text.
+            result: The research result; "Error: ..." results are logged but not scored.
+
+        Returns:
+            The decision record: query index and text, novelty, results
+            collected so far, and 'decision' ("continue", "stop" or "error").
+        """
+        decision: Dict[str, object] = {"index": index, "query": query, "novelty": None,
+                                       "collected": self.collected, "decision": "error"}
+        if result is None or result.startswith("Error:"):
+            self.decisions.append(decision)
+            return decision
+
+        novelty = self.score(result)
+        self.seen.update(_shingles(result))
+        self.collected += 1
+        if self.threshold is not None and novelty < self.threshold:
+            self.low_streak += 1
+        else:
+            self.low_streak = 0
+
+        decision.update(novelty=round(novelty, 4), collected=self.collected, decision="continue")
+        if not self.stopped:
+            if self.max_queries is not None and self.collected >= self.max_queries:
+                self.stopped, self.reason = True, f"reached the maximum of {self.max_queries} results"
+            elif self.collected >= self.min_queries and self.low_streak >= self.patience:
+                self.stopped = True
+                self.reason = (f"{self.low_streak} consecutive results below novelty "
+                               f"{self.threshold:.2f} after {self.collected} results")
+            if self.stopped:
+                decision["decision"] = "stop"
+                decision["reason"] = self.reason
+        self.decisions.append(decision)
+        print(f"    [novelty] query {index+1}: {novelty:.2f} new "
+              f"({self.collected} collected) -> {decision['decision']}"
+              + (f": {self.reason}" if decision["decision"] == "stop" else ""))
+        return decision
+
+    def to_dict(self) -> Dict[str, object]:
+        """Settings, per-result decisions and the stop reason, for logging and tuning."""
+        return {
+            "threshold": self.threshold,
+            "min_queries": self.min_queries,
+            "max_queries": self.max_queries,
+            "patience": self.patience,
+            "stopped": self.stopped,
+            "reason": self.reason,
+            "decisions": self.decisions,
+        }
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    monitor = NoveltyMonitor(threshold=0.3, min_queries=2)
+    test_results = [
+        "Solar capacity grew 24 percent in 2023, led by China and the European Union.",
+        "Offshore wind auctions stalled in 2023 as interest rates and turbine costs rose.",
+        "Solar capacity grew 24 percent in 2023, led by China and the European Union, analysts said.",
+        "Analysts said solar capacity grew 24 percent in 2023, led by China and the European Union.",
+        "Battery storage deployments doubled, helping grids absorb midday solar output.",
+    ]
+    for i, text in enumerate(test_results):
+        monitor.observe(i, f"query {i+1}", text)
+        if monitor.stopped:
+            print(f"Stopping: {monitor.reason}")
+            break
@@ -1,69 +1,131 @@
 # openai_analyzer.py
-import os
-from dotenv import load_dotenv
-from openai import OpenAI, APIError
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+from clients import get_openai_client
+from response_cache import get_cache, make_cache_key
+from token_budget import estimate_tokens, split_text
+from streaming import StreamProgress, consume_stream
+from metrics import track_call, record_cache_hit
+from research_corpus import ResearchCorpus, render_corpus
+from scheduler import create_completion
 
-# Load environment variables from .env file
-load_dotenv()
+intermediate_analysis_model = "o3-mini"  # Reverted back to o3-mini for analysis
+max_tokens = 5000 # Define max_tokens
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Corpora whose prompt exceeds this many (estimated) tokens are analyzed with map-reduce
+DEFAULT_TOKEN_BUDGET = 60000
+# Target prompt size for each map/reduce call
+CHUNK_TOKEN_BUDGET = 20000
+# Output limit for each partial summary
+PARTIAL_MAX_TOKENS = 2000
+# Maximum number of map/reduce calls in flight at once
+MAX_PARALLEL_CALLS = 8
 
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY not found in environment variables. Please set it in your .env file.")
+# Instructions for the single-call analysis; they follow the shared corpus prefix
+analysis_instructions = (
+    "Task: synthesize the research findings above into a coherent and comprehensive analysis "
+    "of the original topic. Identify key themes, connections, discrepancies, and overall insights. "
+    "Provide a well-structured summary based *only* on the provided research data."
+)
 
-# Initialize OpenAI client specifically for this module
-client = OpenAI(api_key=OPENAI_API_KEY)
+# System prompt for the final merge of map-reduce summaries
+system_prompt = (
+    "You are an expert research analyst. You have been provided with a research topic "
+    "and a series of research findings obtained by querying an AI search assistant. "
+    "Your task is to synthesize these findings into a coherent and comprehensive analysis "
+    "of the original topic. Identify key themes, connections, discrepancies, and overall insights. "
+    "Provide a well-structured summary based *only* on the provided research data."
+)
 
-def analyze_research_openai(topic: str, results: List[Dict[str, str]]) -> str:
-    """
-    Analyzes the collected research results using the OpenAI o3-mini model.
+map_system_prompt = (
+    "You are an expert research analyst. You have been given one portion of the research findings "
+    "collected for a topic. Summarize the key facts, themes, figures, and any discrepancies in this "
+    "portion, keeping the query numbers so findings can be traced back. Be thorough but concise, and "
+    "rely *only* on the provided data. Your summary will later be combined with summaries of the "
+    "other portions."
+)
 
-    Args:
-        topic: The original research topic.
-        results: A list of dictionaries, where each dictionary contains
-                 a 'query' and its corresponding 'result'.
+reduce_system_prompt = (
+    "You are an expert research analyst. You have been given several partial summaries of research "
+    "findings for the same topic. Merge them into a single consolidated summary that keeps every "
+    "distinct fact, theme, and discrepancy, removes repetition, and preserves query numbers. "
+    "Rely *only* on the provided summaries."
+)
+
+def _format_summaries(topic: str, summaries: List[str], heading: str) -> str:
+    """Formats partial summaries into a prompt for the reduce step."""
+    parts = [f"Research Topic: {topic}\n\n{heading}:\n", "="*30 + "\n"]
+    for i, summary in enumerate(summaries):
+        parts.append(f"Summary {i+1}:\n{summary}\n")
+        parts.append("-"*30 + "\n")
+    return "".join(parts)
+
+def _prompt(system: str, user_content: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user_content}
+    ]
+
+def _complete(
+    messages: List[Dict[str, str]],
+    output_tokens: int,
+    progress: Optional[StreamProgress] = None,
+    model: str = intermediate_analysis_model,
+) -> str:
+    """
+    Sends one analysis request to the model, using the response cache.
+    When `progress` is given the response is streamed and reported live.
 
     Returns:
-        A string containing the synthesized analysis from the o3-mini model.
-        Returns an error message string if analysis fails.
+        The response text, or an "Error: ..." string on failure.
     """
-    print("\nSynthesizing research results using OpenAI o3-mini...")
-
-    # Format the results into a single string for the prompt
-    formatted_results = f"Research Topic: {topic}\n\nCollected Research Data:\n"
-    formatted_results += "="*30 + "\n"
-    for i, item in enumerate(results):
-        formatted_results += f"Query {i+1}: {item['query']}\n"
-        formatted_results += f"Result {i+1}:\n{item['result']}\n"
-        formatted_results += "-"*30 + "\n"
-
-    system_prompt = (
-        "You are an expert research analyst. You have been provided with a research topic "
-        "and a series of research findings obtained by querying an AI search assistant. "
-        "Your task is to synthesize these findings into a coherent and comprehensive analysis "
-        "of the original topic. Identify key themes, connections, discrepancies, and overall insights. "
-        "Provide a well-structured summary based *only* on the provided research data."
-    )
+    from openai import APIError
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": formatted_results}
-    ]
+    cache = get_cache()
+    cache_key = make_cache_key("analysis", model, messages, max_tokens=output_tokens)
+    cached = cache.get("analysis", cache_key)
+    if cached is not None:
+        record_cache_hit("analysis", model)
+        print("Using cached analysis.")
+        return cached
 
-    intermediate_analysis_model = "o3-mini"  # Reverted back to o3-mini for analysis
-    max_tokens = 5000 # Define max_tokens
     try:
-        print(f"Calling OpenAI API ({intermediate_analysis_model}) for analysis...")
-        response = client.chat.completions.create(
-            model=intermediate_analysis_model,
-            messages=messages,
-            max_tokens=max_tokens,
-        )
+        print(f"Calling OpenAI API ({model}) for analysis...")
+        client = get_openai_client()
+        if progress is not None:
+            progress.start()
+            with track_call("analysis", model) as call:
+                stream = create_completion(
+                    client,
+                    model=model,
+                    messages=messages,
+                    max_tokens=output_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                analysis_content = consume_stream(stream, progress.update, call.set_usage).strip()
+            progress.finish()
+            if not analysis_content:
+                return "Error: Received empty analysis content."
+            cache.set("analysis", cache_key, analysis_content)
+            return analysis_content
+
+        with track_call("analysis", model) as call:
+            response = create_completion(
+                client,
+                model=model,
+                messages=messages,
+                max_tokens=output_tokens,
+            )
+            call.set_usage(response.usage)
 
         if response.choices and len(response.choices) > 0:
             analysis_content = response.choices[0].message.content
-            return analysis_content.strip() if analysis_content else "Error: Received empty analysis content."
+            if not analysis_content:
+                return "Error: Received empty analysis content."
+            analysis_content = analysis_content.strip()
+            cache.set("analysis", cache_key, analysis_content)
+            return analysis_content
         else:
             return "Error: No analysis choices received from OpenAI."
 
@@ -74,6 +136,143 @@ def analyze_research_openai(topic: str, results: List[Dict[str, str]]) -> str:
         print(f"An unexpected error occurred during analysis: {e}")
         return f"Error: An unexpected error occurred during analysis. {e}"
 
+def _chunk_results(results: List[Dict[str, str]], chunk_budget: int) -> List[List[Dict[str, str]]]:
+    """
+    Packs numbered query/result pairs into chunks of roughly `chunk_budget`
+    tokens, splitting results that are too large on their own.
+    """
+    chunks: List[List[Dict[str, str]]] = []
+    current: List[Dict[str, str]] = []
+    current_tokens = 0
+    for item in results:
+        item_tokens = estimate_tokens(item["query"]) + estimate_tokens(item["result"])
+        if item_tokens > chunk_budget:
+            pieces = split_text(item["result"], chunk_budget - estimate_tokens(item["query"]))
+            parts = [
+                {"number": f"{item['number']} (part {k+1}/{len(pieces)})", "query": item["query"], "result": piece}
+                for k, piece in enumerate(pieces)
+            ]
+        else:
+            parts = [item]
+        for part in parts:
+            part_tokens = estimate_tokens(part["query"]) + estimate_tokens(part["result"])
+            if current and current_tokens + part_tokens > chunk_budget:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _group_summaries(summaries: List[str], chunk_budget: int) -> List[List[str]]:
+    """Groups partial summaries for one reduce level; every group holds at least two."""
+    groups: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for summary in summaries:
+        summary_tokens = estimate_tokens(summary)
+        if len(current) >= 2 and current_tokens + summary_tokens > chunk_budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(summary)
+        current_tokens += summary_tokens
+    if len(current) == 1 and groups:
+        groups[-1].extend(current)
+    elif current:
+        groups.append(current)
+    return groups
+
+def _parallel_complete(system: str, prompts: List[str], output_tokens: int, model: str) -> List[str]:
+    """Runs several analysis requests concurrently, returning results in order."""
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_CALLS, len(prompts))) as executor:
+        return list(executor.map(lambda prompt: _complete(_prompt(system, prompt), output_tokens, model=model), prompts))
+
+def _map_reduce_analysis(
+    topic: str,
+    numbered: List[Dict[str, str]],
+    token_budget: int,
+    chunk_budget: int,
+    progress: Optional[StreamProgress] = None,
+    model: str = intermediate_analysis_model,
+) -> str:
+    """Summarizes chunks in parallel, then merges the summaries level by level."""
+    chunks = _chunk_results(numbered, chunk_budget)
+    print(f"Corpus exceeds the {token_budget}-token budget; summarizing {len(chunks)} chunks in parallel...")
+    summaries = _parallel_complete(
+        map_system_prompt, [render_corpus(topic, chunk) for chunk in chunks], PARTIAL_MAX_TOKENS, model
+    )
+    failed = [s for s in summaries if s.startswith("Error:")]
+    summaries = [s for s in summaries if not s.startswith("Error:")]
+    if failed:
+        print(f"Warning: {len(failed)} of {len(chunks)} chunk summaries failed and were skipped.")
+    if not summaries:
+        return failed[0]
+
+    level = 1
+    while len(summaries) > 1 and estimate_tokens("".join(summaries)) > token_budget:
+        groups = _group_summaries(summaries, chunk_budget)
+        print(f"Reduce level {level}: merging {len(summaries)} summaries into {len(groups)}...")
+        merged = _parallel_complete(
+            reduce_system_prompt,
+            [_format_summaries(topic, group, "Partial Summaries") for group in groups],
+            PARTIAL_MAX_TOKENS,
+            model,
+        )
+        # Keep the unmerged summaries of a group whose merge failed rather than losing them
+        summaries = []
+        for group, result in zip(groups, merged):
+            summaries.extend(group if result.startswith("Error:") else [result])
+        if len(merged) == len(groups) and all(r.startswith("Error:") for r in merged):
+            return merged[0]
+        level += 1
+
+    return _complete(
+        _prompt(system_prompt, _format_summaries(topic, summaries, "Summaries of Collected Research Data")),
+        max_tokens,
+        progress,
+        model,
+    )
+
+def analyze_research_openai(
+    topic: str,
+    results: List[Dict[str, str]],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    chunk_budget: int = CHUNK_TOKEN_BUDGET,
+    progress: Optional[StreamProgress] = None,
+    corpus: Optional[ResearchCorpus] = None,
+    model: str = intermediate_analysis_model,
+) -> str:
+    """
+    Analyzes the collected research results using an OpenAI model (o3-mini by default).
+
+    Corpora that fit within `token_budget` are analyzed in a single call.
+    Larger ones are split into chunks that are summarized in parallel, and the
+    partial summaries are merged hierarchically into the final analysis.
+
+    Args:
+        topic: The original research topic.
+        results: A list of dictionaries, where each dictionary contains
+                 a 'query' and its corresponding 'result'.
+        token_budget: Maximum estimated prompt size for a single analysis call.
+        chunk_budget: Target estimated prompt size for each map/reduce call.
+        progress: Optional progress display; when given, the final analysis
+                  call is streamed and its time to first token recorded.
+        corpus: The run's already rendered corpus, shared with the report
+                stage; built from `topic` and `results` when omitted.
+        model: The OpenAI model used for every analysis call.
+
+    Returns:
+        A string containing the synthesized analysis from the model.
+        Returns an error message string if analysis fails.
+    """
+    print(f"\nSynthesizing research results using OpenAI {model}...")
+
+    corpus = corpus or ResearchCorpus(topic, results)
+    if corpus.tokens <= token_budget:
+        return _complete(corpus.messages(analysis_instructions), max_tokens, progress, model)
+    return _map_reduce_analysis(topic, corpus.results, token_budget, chunk_budget, progress, model)
+
 # Example Usage (optional, for testing this module directly)
 if __name__ == "__main__":
     test_topic = "Impact of AI on Climate Change Mitigation"
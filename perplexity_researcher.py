@@ -1,31 +1,34 @@
 # perplexity_researcher.py
-import os
-from dotenv import load_dotenv
-from openai import OpenAI, APIError, Timeout
+import time
+import asyncio
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from clients import get_perplexity_client, get_async_perplexity_client
+from response_cache import get_cache, make_cache_key
+from metrics import track_call, record_cache_hit
+from research_memory import get_memory
+from scheduler import create_completion, create_completion_async
+from token_budget import estimate_tokens
 
-# Load environment variables from .env file
-load_dotenv()
+# Defaults for the concurrent research path
+DEFAULT_MAX_CONCURRENCY = 5
+DEFAULT_TIMEOUT = 60.0
 
-PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
-
-if not PERPLEXITY_API_KEY:
-    raise ValueError("PERPLEXITY_API_KEY not found in environment variables. Please set it in your .env file.")
-
-# Initialize the Perplexity client using the OpenAI library structure
-# Point the base_url to the Perplexity API endpoint
-client = OpenAI(api_key=PERPLEXITY_API_KEY, base_url="https://api.perplexity.ai")
-
-def research_query_perplexity(query: str) -> str:
+def _build_messages(query: str, context: Optional[List[Dict[str, object]]] = None) -> list:
     """
-    Performs research on a given query using the Perplexity API (sonar model).
-
-    Args:
-        query: The research query string.
-
-    Returns:
-        The research result from the Perplexity model.
+    Builds the chat messages sent to Perplexity for a single query, with
+    related findings from earlier runs appended as background when given.
     """
-    messages = [
+    content = query
+    if context:
+        parts = [query, "\n\nBackground from earlier research (may be outdated):\n"]
+        for entry in context:
+            collected = datetime.fromtimestamp(entry["created_at"]).strftime("%Y-%m-%d")
+            parts.append(f"- Earlier query ({collected}): {entry['query']}\n  Findings: {entry['result']}\n")
+        parts.append("\nAnswer the query fully. Verify and update the background where needed, "
+                     "and prioritize new or more recent information.")
+        content = "".join(parts)
+    return [
         {
             "role": "system",
             "content": (
@@ -35,28 +38,134 @@ def research_query_perplexity(query: str) -> str:
         },
         {
             "role": "user",
-            "content": query,
+            "content": content,
         },
     ]
 
+def _consult_memory(query: str) -> Tuple[Optional[str], Optional[list]]:
+    """
+    Looks the query up in the research memory.
+
+    Returns:
+        A reusable earlier result (and None), or None and the messages to send,
+        which carry related earlier findings as background when there are any.
+    """
+    found = get_memory().lookup(query)
+    reuse = found["reuse"]
+    if reuse is not None:
+        record_cache_hit("research", "memory")
+        age_days = (time.time() - reuse["created_at"]) / (24 * 60 * 60)
+        print(f"    Reusing research from memory ({age_days:.1f} days old): {reuse['query']}")
+        return reuse["result"], None
+    if found["context"]:
+        print(f"    Adding {len(found['context'])} related earlier findings as background.")
+    return None, _build_messages(query, found["context"])
+
+def _extract_content(response) -> str:
+    """Extracts the answer text from a Perplexity chat completion response."""
+    if response.choices and len(response.choices) > 0:
+        # Check if message content is not None before stripping
+        content = response.choices[0].message.content
+        return content.strip() if content else "Error: Received empty response content."
+    else:
+        return "Error: No response choices received."
+
+def research_query_perplexity(query: str, model: str = "sonar") -> str:
+    """
+    Performs research on a given query using the Perplexity API (sonar model by default).
+
+    Args:
+        query: The research query string.
+        model: The Perplexity model to use.
+
+    Returns:
+        The research result from the Perplexity model.
+    """
+    from openai import APIError
+
+    remembered, messages = _consult_memory(query)
+    if remembered is not None:
+        return remembered
+    cache = get_cache()
+    cache_key = make_cache_key("research", model, messages)
+    cached = cache.get("research", cache_key)
+    if cached is not None:
+        record_cache_hit("research", model)
+        print(f"    Using cached Perplexity result.")
+        return cached
+
     try:
         print(f"    Sending query to Perplexity API...")
-        # Use the 'sonar' model as requested.
         # Add a timeout (e.g., 60 seconds) to the API call
-        response = client.chat.completions.create(
-            model="sonar", # Using the specific 'sonar' model identifier
-            messages=messages,
-            timeout=60.0 # Added timeout 
-        )
+        with track_call("research", model) as call:
+            response = create_completion(
+                get_perplexity_client(),
+                model=model,
+                messages=messages,
+                timeout=DEFAULT_TIMEOUT # Added timeout 
+            )
+            call.set_usage(response.usage)
         print(f"    Received response from Perplexity API.")
         # Extract the content from the response
-        if response.choices and len(response.choices) > 0:
-            # Check if message content is not None before stripping
-            content = response.choices[0].message.content
-            return content.strip() if content else "Error: Received empty response content."
-        else:
-            return "Error: No response choices received."
+        result = _extract_content(response)
+        if not result.startswith("Error:"):
+            cache.set("research", cache_key, result)
+            get_memory().add(query, result)
+        return result
+
+    except APIError as e:
+        print(f"Perplexity API error: {e}")
+        return f"Error: Failed to get response from Perplexity API. {e}"
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return f"Error: An unexpected error occurred. {e}"
+
+async def research_query_perplexity_async(query: str, timeout: float = DEFAULT_TIMEOUT, model: str = "sonar") -> str:
+    """
+    Async counterpart of research_query_perplexity.
+
+    Args:
+        query: The research query string.
+        timeout: Upper bound in seconds for the whole request, including
+                 any retries performed by the scheduler.
+        model: The Perplexity model to use.
+
+    Returns:
+        The research result from the Perplexity model, or an "Error: ..." string.
+    """
+    from openai import APIError
+
+    remembered, messages = _consult_memory(query)
+    if remembered is not None:
+        return remembered
+    cache = get_cache()
+    cache_key = make_cache_key("research", model, messages)
+    cached = cache.get("research", cache_key)
+    if cached is not None:
+        record_cache_hit("research", model)
+        return cached
 
+    try:
+        with track_call("research", model) as call:
+            response = await asyncio.wait_for(
+                create_completion_async(
+                    get_async_perplexity_client(),
+                    model=model,
+                    messages=messages,
+                    timeout=timeout,
+                ),
+                timeout=timeout,
+            )
+            call.set_usage(response.usage)
+        result = _extract_content(response)
+        if not result.startswith("Error:"):
+            cache.set("research", cache_key, result)
+            get_memory().add(query, result)
+        return result
+
+    except asyncio.TimeoutError:
+        print(f"Perplexity request timed out after {timeout:.0f}s: {query}")
+        return f"Error: Perplexity request timed out after {timeout:.0f} seconds."
     except APIError as e:
         print(f"Perplexity API error: {e}")
         return f"Error: Failed to get response from Perplexity API. {e}"
@@ -64,6 +173,75 @@ def research_query_perplexity(query: str) -> str:
         print(f"An unexpected error occurred: {e}")
         return f"Error: An unexpected error occurred. {e}"
 
+async def research_queries_perplexity_async(
+    queries: List[str],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    timeout: float = DEFAULT_TIMEOUT,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    on_result: Optional[Callable[[int, str], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    router=None,
+) -> List[Optional[str]]:
+    """
+    Researches several queries concurrently against the Perplexity API.
+
+    At most `max_concurrency` requests are in flight at once, so the total
+    wall-clock time is close to the slowest single query rather than the sum.
+
+    Args:
+        queries: The research query strings.
+        max_concurrency: Maximum number of simultaneous requests.
+        timeout: Per-request timeout in seconds.
+        semaphore: Optional semaphore shared with other callers; overrides
+                   `max_concurrency` when given.
+        on_result: Optional callback invoked with (index, result) as soon as
+                   each query finishes, e.g. to checkpoint it.
+        should_stop: Optional predicate checked before each request is sent and
+                     after each result; once it returns True, queries not yet
+                     sent are skipped and those in flight are cancelled.
+        router: Optional ModelRouter choosing the model for each query and
+                escalating failed or too short answers.
+
+    Returns:
+        The research results, in the same order as `queries`; None for
+        queries skipped or cancelled through `should_stop`.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    total = len(queries)
+
+    tasks: List[asyncio.Task] = []
+
+    async def _run(index: int, query: str) -> Optional[str]:
+        async with semaphore:
+            if should_stop is not None and should_stop():
+                return None
+            print(f"    [{index+1}/{total}] Sending query to Perplexity API...")
+            if router is None:
+                result = await research_query_perplexity_async(query, timeout=timeout)
+            else:
+                result = await router.run_async(
+                    "research", estimate_tokens(query),
+                    lambda model: research_query_perplexity_async(query, timeout=timeout, model=model),
+                )
+            print(f"    [{index+1}/{total}] Received response from Perplexity API.")
+        if on_result is not None:
+            on_result(index, result)
+        if should_stop is not None and should_stop():
+            current = asyncio.current_task()
+            for task in tasks:
+                if task is not current:
+                    task.cancel()
+        return result
+
+    tasks.extend(asyncio.ensure_future(_run(i, q)) for i, q in enumerate(queries))
+    # gather() preserves the order of its arguments, not completion order
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError):
+            raise result
+    return [None if isinstance(result, asyncio.CancelledError) else result for result in results]
+
 # Example Usage (optional, can be run directly)
 if __name__ == "__main__":
     test_query = "What are the latest advancements in AI for drug discovery?"
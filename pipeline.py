@@ -0,0 +1,413 @@
+# pipeline.py
+import os
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from generate_research_queries import generate_queries
+from perplexity_researcher import (
+    research_query_perplexity,
+    research_queries_perplexity_async,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_TIMEOUT,
+)
+from openai_analyzer import analyze_research_openai
+from report_generator import generate_html_report, stream_html_report
+from sectioned_report import generate_sectioned_report, DEFAULT_SECTION_WORKERS
+from research_corpus import ResearchCorpus
+from streaming import StreamProgress
+from query_dedup import DEFAULT_SIMILARITY_THRESHOLD
+from novelty import NoveltyMonitor, DEFAULT_MIN_QUERIES
+from corpus_compaction import compact_results, DEFAULT_SIMILARITY_THRESHOLD as DEFAULT_COMPACTION_THRESHOLD
+from run_store import RunStore, is_error
+from model_router import ModelRouter, DEFAULT_ROUTING_POLICY
+from token_budget import estimate_tokens
+from clients import run_async
+
+@dataclass
+class PipelineOptions:
+    """Settings shared by every stage of a research run."""
+    sequential: bool = False
+    concurrency: int = DEFAULT_MAX_CONCURRENCY
+    timeout: float = DEFAULT_TIMEOUT
+    dedup_threshold: Optional[float] = DEFAULT_SIMILARITY_THRESHOLD
+    stream: bool = True
+    # Early stopping: skip the remaining queries once results stop adding new information
+    novelty_threshold: Optional[float] = None
+    min_queries: int = DEFAULT_MIN_QUERIES
+    max_queries: Optional[int] = None
+    compact: bool = True
+    compaction_threshold: float = DEFAULT_COMPACTION_THRESHOLD
+    # "single" writes the report in one completion; "sections" writes an outline, then sections in parallel
+    report_mode: str = "single"
+    section_workers: int = DEFAULT_SECTION_WORKERS
+    # "fixed" uses one model per stage; "tiered" tries faster models first and escalates on failed checks
+    model_routing: str = DEFAULT_ROUTING_POLICY
+    reports_dir: str = "generated_reports"
+    # Called with (event, data) as stages start and finish and as each query completes
+    on_event: Optional[Callable[[str, dict], None]] = None
+
+def notify(options: PipelineOptions, event: str, **data):
+    """Reports a progress event to the options' listener, if any."""
+    if options.on_event is not None:
+        options.on_event(event, data)
+
+def print_result_preview(result: str):
+    """Prints a truncated preview of a research result."""
+    print("Result Preview:")
+    # Limit printing potentially long results to console
+    print(result[:300] + ('...' if len(result) > 300 else ''))
+
+def report_filepath(topic: str, reports_dir: str = "generated_reports", run_id: Optional[str] = None) -> str:
+    """
+    Builds the output path for a topic's report under `reports_dir`. The run
+    ID (which starts with the run's creation time) replaces the timestamp, so
+    concurrent runs of the same topic, or of topics that sanitize to the same
+    name, never overwrite each other's reports.
+    """
+    safe_topic = "".join(c if c.isalnum() else '_' for c in topic)
+    suffix = run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+    base_filename = f"research_report_{safe_topic}_{suffix}.html"
+    # Construct the full path
+    return os.path.join(reports_dir, base_filename)
+
+def _save_routing(store: RunStore, router: ModelRouter):
+    """Appends the router's decisions to the run's routing log."""
+    if router.decisions:
+        store.save_routing_log(store.load_routing_log() + router.decisions)
+
+def run_query_stage(store: RunStore, options: PipelineOptions) -> List[str]:
+    """Generates the research queries, or loads them from a previous attempt."""
+    queries = store.load_queries()
+    if queries:
+        print(f"\nLoaded {len(queries)} queries from run {store.run_id}.")
+        return queries
+
+    print(f"\nGenerating research queries for: {store.topic}...")
+    router = ModelRouter(options.model_routing)
+    queries = router.run(
+        "queries",
+        estimate_tokens(store.topic),
+        lambda model: generate_queries(store.topic, similarity_threshold=options.dedup_threshold, model=model),
+    )
+    _save_routing(store, router)
+    if queries:
+        store.save_queries(queries)
+    return queries
+
+def _research_sequential(
+    store: RunStore,
+    queries: List[str],
+    pending: List[int],
+    options: PipelineOptions,
+    monitor: Optional[NoveltyMonitor] = None,
+    router: Optional[ModelRouter] = None,
+):
+    """Researches the pending queries one at a time, checkpointing each result."""
+    router = router or ModelRouter(options.model_routing)
+    for i in pending:
+        if monitor is not None and monitor.stopped:
+            break
+        print(f"\n[{i+1}/{len(queries)}] Researching query: {queries[i]}")
+        result = router.run(
+            "research", estimate_tokens(queries[i]), lambda model: research_query_perplexity(queries[i], model)
+        )
+        store.save_result(i, queries[i], result)
+        notify(options, "query_finished", index=i, query=queries[i], ok=not is_error(result))
+        print_result_preview(result)
+        if monitor is not None:
+            monitor.observe(i, queries[i], result)
+        print("-"*40) # Separator
+
+async def _research_concurrent(
+    store: RunStore,
+    queries: List[str],
+    pending: List[int],
+    options: PipelineOptions,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    monitor: Optional[NoveltyMonitor] = None,
+    router: Optional[ModelRouter] = None,
+):
+    """
+    Researches the pending queries concurrently, checkpointing each result as
+    it arrives. With a novelty monitor, results are scored in completion order
+    and the remaining queries are skipped or cancelled once it stops.
+    """
+    pending_queries = [queries[i] for i in pending]
+
+    def on_result(position: int, result: str):
+        store.save_result(pending[position], pending_queries[position], result)
+        notify(options, "query_finished", index=pending[position], query=pending_queries[position],
+               ok=not is_error(result))
+        if monitor is not None:
+            monitor.observe(pending[position], pending_queries[position], result)
+
+    await research_queries_perplexity_async(
+        pending_queries,
+        max_concurrency=options.concurrency,
+        timeout=options.timeout,
+        semaphore=semaphore,
+        on_result=on_result,
+        should_stop=(lambda: monitor.stopped) if monitor is not None else None,
+        router=router or ModelRouter(options.model_routing),
+    )
+
+def _novelty_disabled(options: PipelineOptions) -> bool:
+    return options.novelty_threshold is None and options.max_queries is None
+
+def _skipped_queries(store: RunStore, options: PipelineOptions) -> List[int]:
+    """
+    Queries an earlier attempt skipped by early stopping. They stay skipped
+    only while early stopping runs with the same settings; otherwise they are
+    researched like any other pending query.
+    """
+    log = store.load_novelty_log() or {}
+    settings = (options.novelty_threshold, options.min_queries, options.max_queries)
+    if _novelty_disabled(options) or (log.get("threshold"), log.get("min_queries"), log.get("max_queries")) != settings:
+        return []
+    return log.get("skipped", [])
+
+def _pending_queries(store: RunStore, queries: List[str], options: PipelineOptions) -> List[int]:
+    """Indices of queries without a successful checkpointed result, excluding queries skipped by early stopping."""
+    skipped = set(_skipped_queries(store, options))
+    pending = [i for i, _ in enumerate(queries)
+               if i not in skipped and is_error((store.load_result(i) or {}).get("result"))]
+    if len(pending) < len(queries) - len(skipped):
+        print(f"\nReusing {len(queries) - len(skipped) - len(pending)} completed results from run {store.run_id}.")
+    return pending
+
+def _novelty_monitor(store: RunStore, queries: List[str], options: PipelineOptions) -> Optional[NoveltyMonitor]:
+    """Creates the early-stopping monitor, seeded with results already collected, if enabled."""
+    if _novelty_disabled(options):
+        return None
+    monitor = NoveltyMonitor(options.novelty_threshold, options.min_queries, options.max_queries)
+    for i in range(len(queries)):
+        result = (store.load_result(i) or {}).get("result")
+        if not is_error(result):
+            monitor.seed(result)
+    return monitor
+
+def _save_novelty_log(store: RunStore, pending: List[int], monitor: Optional[NoveltyMonitor]):
+    """Records the monitor's decisions and the queries it skipped in the run directory."""
+    if monitor is None:
+        return
+    skipped = [i for i in pending if store.load_result(i) is None]
+    store.save_novelty_log({**monitor.to_dict(), "skipped": skipped})
+    if monitor.stopped:
+        print(f"\nStopped research early ({monitor.reason}); skipped {len(skipped)} queries.")
+
+def collect_results(store: RunStore, queries: List[str]) -> List[Dict[str, str]]:
+    """
+    Query/result pairs in query order, each with its query 'number' (from 1);
+    queries skipped by early stopping have none, so numbers may have gaps.
+    """
+    results = ((i, store.load_result(i)) for i in range(len(queries)))
+    return [{**item, "number": i + 1} for i, item in results if item is not None]
+
+def run_research_stage(store: RunStore, queries: List[str], options: PipelineOptions) -> List[Dict[str, str]]:
+    """
+    Researches every query that has no successful checkpointed result yet.
+
+    Returns:
+        The query/result pairs for all queries, in query order.
+    """
+    pending = _pending_queries(store, queries, options)
+
+    if pending:
+        print(f"\nResearching {len(pending)} of {len(queries)} queries...")
+        monitor = _novelty_monitor(store, queries, options)
+        router = ModelRouter(options.model_routing)
+        if options.sequential:
+            _research_sequential(store, queries, pending, options, monitor, router)
+        else:
+            try:
+                print(f"Running up to {options.concurrency} queries concurrently...")
+                run_async(_research_concurrent(store, queries, pending, options, monitor=monitor, router=router))
+                for i in pending:
+                    item = store.load_result(i)
+                    if item is None:
+                        continue
+                    print(f"\n[{i+1}/{len(queries)}] Query: {queries[i]}")
+                    print_result_preview(item["result"])
+                    print("-"*40) # Separator
+            except Exception as e:
+                print(f"\nConcurrent research failed ({e}). Falling back to sequential research...")
+                retry = [i for i in pending if is_error((store.load_result(i) or {}).get("result"))]
+                _research_sequential(store, queries, retry, options, monitor, router)
+        _save_novelty_log(store, pending, monitor)
+        _save_routing(store, router)
+
+    print("\nResearch complete.")
+    return collect_results(store, queries)
+
+async def run_research_stage_async(
+    store: RunStore,
+    queries: List[str],
+    options: PipelineOptions,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> List[Dict[str, str]]:
+    """
+    Async variant of run_research_stage for callers that already run an event
+    loop, e.g. to share one request semaphore between several runs.
+    """
+    pending = _pending_queries(store, queries, options)
+    if pending:
+        print(f"\n[{store.run_id}] Researching {len(pending)} of {len(queries)} queries...")
+        monitor = _novelty_monitor(store, queries, options)
+        router = ModelRouter(options.model_routing)
+        await _research_concurrent(store, queries, pending, options, semaphore, monitor, router)
+        _save_novelty_log(store, pending, monitor)
+        _save_routing(store, router)
+    return collect_results(store, queries)
+
+def build_corpus(store: RunStore, results: List[Dict[str, str]], options: PipelineOptions) -> ResearchCorpus:
+    """
+    Renders the research corpus shared by the analysis and report prompts,
+    first dropping duplicate and near-duplicate text across results unless
+    compaction is disabled. Checkpoints keep the raw results.
+    """
+    if options.compact:
+        results, report = compact_results(results, options.compaction_threshold)
+        print(f"\nCorpus compaction removed {report['paragraphs_removed']} paragraphs and "
+              f"{report['sentences_removed']} sentences, saving ~{report['tokens_saved']} of "
+              f"{report['tokens_before']} prompt tokens.")
+    return ResearchCorpus(store.topic, results)
+
+def run_analysis_stage(store: RunStore, corpus: ResearchCorpus, options: PipelineOptions) -> Optional[str]:
+    """Runs the intermediate analysis unless a successful one is already checkpointed."""
+    intermediate_analysis = store.load_analysis()
+    if not is_error(intermediate_analysis):
+        print(f"\nLoaded intermediate analysis from run {store.run_id}.")
+        return intermediate_analysis
+
+    router = ModelRouter(options.model_routing)
+    try:
+        print("\nStarting intermediate analysis...")
+        analysis_progress = None
+
+        def analyze(model: str) -> str:
+            nonlocal analysis_progress
+            analysis_progress = StreamProgress("Analysis") if options.stream else None
+            return analyze_research_openai(
+                store.topic, corpus.results, progress=analysis_progress, corpus=corpus, model=model
+            )
+
+        intermediate_analysis = router.run("analysis", corpus.tokens, analyze)
+        if analysis_progress is not None and analysis_progress.ttft is not None:
+            print(f"Analysis time to first token: {analysis_progress.ttft:.2f}s")
+        print(f"\nIntermediate Analysis (from {router.decisions[-1]['model']}) Preview:")
+        print("="*40)
+        if intermediate_analysis:
+             print(intermediate_analysis[:500] + ('...' if len(intermediate_analysis) > 500 else ''))
+        else:
+             print("No analysis content generated.")
+        print("="*40)
+    except Exception as e:
+        print(f"\nError during OpenAI analysis: {e}")
+        return None
+    finally:
+        _save_routing(store, router)
+
+    if is_error(intermediate_analysis):
+        return None
+    store.save_analysis(intermediate_analysis)
+    return intermediate_analysis
+
+def run_report_stage(store: RunStore, corpus: ResearchCorpus, analysis: str, options: PipelineOptions) -> Optional[str]:
+    """
+    Generates the final HTML report and saves it under the reports directory.
+
+    Returns:
+        The report path, or None if the report could not be generated.
+    """
+    filepath = report_filepath(store.topic, options.reports_dir, store.run_id)
+    router = ModelRouter(options.model_routing)
+    # Streamed attempts are written to a draft per model; only the draft of
+    # the report the router settles on is renamed to `filepath`
+    drafts: Dict[str, str] = {}
+
+    def write_report(model: str) -> str:
+        if options.report_mode == "sections":
+            return generate_sectioned_report(
+                store.topic, corpus.results, analysis, corpus, max_workers=options.section_workers, model=model
+            )
+        if options.stream:
+            report_progress = StreamProgress("Report")
+            drafts[model] = f"{filepath}.{model}.draft"
+            report = stream_html_report(
+                store.topic, corpus.results, analysis, drafts[model], report_progress, corpus, model
+            )
+            if not is_error(report) and report_progress.ttft is not None:
+                print(f"Report time to first token: {report_progress.ttft:.2f}s")
+            return report
+        print("\nGenerating final HTML report...")
+        return generate_html_report(store.topic, corpus.results, analysis, corpus, model)
+
+    try:
+        report = router.run("report", corpus.tokens + estimate_tokens(analysis), write_report)
+        if not is_error(report):
+            chosen = router.decisions[-1]["model"]
+            if chosen in drafts:
+                os.replace(drafts.pop(chosen), filepath)
+            else:
+                # Create the directory if it doesn't exist
+                os.makedirs(options.reports_dir, exist_ok=True)
+                with open(filepath, 'w', encoding='utf-8') as f: # Use the full filepath
+                    f.write(report)
+    except Exception as e:
+        print(f"\nError during report generation: {e}")
+        return None
+    finally:
+        # Drafts of rejected or failed attempts never become the report
+        for draft in drafts.values():
+            if os.path.exists(draft):
+                os.remove(draft)
+        _save_routing(store, router)
+
+    if is_error(report):
+        print(f"\n{report}")
+        print("\nFinal report could not be generated, so it was not saved.")
+        return None
+    store.save_report_path(filepath)
+    print(f"\nFinal research report saved to {filepath}")
+    return filepath
+
+def run_pipeline(store: RunStore, options: PipelineOptions) -> Optional[str]:
+    """
+    Runs (or resumes) every stage of a research run, skipping stages whose
+    output is already checkpointed in `store`.
+
+    Returns:
+        The path of the final report, or None if the run did not complete.
+    """
+    if store.report_path:
+        print(f"\nRun {store.run_id} is already complete: {store.report_path}")
+        return store.report_path
+
+    notify(options, "stage_started", stage="queries")
+    queries = run_query_stage(store, options)
+    notify(options, "stage_finished", stage="queries", ok=bool(queries), queries=queries or [])
+    if not queries:
+        print("Failed to generate queries. Exiting.")
+        return None
+
+    notify(options, "stage_started", stage="research", total=len(queries))
+    results = run_research_stage(store, queries, options)
+    notify(options, "stage_finished", stage="research", ok=True,
+           succeeded=sum(1 for item in results if not is_error(item["result"])))
+    # Rendered once and shared, so both prompts start with the same cacheable prefix
+    corpus = build_corpus(store, results, options)
+
+    notify(options, "stage_started", stage="analysis")
+    analysis = run_analysis_stage(store, corpus, options)
+    notify(options, "stage_finished", stage="analysis", ok=analysis is not None)
+    if analysis is None:
+        print("\nSkipping final report generation due to analysis failure.")
+        return None
+
+    notify(options, "stage_started", stage="report")
+    report_path = run_report_stage(store, corpus, analysis, options)
+    notify(options, "stage_finished", stage="report", ok=report_path is not None, report_path=report_path)
+    print("\n" + ModelRouter(options.model_routing, store.load_routing_log()).format_summary())
+    return report_path
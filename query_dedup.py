@@ -0,0 +1,179 @@
+# query_dedup.py
+import re
+import numpy as np
+from typing import Dict, List, Tuple
+
+# Cosine similarity above which two queries are treated as paraphrases. Shingle
+# similarity stays high for queries differing in one word ("advantages" and
+# "disadvantages"), so only near-identical wordings qualify
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+# Length of the character shingles used to compare queries
+SHINGLE_SIZE = 3
+
+# Words that do not change what a query asks
+STOPWORDS = frozenset(
+    "a an and are as at be by do does for from how in into is it its of on or over "
+    "the their this to under what which why with within".split()
+)
+# Suffixes stripped so that inflections ("warming", "warms") count as one term
+_SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "es", "ed", "s")
+
+# Two similar queries are never merged when only one of them contains a number
+# or one of these words: they ask the opposite or a differently scoped question
+NEGATIONS = frozenset("not no non without never against lack".split())
+POLARITY_WORDS = (
+    "advantages disadvantages benefits drawbacks pros cons positive negative risks opportunities "
+    "increase decrease growth decline success failure"
+).split()
+# Prefixes that turn a word into its opposite ("advantages" and "disadvantages")
+NEGATING_PREFIXES = ("dis", "un", "non", "anti", "counter", "in", "im", "ir", "il")
+
+def _stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if len(word) - len(suffix) >= 4 and word.endswith(suffix):
+            return word[: -len(suffix)]
+    return word
+
+def content_terms(text: str) -> frozenset:
+    """The stemmed non-stopword words and the numbers of a query."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return frozenset(word if word.isdigit() else _stem(word) for word in words if word not in STOPWORDS)
+
+_POLARITY_TERMS = frozenset(_stem(word) for word in POLARITY_WORDS)
+
+def merge_veto(first: str, second: str) -> bool:
+    """
+    True when two queries differ in a number or a polarity word, however
+    similar their wording ("2023"/"2024", "advantages"/"disadvantages", "not").
+    """
+    difference = content_terms(first) ^ content_terms(second)
+    for term in difference:
+        if term.isdigit() or term in NEGATIONS or term in _POLARITY_TERMS:
+            return True
+        for other in difference:
+            if other != term and term.endswith(other) and term[: -len(other)] in NEGATING_PREFIXES:
+                return True
+    return False
+
+def _shingles(text: str, size: int = SHINGLE_SIZE) -> List[str]:
+    """Splits normalized text into overlapping character shingles."""
+    normalized = " " + re.sub(r"[^a-z0-9]+", " ", text.lower()).strip() + " "
+    if len(normalized) <= size:
+        return [normalized]
+    return [normalized[i:i + size] for i in range(len(normalized) - size + 1)]
+
+def similarity_matrix(texts: List[str]) -> np.ndarray:
+    """
+    Computes pairwise TF-IDF cosine similarity over character shingles.
+
+    Args:
+        texts: The strings to compare.
+
+    Returns:
+        An (n, n) array of cosine similarities in [0, 1].
+    """
+    vocabulary: Dict[str, int] = {}
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        for shingle in _shingles(text):
+            rows.append(row)
+            cols.append(vocabulary.setdefault(shingle, len(vocabulary)))
+
+    counts = np.zeros((len(texts), max(len(vocabulary), 1)), dtype=np.float64)
+    np.add.at(counts, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), 1.0)
+
+    # Smoothed IDF so shingles shared by every query (the topic words) count for less
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1.0 + len(texts)) / (1.0 + document_frequency)) + 1.0
+    weights = counts * idf
+
+    norms = np.linalg.norm(weights, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    weights /= norms
+    return np.clip(weights @ weights.T, 0.0, 1.0)
+
+def deduplicate_queries(
+    queries: List[str],
+    threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+) -> Tuple[List[str], List[Dict[str, object]]]:
+    """
+    Removes near-duplicate queries, keeping the first of each group. A query
+    is merged into the most similar surviving query at or above `threshold`,
+    unless the two differ in a number or a polarity word (see merge_veto).
+
+    Args:
+        queries: The candidate queries, in priority order.
+        threshold: Cosine similarity at or above which a query is merged
+                   into an earlier, surviving query.
+
+    Returns:
+        A tuple of the surviving queries (in their original order) and a
+        list of merge records, each with the 'dropped' query, the 'kept'
+        query it was merged into and their 'similarity'.
+    """
+    if len(queries) < 2:
+        return list(queries), []
+
+    similarities = similarity_matrix(queries)
+    kept_indices: List[int] = []
+    merged: List[Dict[str, object]] = []
+    for i in range(len(queries)):
+        candidates = [k for k in kept_indices if not merge_veto(queries[k], queries[i])]
+        if candidates:
+            scores = similarities[i, candidates]
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                merged.append({
+                    "dropped": queries[i],
+                    "kept": queries[candidates[best]],
+                    "similarity": round(float(scores[best]), 3),
+                })
+                continue
+        kept_indices.append(i)
+
+    return [queries[i] for i in kept_indices], merged
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    test_queries = [
+        "Impact of climate change on polar bear habitats",
+        "Climate change impact on polar bear habitats",
+        "Effects of global warming on Arctic ecosystems",
+        "Polar bear population trends in relation to climate variability",
+        "Conservation strategies for polar bears in a warming climate",
+        "Strategies for conserving polar bears as the climate warms",
+    ]
+    surviving, merges = deduplicate_queries(test_queries)
+    print("Surviving queries:")
+    for q in surviving:
+        print(f"  - {q}")
+    print("Merged:")
+    for record in merges:
+        print(f"  - \"{record['dropped']}\" -> \"{record['kept']}\" (similarity {record['similarity']})")
+
+    # Regression check: paraphrases merge at a lower threshold, queries that
+    # differ in a number or polarity never merge, and queries differing in a
+    # subject word stay apart at the default threshold
+    paraphrase = ("Conservation strategies for polar bears in a warming climate",
+                  "Strategies for conserving polar bears as the climate warms")
+    kept, _ = deduplicate_queries(list(paraphrase), 0.5)
+    assert len(kept) == 1, f"'{paraphrase[1]}' was not merged into '{paraphrase[0]}' at threshold 0.5"
+    vetoed_pairs = [
+        ("Advantages of nuclear power", "Disadvantages of nuclear power"),
+        ("Electric vehicle adoption rates in 2023", "Electric vehicle adoption rates in 2024"),
+        ("Is nuclear power safe", "Is nuclear power not safe"),
+    ]
+    for first, second in vetoed_pairs:
+        kept, _ = deduplicate_queries([first, second], 0.0)
+        assert len(kept) == 2, f"'{second}' was merged into '{first}'"
+    distinct_pairs = [
+        ("Economic impact of remote work on small businesses",
+         "Environmental impact of remote work on small businesses"),
+        ("Long-term effects of social media use on teenagers",
+         "Short-term effects of social media use on teenagers"),
+        ("Healthcare costs in the United States", "Healthcare costs in the United Kingdom"),
+    ]
+    for first, second in distinct_pairs:
+        kept, _ = deduplicate_queries([first, second])
+        assert len(kept) == 2, f"'{second}' was merged into '{first}' at the default threshold"
+    print("Regression check passed.")
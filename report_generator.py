@@ -1,24 +1,18 @@
 # report_generator.py
-import os
-from dotenv import load_dotenv
-from openai import OpenAI, APIError
-from typing import List, Dict
+from typing import List, Dict, Optional
+from clients import get_openai_client
+from response_cache import get_cache, make_cache_key
+from streaming import StreamProgress, AtomicFileWriter, consume_stream
+from metrics import track_call, record_cache_hit
+from research_corpus import ResearchCorpus
+from scheduler import create_completion
+from model_router import quality_problem
 
-# Load environment variables from .env file
-load_dotenv()
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY not found in environment variables. Please set it in your .env file.")
-
-# Initialize OpenAI client specifically for this module
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-system_prompt = (
-    "You are an expert research writer tasked with creating a detailed and well-structured research report in HTML format. "
-    "You have been provided with the original research topic, a preliminary analysis/synthesis of research findings, "
-    "and the raw query-result pairs from the research phase.\n\n" 
+# Instructions for the report; they follow the corpus shared with the analysis stage
+report_instructions = (
+    "Task: you are now acting as an expert research writer creating a detailed and well-structured research report "
+    "in HTML format. Above are the raw query-result pairs from the research phase; below is a preliminary "
+    "analysis/synthesis of those findings.\n\n"
     "Your goal is to synthesize ALL of this information into a comprehensive research report formatted as a single HTML document. "
     "The report should:\n"
     "1. Have a clear title, perhaps using an <h1> tag based on the topic.\n"
@@ -31,53 +25,102 @@ system_prompt = (
     "8. Use appropriate HTML tags (e.g., <p>, <ul>, <li>, <strong>) for structure and readability. Ensure valid HTML."
 )
 
-def generate_html_report(topic: str, results: List[Dict[str, str]], analysis: str) -> str:
+def _build_request(
+    topic: str,
+    results: List[Dict[str, str]],
+    analysis: str,
+    corpus: Optional[ResearchCorpus] = None,
+    model: str = "gpt-4.1",
+) -> dict:
+    """
+    Builds the chat completion request for the final report. The shared
+    corpus comes first and the run-specific analysis last, so the prefix
+    matches the analysis prompt.
     """
-    Generates a detailed research report in HTML format using GPT-4.1.
+    corpus = corpus or ResearchCorpus(topic, results)
+    instructions = "".join([
+        report_instructions,
+        "\n\nIntermediate Analysis (from previous step):\n",
+        "-"*20 + "\n",
+        analysis + "\n",
+        "-"*20 + "\n",
+    ])
+    messages = corpus.messages(instructions)
+
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.6, # Balanced temperature for structured yet natural writing
+        "max_tokens": 3000, # Allow ample space for a detailed report
+        "top_p": 1,
+    }
+
+def generate_html_report(
+    topic: str,
+    results: List[Dict[str, str]],
+    analysis: str,
+    corpus: Optional[ResearchCorpus] = None,
+    model: str = "gpt-4.1",
+) -> str:
+    """
+    Generates a detailed research report in HTML format using GPT-4.1 (or `model`).
 
     Args:
         topic: The original research topic.
         results: A list of dictionaries, where each dictionary contains
                  a 'query' and its corresponding 'result'.
         analysis: The synthesized analysis previously generated by o3-mini.
+        corpus: The run's already rendered corpus; built from `topic` and
+                `results` when omitted.
+        model: The OpenAI model that writes the report.
 
     Returns:
         A string containing the final research report in HTML format.
         Returns an error message string if report generation fails.
     """
-    print("\nGenerating final research report (HTML) using OpenAI GPT-4.1...")
-
-    # Format the input data for the final prompt
-    formatted_input = f"Research Topic: {topic}\n\n"
-    formatted_input += "Intermediate Analysis (from previous step):\n"
-    formatted_input += "-"*20 + "\n"
-    formatted_input += analysis + "\n"
-    formatted_input += "-"*20 + "\n\n"
-    
-    formatted_input += "Raw Research Data (Query-Result pairs):\n"
-    formatted_input += "="*30 + "\n"
-    for i, item in enumerate(results):
-        formatted_input += f"Query {i+1}: {item['query']}\n"
-        formatted_input += f"Result {i+1}:\n{item['result']}\n"
-        formatted_input += "-"*30 + "\n"
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": formatted_input}
-    ]
+    print(f"\nGenerating final research report (HTML) using OpenAI {model}...")
+    return complete_report_request(_build_request(topic, results, analysis, corpus, model), check_report=True)
+
+def _cacheable_report(report: str) -> bool:
+    # A report the router would reject (too short, truncated) is not cached, so
+    # a rerun does not get it back and escalate again
+    return quality_problem("report", report) is None
+
+def complete_report_request(request: dict, check_report: bool = False) -> str:
+    """
+    Sends one non-streaming report-stage request, using the response cache.
+
+    Args:
+        request: Keyword arguments for chat.completions.create.
+        check_report: Cache the response only if it passes the router's
+                      report check (for complete reports, not fragments).
+
+    Returns:
+        The response text, or an "Error: ..." string on failure.
+    """
+    from openai import APIError
+
+    cache = get_cache()
+    cache_key = make_cache_key("report", **request)
+    cached = cache.get("report", cache_key)
+    if cached is not None:
+        record_cache_hit("report", request["model"])
+        print("Using cached report.")
+        return cached
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4.1", # Using the requested GPT-4.1 model
-            messages=messages,
-            temperature=0.6, # Balanced temperature for structured yet natural writing
-            max_tokens=3000, # Allow ample space for a detailed report
-            top_p=1,
-        )
+        with track_call("report", request["model"]) as call:
+            response = create_completion(get_openai_client(), **request)
+            call.set_usage(response.usage)
 
         if response.choices and len(response.choices) > 0:
             report_content = response.choices[0].message.content
-            return report_content.strip() if report_content else "Error: Received empty report content."
+            if not report_content:
+                return "Error: Received empty report content."
+            report_content = report_content.strip()
+            if not check_report or _cacheable_report(report_content):
+                cache.set("report", cache_key, report_content)
+            return report_content
         else:
             return "Error: No report choices received from OpenAI."
 
@@ -88,6 +131,86 @@ def generate_html_report(topic: str, results: List[Dict[str, str]], analysis: st
         print(f"An unexpected error occurred during report generation: {e}")
         return f"Error: An unexpected error occurred during report generation. {e}"
 
+def stream_html_report(
+    topic: str,
+    results: List[Dict[str, str]],
+    analysis: str,
+    filepath: str,
+    progress: Optional[StreamProgress] = None,
+    corpus: Optional[ResearchCorpus] = None,
+    model: str = "gpt-4.1",
+) -> str:
+    """
+    Generates the HTML report like generate_html_report, but streams it into
+    `filepath` as it is produced. The report is written to a temporary file
+    that is renamed into place once the stream completes, so `filepath` only
+    ever holds a complete report.
+
+    Args:
+        topic: The original research topic.
+        results: A list of dictionaries, where each dictionary contains
+                 a 'query' and its corresponding 'result'.
+        analysis: The synthesized analysis previously generated by o3-mini.
+        filepath: Where to save the finished report.
+        progress: Optional progress display; its ttft records the time to first token.
+        corpus: The run's already rendered corpus; built from `topic` and
+                `results` when omitted.
+        model: The OpenAI model that writes the report.
+
+    Returns:
+        The report HTML, or an error message string if generation fails
+        (in which case nothing is written to `filepath`).
+    """
+    from openai import APIError
+
+    print(f"\nStreaming final research report (HTML) using OpenAI {model}...")
+
+    request = _build_request(topic, results, analysis, corpus, model)
+    cache = get_cache()
+    cache_key = make_cache_key("report", **request)
+    cached = cache.get("report", cache_key)
+    if cached is not None:
+        record_cache_hit("report", request["model"])
+        print("Using cached report.")
+        with AtomicFileWriter(filepath) as writer:
+            writer.write(cached)
+        return cached
+
+    progress = progress or StreamProgress("Report")
+    try:
+        with AtomicFileWriter(filepath) as writer, track_call("report", request["model"]) as call:
+            progress.start()
+            stream = create_completion(
+                get_openai_client(), stream=True, stream_options={"include_usage": True}, **request
+            )
+            started = False
+
+            def on_text(text: str):
+                nonlocal started
+                progress.update(text)
+                if not started:
+                    # Match the non-streaming path, which strips leading whitespace
+                    text = text.lstrip()
+                    started = bool(text)
+                if text:
+                    writer.write(text)
+
+            report_content = consume_stream(stream, on_text, call.set_usage).strip()
+            progress.finish()
+            if not report_content:
+                raise ValueError("Received empty report content.")
+
+        if _cacheable_report(report_content):
+            cache.set("report", cache_key, report_content)
+        return report_content
+
+    except APIError as e:
+        print(f"\nOpenAI API error during report generation: {e}")
+        return f"Error: Failed to generate report from OpenAI API. {e}"
+    except Exception as e:
+        print(f"\nAn unexpected error occurred during report generation: {e}")
+        return f"Error: An unexpected error occurred during report generation. {e}"
+
 # Example Usage (optional, for testing this module directly)
 if __name__ == "__main__":
     test_topic = "AI in Education"
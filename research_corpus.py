@@ -0,0 +1,71 @@
+# research_corpus.py
+from typing import Dict, List
+from token_budget import estimate_tokens
+
+# System message shared by every prompt that carries the full research corpus.
+# Keeping it (and the corpus message after it) byte-identical across stages lets
+# providers with automatic prompt caching reuse the prefix; stage-specific
+# instructions always come after the corpus.
+corpus_system_prompt = (
+    "You are an expert research analyst and writer. You will be given a research topic "
+    "and a series of research findings obtained by querying an AI search assistant, "
+    "numbered by query. Everything you write must be based *only* on these findings. "
+    "The task to perform follows the findings."
+)
+
+def render_corpus(topic: str, results: List[Dict[str, str]], heading: str = "Collected Research Data") -> str:
+    """
+    Formats query/result pairs into prompt text.
+
+    Args:
+        topic: The research topic.
+        results: Dictionaries with a 'query' and 'result'; an optional
+                 'number' overrides the position-based query number.
+        heading: Title of the data section.
+
+    Returns:
+        The formatted corpus.
+    """
+    # Collect the pieces and join once; repeated += is quadratic for large corpora
+    parts = [f"Research Topic: {topic}\n\n{heading}:\n", "="*30 + "\n"]
+    for i, item in enumerate(results):
+        number = item.get("number", i+1)
+        parts.append(f"Query {number}: {item['query']}\n")
+        parts.append(f"Result {number}:\n{item['result']}\n")
+        parts.append("-"*30 + "\n")
+    return "".join(parts)
+
+class ResearchCorpus:
+    """
+    The query/result pairs of one run, rendered once and shared by the
+    analysis and report prompts.
+    """
+
+    def __init__(self, topic: str, results: List[Dict[str, str]]):
+        self.topic = topic
+        self.results = [
+            {"number": item.get("number", i+1), "query": item["query"], "result": item["result"]}
+            for i, item in enumerate(results)
+        ]
+        self.text = render_corpus(topic, self.results)
+        self.tokens = estimate_tokens(self.text)
+
+    def messages(self, instructions: str) -> List[Dict[str, str]]:
+        """
+        Builds chat messages that start with the shared, cacheable prefix
+        (system message and corpus) and end with the stage's instructions.
+        """
+        return [
+            {"role": "system", "content": corpus_system_prompt},
+            {"role": "user", "content": self.text},
+            {"role": "user", "content": instructions},
+        ]
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    corpus = ResearchCorpus("AI in Education", [
+        {"query": "AI tutoring systems effectiveness", "result": "Studies show AI tutors can improve test scores..."},
+        {"query": "AI for personalized learning paths", "result": "AI analyzes student data to adapt curriculum..."},
+    ])
+    print(corpus.text)
+    print(f"~{corpus.tokens} tokens")
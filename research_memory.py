@@ -0,0 +1,283 @@
+# research_memory.py
+import os
+import re
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+from response_cache import get_cache, DEFAULT_TTLS
+
+# Directory (relative to the working directory) holding the memory database
+DEFAULT_MEMORY_DIR = ".research_cache"
+# Upper bound on stored query/result pairs; the least recently used are evicted beyond it
+DEFAULT_MAX_ENTRIES = 50000
+DAY = 24 * 60 * 60
+# Prior results younger than this can be returned instead of calling Perplexity.
+# Reuse is also capped at the response cache's research TTL, so the memory
+# never serves an answer the cache already considers stale
+DEFAULT_REUSE_MAX_AGE = DEFAULT_TTLS["research"]
+# Prior results younger than this can be supplied as background context
+DEFAULT_CONTEXT_MAX_AGE = 30 * DAY
+# Share of the new query's content words a prior query must contain to serve as context
+DEFAULT_CONTEXT_COVERAGE = 0.5
+# Number of prior results supplied as context, and their length limit in characters
+CONTEXT_ENTRIES = 2
+CONTEXT_CHARS = 1500
+# Candidates fetched from the full-text index per lookup, and query terms searched
+CANDIDATES = 20
+MAX_QUERY_TERMS = 16
+
+# "use": consult and extend the memory. "store": only record new results. "off": neither.
+MEMORY_MODES = ("use", "store", "off")
+# Memory mode implied by each response cache mode: refreshing the cache must not
+# serve remembered results, and bypassing it must not read or write the memory
+CACHE_MEMORY_MODES = {"use": "use", "refresh": "store", "bypass": "off"}
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "into", "is", "it",
+    "its", "of", "on", "or", "than", "that", "the", "their", "to", "vs", "what", "when", "which",
+    "who", "why", "with",
+}
+
+def content_terms(text: str) -> List[str]:
+    """Lower-cased words of `text` without stopwords, in order of first appearance."""
+    terms = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word not in STOPWORDS and word not in terms:
+            terms.append(word)
+    return terms
+
+class ResearchMemory:
+    """
+    Persistent full-text index of past research query/result pairs, shared by
+    every run and topic. Lookups rank stored queries with SQLite FTS5 BM25.
+
+    A prior result whose query has exactly the same content words, in the
+    same order, as the new one and is younger than `reuse_max_age` (and the
+    research cache TTL) replaces the Perplexity call. Near matches may ask
+    something different ("benefits" and "drawbacks", another country or
+    year, "US on China" and "China on US"), so they are only returned as
+    background context. The table is capped at `max_entries` by least-recent use, so
+    index size and lookup time stay bounded.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_MEMORY_DIR,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        reuse_max_age: float = DEFAULT_REUSE_MAX_AGE,
+        context_max_age: float = DEFAULT_CONTEXT_MAX_AGE,
+        context_coverage: float = DEFAULT_CONTEXT_COVERAGE,
+        mode: str = "use",
+    ):
+        if mode not in MEMORY_MODES:
+            raise ValueError(f"Unknown memory mode '{mode}'. Expected one of {MEMORY_MODES}.")
+        self.directory = directory
+        self.max_entries = max_entries
+        self.reuse_max_age = reuse_max_age
+        self.context_max_age = context_max_age
+        self.context_coverage = context_coverage
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened lazily so that "off" mode never touches the disk
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, "memory.sqlite3")
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " id INTEGER PRIMARY KEY,"
+                " query TEXT NOT NULL UNIQUE,"
+                " result TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            # External-content index over the queries only: the text lives once, in
+            # `entries`, and the index stays small however long the results are
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5("
+                " query, content='entries', content_rowid='id', tokenize='porter unicode61')"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN"
+                " INSERT INTO entries_fts (rowid, query) VALUES (new.id, new.query); END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN"
+                " INSERT INTO entries_fts (entries_fts, rowid, query) VALUES ('delete', old.id, old.query); END"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _similar(self, query: str, max_age: float) -> List[Dict[str, object]]:
+        """Fresh stored pairs whose query shares a content word with `query`, best BM25 match first."""
+        terms = content_terms(query)[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        rows = self._connect().execute(
+            "SELECT e.id, e.query, e.result, e.created_at, bm25(entries_fts) AS score"
+            " FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid"
+            " WHERE entries_fts MATCH ? AND e.created_at >= ?"
+            " ORDER BY score LIMIT ?",
+            (match, time.time() - max_age, CANDIDATES),
+        ).fetchall()
+        return [{"id": r[0], "query": r[1], "result": r[2], "created_at": r[3], "score": r[4]} for r in rows]
+
+    def _reuse_max_age(self) -> float:
+        ttl = get_cache().ttls.get("research")
+        return self.reuse_max_age if ttl is None else min(self.reuse_max_age, ttl)
+
+    def lookup(self, query: str) -> Dict[str, object]:
+        """
+        Consults the memory before a query is researched.
+
+        Args:
+            query: The research query about to be sent.
+
+        Returns:
+            A dict with 'reuse' (a prior result to use instead of calling
+            Perplexity, or None) and 'context' (prior query/result pairs
+            related to the query, possibly empty).
+        """
+        found: Dict[str, object] = {"reuse": None, "context": []}
+        if self.mode != "use":
+            return found
+        ordered = content_terms(query)
+        terms = set(ordered)
+        reuse_max_age = self._reuse_max_age()
+        with self._lock:
+            candidates = self._similar(query, max(reuse_max_age, self.context_max_age))
+            now = time.time()
+            context = []
+            for candidate in candidates:
+                stored_ordered = content_terms(candidate["query"])
+                stored = set(stored_ordered)
+                if not terms or not stored:
+                    continue
+                overlap = len(terms & stored)
+                age = now - candidate["created_at"]
+                # Word order matters for reuse: "impact of US on China" is not "impact of China on US"
+                if stored_ordered == ordered and age <= reuse_max_age:
+                    found["reuse"] = candidate
+                    break
+                if overlap / len(terms) >= self.context_coverage and age <= self.context_max_age:
+                    context.append(candidate)
+            used = [found["reuse"]] if found["reuse"] else context[:CONTEXT_ENTRIES]
+            if used:
+                self._connect().executemany(
+                    "UPDATE entries SET last_used = ? WHERE id = ?", [(now, entry["id"]) for entry in used]
+                )
+        if found["reuse"] is None:
+            found["context"] = [
+                {"query": entry["query"], "result": entry["result"][:CONTEXT_CHARS], "created_at": entry["created_at"]}
+                for entry in context[:CONTEXT_ENTRIES]
+            ]
+        return found
+
+    def add(self, query: str, result: str):
+        """
+        Records a successful research result, replacing any earlier result
+        for the same query and evicting the least recently used entries
+        beyond `max_entries`.
+        """
+        if self.mode == "off" or result.startswith("Error:"):
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Delete then insert so the FTS delete trigger sees the old text
+                conn.execute("DELETE FROM entries WHERE query = ?", (query,))
+                conn.execute(
+                    "INSERT INTO entries (query, result, created_at, last_used) VALUES (?, ?, ?, ?)",
+                    (query, result, now, now),
+                )
+                excess = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM entries WHERE id IN (SELECT id FROM entries ORDER BY last_used ASC LIMIT ?)",
+                        (excess,),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        """Removes every stored result."""
+        with self._lock:
+            self._connect().execute("DELETE FROM entries")
+
+_memory = None
+_memory_lock = threading.Lock()
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def get_memory() -> ResearchMemory:
+    """
+    Returns the process-wide research memory, creating it on first use.
+
+    The memory is configured from the environment: RESEARCH_MEMORY_DIR,
+    RESEARCH_MEMORY_MODE (use/store/off), RESEARCH_MEMORY_MAX_ENTRIES and
+    RESEARCH_MEMORY_REUSE_DAYS / RESEARCH_MEMORY_CONTEXT_DAYS. Without
+    RESEARCH_MEMORY_MODE, the mode follows RESEARCH_CACHE_MODE.
+    """
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = ResearchMemory(
+                directory=os.getenv("RESEARCH_MEMORY_DIR", DEFAULT_MEMORY_DIR),
+                max_entries=int(_env_float("RESEARCH_MEMORY_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                reuse_max_age=_env_float("RESEARCH_MEMORY_REUSE_DAYS", DEFAULT_REUSE_MAX_AGE / DAY) * DAY,
+                context_max_age=_env_float("RESEARCH_MEMORY_CONTEXT_DAYS", DEFAULT_CONTEXT_MAX_AGE / DAY) * DAY,
+                mode=memory_mode_for(os.getenv("RESEARCH_CACHE_MODE"), os.getenv("RESEARCH_MEMORY_MODE")) or "use",
+            )
+        return _memory
+
+def memory_mode_for(cache_mode: Optional[str], memory_mode: Optional[str] = None) -> Optional[str]:
+    """
+    The memory mode to run with: `memory_mode` if it was given explicitly,
+    otherwise the one implied by the response cache mode (None: unchanged).
+    """
+    return memory_mode or CACHE_MEMORY_MODES.get(cache_mode or "")
+
+def configure_memory(mode: Optional[str] = None, directory: Optional[str] = None):
+    """
+    Overrides the process-wide memory settings, e.g. from command-line flags.
+
+    Args:
+        mode: One of MEMORY_MODES.
+        directory: Directory holding the memory database.
+    """
+    global _memory
+    memory = get_memory()
+    with _memory_lock:
+        _memory = ResearchMemory(
+            directory=directory or memory.directory,
+            max_entries=memory.max_entries,
+            reuse_max_age=memory.reuse_max_age,
+            context_max_age=memory.context_max_age,
+            context_coverage=memory.context_coverage,
+            mode=mode or memory.mode,
+        )
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    demo_memory = ResearchMemory(directory=DEFAULT_MEMORY_DIR)
+    demo_memory.add("Economic impact of tidal power in Europe", "Tidal projects in France and the UK ...")
+    for demo_query in ("Economic impact of tidal power in Europe", "Economic impact of tidal power in Asia"):
+        start = time.perf_counter()
+        demo_found = demo_memory.lookup(demo_query)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{demo_query!r}: reuse={demo_found['reuse'] is not None}, "
+              f"context={len(demo_found['context'])} entries ({elapsed:.2f} ms)")
@@ -0,0 +1,217 @@
+# response_cache.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+# Directory (relative to the working directory) holding the cache database
+DEFAULT_CACHE_DIR = ".research_cache"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# How long a cached response stays valid for each pipeline stage, in seconds.
+# Research results go stale fastest since Perplexity searches the live web.
+DEFAULT_TTLS = {
+    "queries": 7 * DAY,
+    "research": 1 * DAY,
+    "analysis": 30 * DAY,
+    "report": 30 * DAY,
+}
+
+# "use": read and write the cache.
+# "refresh": skip reads but store fresh responses, overwriting old entries.
+# "bypass": neither read nor write.
+CACHE_MODES = ("use", "refresh", "bypass")
+
+def make_cache_key(stage: str, model: str, messages: list, **params) -> str:
+    """
+    Builds a content-addressed key for a model request.
+
+    Args:
+        stage: The pipeline stage issuing the request.
+        model: The model identifier.
+        messages: The chat messages sent to the model.
+        **params: Sampling parameters (temperature, max_tokens, ...).
+
+    Returns:
+        A hex SHA-256 digest of the canonical JSON form of the request.
+    """
+    payload = {"stage": stage, "model": model, "messages": messages, "params": params}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """SQLite-backed response cache with per-stage TTLs and LRU eviction."""
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttls: Optional[Dict[str, float]] = None,
+        mode: str = "use",
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{mode}'. Expected one of {CACHE_MODES}.")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened lazily so that bypass mode never touches the disk
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, "responses.sqlite3")
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " stage TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, stage: str, key: str) -> Optional[str]:
+        """
+        Looks up a cached response.
+
+        Args:
+            stage: The pipeline stage, used to pick the TTL.
+            key: A key produced by make_cache_key.
+
+        Returns:
+            The cached response text, or None on a miss, an expired entry,
+            or when reads are disabled by the cache mode.
+        """
+        if self.mode != "use":
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            ttl = self.ttls.get(stage)
+            if ttl is not None and now - created_at > ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, stage: str, key: str, value: str):
+        """
+        Stores a response, evicting least recently used entries if the cache
+        grows beyond its size cap.
+
+        Args:
+            stage: The pipeline stage that produced the response.
+            key: A key produced by make_cache_key.
+            value: The response text.
+        """
+        if self.mode == "bypass":
+            return
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, stage, value, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, stage, value, size, now, now),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def clear(self):
+        """Removes every cached response."""
+        with self._lock:
+            self._connect().execute("DELETE FROM responses")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _ttls_from_env() -> Dict[str, float]:
+    ttls = {}
+    for stage in DEFAULT_TTLS:
+        value = os.getenv(f"RESEARCH_CACHE_TTL_{stage.upper()}")
+        if value:
+            ttls[stage] = float(value)
+    return ttls
+
+def get_cache() -> ResponseCache:
+    """
+    Returns the process-wide response cache, creating it on first use.
+
+    The cache is configured from the environment:
+    RESEARCH_CACHE_DIR, RESEARCH_CACHE_MODE (use/refresh/bypass),
+    RESEARCH_CACHE_MAX_MB and RESEARCH_CACHE_TTL_<STAGE> (seconds).
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                directory=os.getenv("RESEARCH_CACHE_DIR", DEFAULT_CACHE_DIR),
+                max_bytes=int(float(os.getenv("RESEARCH_CACHE_MAX_MB", DEFAULT_MAX_BYTES / (1024 * 1024))) * 1024 * 1024),
+                ttls=_ttls_from_env(),
+                mode=os.getenv("RESEARCH_CACHE_MODE", "use"),
+            )
+        return _cache
+
+def configure_cache(mode: Optional[str] = None, directory: Optional[str] = None):
+    """
+    Overrides the process-wide cache settings, e.g. from command-line flags.
+
+    Args:
+        mode: One of CACHE_MODES.
+        directory: Directory holding the cache database.
+    """
+    global _cache
+    cache = get_cache()
+    with _cache_lock:
+        _cache = ResponseCache(
+            directory=directory or cache.directory,
+            max_bytes=cache.max_bytes,
+            ttls=cache.ttls,
+            mode=mode or cache.mode,
+        )
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    demo_cache = ResponseCache(directory=DEFAULT_CACHE_DIR)
+    demo_key = make_cache_key("queries", "gpt-4.1-mini", [{"role": "user", "content": "hello"}], temperature=0.7)
+    demo_cache.set("queries", demo_key, "cached response")
+    start = time.perf_counter()
+    print(f"Cache hit: {demo_cache.get('queries', demo_key)!r} in {(time.perf_counter() - start) * 1000:.2f} ms")
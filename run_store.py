@@ -0,0 +1,132 @@
+# run_store.py
+import os
+import json
+import uuid
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Directory (relative to the working directory) holding one sub-directory per run
+DEFAULT_RUNS_DIR = "runs"
+
+def is_error(text: Optional[str]) -> bool:
+    """Returns True for missing output or the "Error: ..." strings the stages return on failure."""
+    return text is None or text.startswith("Error:")
+
+def _write_atomic(path: str, text: str):
+    # A unique temp file per writer: two workers holding the same task (a lease
+    # reclaimed from a worker that is still alive) must not share one
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+class RunStore:
+    """
+    Persists the output of each pipeline stage under runs/<run_id>/ so that an
+    interrupted run can be resumed without repeating completed work.
+
+    Layout:
+        meta.json          topic, creation time and final report path
+        queries.json       generated research queries
+        results/NNNN.json  one query/result pair per research query
+        analysis.md        intermediate analysis
+        novelty.json       novelty scores and early-stopping decisions of the research stage
+        routing.json       model routing decisions of every stage
+    """
+
+    def __init__(self, run_id: str, runs_dir: str = DEFAULT_RUNS_DIR):
+        self.run_id = run_id
+        self.directory = os.path.join(runs_dir, run_id)
+        self.results_dir = os.path.join(self.directory, "results")
+        self._meta = json.loads(_read(os.path.join(self.directory, "meta.json")) or "{}")
+
+    @classmethod
+    def create(cls, topic: str, runs_dir: str = DEFAULT_RUNS_DIR) -> "RunStore":
+        """Creates a new run directory for `topic` with a fresh run ID."""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        run_id = f"{timestamp}_{uuid.uuid4().hex[:6]}"
+        store = cls(run_id, runs_dir)
+        os.makedirs(store.results_dir, exist_ok=True)
+        store._meta = {"run_id": run_id, "topic": topic, "created_at": datetime.now().isoformat()}
+        store._save_meta()
+        return store
+
+    @classmethod
+    def open(cls, run_id: str, runs_dir: str = DEFAULT_RUNS_DIR) -> "RunStore":
+        """
+        Opens an existing run.
+
+        Raises:
+            FileNotFoundError: If no run with this ID exists.
+        """
+        store = cls(run_id, runs_dir)
+        if not store._meta:
+            raise FileNotFoundError(f"No run '{run_id}' found in {runs_dir}/.")
+        os.makedirs(store.results_dir, exist_ok=True)
+        return store
+
+    @property
+    def topic(self) -> str:
+        return self._meta["topic"]
+
+    def _save_meta(self):
+        _write_atomic(os.path.join(self.directory, "meta.json"), json.dumps(self._meta, indent=2))
+
+    def load_queries(self) -> Optional[List[str]]:
+        text = _read(os.path.join(self.directory, "queries.json"))
+        return json.loads(text) if text is not None else None
+
+    def save_queries(self, queries: List[str]):
+        _write_atomic(os.path.join(self.directory, "queries.json"), json.dumps(queries, indent=2))
+
+    def _result_path(self, index: int) -> str:
+        return os.path.join(self.results_dir, f"{index:04d}.json")
+
+    def load_result(self, index: int) -> Optional[Dict[str, str]]:
+        text = _read(self._result_path(index))
+        return json.loads(text) if text is not None else None
+
+    def save_result(self, index: int, query: str, result: str):
+        _write_atomic(self._result_path(index), json.dumps({"query": query, "result": result}, indent=2))
+
+    def load_novelty_log(self) -> Optional[dict]:
+        text = _read(os.path.join(self.directory, "novelty.json"))
+        return json.loads(text) if text is not None else None
+
+    def save_novelty_log(self, log: dict):
+        _write_atomic(os.path.join(self.directory, "novelty.json"), json.dumps(log, indent=2))
+
+    def load_routing_log(self) -> List[dict]:
+        text = _read(os.path.join(self.directory, "routing.json"))
+        return json.loads(text) if text is not None else []
+
+    def save_routing_log(self, log: List[dict]):
+        _write_atomic(os.path.join(self.directory, "routing.json"), json.dumps(log, indent=2))
+
+    def load_analysis(self) -> Optional[str]:
+        return _read(os.path.join(self.directory, "analysis.md"))
+
+    def save_analysis(self, analysis: str):
+        _write_atomic(os.path.join(self.directory, "analysis.md"), analysis)
+
+    @property
+    def report_path(self) -> Optional[str]:
+        """Path of the finished report, if the report stage has completed."""
+        path = self._meta.get("report_path")
+        return path if path and os.path.exists(path) else None
+
+    def save_report_path(self, path: str):
+        self._meta["report_path"] = path
+        self._save_meta()
@@ -0,0 +1,545 @@
+# scheduler.py
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+from token_budget import estimate_tokens
+
+# Directory (relative to the working directory) holding the shared limiter state
+DEFAULT_SCHEDULER_DIR = ".research_cache"
+
+# Requests and tokens per minute for each model (None: unlimited). Limits are
+# opt-in, since account limits vary by tier: set
+# RESEARCH_RATE_LIMITS="model=RPM:TPM,..." or "tier1" for the preset below.
+# Tokens are counted the way the providers do: estimated prompt tokens plus max_tokens.
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+# Conservative first-tier account limits
+TIER1_RATE_LIMITS: Dict[str, Tuple[Optional[float], Optional[float]]] = {
+    "gpt-4.1": (500, 30000),
+    "gpt-4.1-mini": (500, 200000),
+    "gpt-4.1-nano": (500, 200000),
+    "o3-mini": (500, 200000),
+    "sonar": (50, None),
+    "sonar-pro": (50, None),
+}
+# Output tokens assumed for requests that do not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+
+# Attempts per call, including the first
+DEFAULT_MAX_ATTEMPTS = 4
+# Exponential backoff: base delay and cap in seconds (full jitter is applied)
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+# Longest Retry-After honoured before giving up on a call
+MAX_RETRY_AFTER = 120.0
+
+# A duplicate request is sent when a call runs longer than this latency quantile
+# of recent calls to the same model (0 disables hedging)
+DEFAULT_HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Consecutive failures (timeouts, connection errors, 5xx) that open an endpoint's
+# circuit, and how long it stays open before a single probe request is let through
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+def request_tokens(messages: list, max_tokens: Optional[int] = None) -> int:
+    """Tokens a chat request counts against a TPM limit: estimated prompt plus maximum output."""
+    prompt = sum(estimate_tokens(m.get("content") or "") for m in messages)
+    return prompt + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+def _status_code(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+def _is_transient(error: Exception) -> bool:
+    """Timeouts, connection failures and server errors: the endpoint itself is struggling."""
+    from openai import APIConnectionError, APITimeoutError
+
+    if isinstance(error, (APIConnectionError, APITimeoutError, asyncio.TimeoutError, TimeoutError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status >= 500 or status in (408, 409))
+
+def _is_retryable(error: Exception) -> bool:
+    return _is_transient(error) or _status_code(error) == 429
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked the client to wait, from Retry-After or retry-after-ms."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+class ModelScheduler:
+    """
+    Admits, retries and hedges every model call.
+
+    Token buckets for requests and tokens per model, and a circuit breaker per
+    endpoint, live in a SQLite database, so the limits hold across threads,
+    async tasks and worker processes sharing the same directory. Retryable
+    failures (429, timeouts, connection errors, 5xx) are retried with
+    exponential backoff and full jitter, honouring Retry-After. A call still
+    running past the `hedge_quantile` latency of recent calls to its model is
+    raced against one duplicate request.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_SCHEDULER_DIR,
+        limits: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        hedge_quantile: float = DEFAULT_HEDGE_QUANTILE,
+        breaker_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+        breaker_cooldown: float = DEFAULT_BREAKER_COOLDOWN,
+        enabled: bool = True,
+    ):
+        self.directory = directory
+        self.limits = dict(DEFAULT_RATE_LIMITS if limits is None else limits)
+        self.max_attempts = max(1, max_attempts)
+        self.hedge_quantile = hedge_quantile
+        self.breaker_threshold = max(1, breaker_threshold)
+        self.breaker_cooldown = breaker_cooldown
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, "scheduler.sqlite3")
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS breakers ("
+                " endpoint TEXT PRIMARY KEY, failures INTEGER NOT NULL,"
+                " opened_until REAL NOT NULL, probe_until REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    # Token buckets
+
+    def _try_acquire(self, model: str, tokens: int) -> float:
+        """
+        Takes one request and `tokens` tokens from the model's buckets if both
+        have enough, in one transaction.
+
+        Returns:
+            0 when admitted, otherwise the seconds until both buckets will have refilled enough.
+        """
+        rpm, tpm = self.limits.get(model, (None, None))
+        wanted = [(f"{model}:requests", rpm, 1.0), (f"{model}:tokens", tpm, float(tokens))]
+        wanted = [(key, limit, min(amount, limit)) for key, limit, amount in wanted if limit]
+        if not wanted:
+            return 0.0
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                levels = []
+                for key, limit, amount in wanted:
+                    row = conn.execute("SELECT level, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                    # Buckets start full and refill continuously at limit per minute
+                    level = limit if row is None else min(limit, row[0] + (now - row[1]) * limit / 60.0)
+                    levels.append(level)
+                wait_seconds = max(
+                    (amount - level) * 60.0 / limit for (key, limit, amount), level in zip(wanted, levels)
+                )
+                if wait_seconds <= 0:
+                    levels = [level - amount for (key, limit, amount), level in zip(wanted, levels)]
+                for (key, limit, amount), level in zip(wanted, levels):
+                    conn.execute("INSERT OR REPLACE INTO buckets (key, level, updated_at) VALUES (?, ?, ?)",
+                                 (key, level, now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return max(0.0, wait_seconds)
+
+    def _notify_wait(self, model: str, wait_seconds: float, first: bool):
+        if first:
+            print(f"    {model} rate limit reached; waiting ~{wait_seconds:.1f}s "
+                  f"(set RESEARCH_RATE_LIMITS to change the limits).")
+
+    def acquire(self, model: str, tokens: int):
+        """Blocks until the model's rate limits admit one request of `tokens` tokens."""
+        first = True
+        while True:
+            wait_seconds = self._try_acquire(model, tokens)
+            if wait_seconds <= 0:
+                return
+            self._notify_wait(model, wait_seconds, first)
+            first = False
+            time.sleep(min(wait_seconds, 5.0) + random.uniform(0, 0.05))
+
+    async def acquire_async(self, model: str, tokens: int):
+        """
+        Async counterpart of acquire. The SQLite transaction runs in a thread,
+        so a contended database never blocks the event loop.
+        """
+        first = True
+        while True:
+            wait_seconds = await asyncio.to_thread(self._try_acquire, model, tokens)
+            if wait_seconds <= 0:
+                return
+            self._notify_wait(model, wait_seconds, first)
+            first = False
+            await asyncio.sleep(min(wait_seconds, 5.0) + random.uniform(0, 0.05))
+
+    # Circuit breaker
+
+    def _check_breaker(self, endpoint: str):
+        """
+        Raises CircuitOpenError while the endpoint's circuit is open. After the
+        cooldown one caller at a time is let through as a probe (half-open).
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT opened_until, probe_until FROM breakers WHERE endpoint = ?", (endpoint,)
+                ).fetchone()
+                blocked = None
+                if row is not None and row[0] > 0:
+                    opened_until, probe_until = row
+                    if now < opened_until:
+                        blocked = opened_until - now
+                    elif now < probe_until:
+                        blocked = probe_until - now
+                    else:
+                        conn.execute("UPDATE breakers SET probe_until = ? WHERE endpoint = ?",
+                                     (now + self.breaker_cooldown, endpoint))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if blocked is not None:
+            raise CircuitOpenError(
+                f"Circuit breaker open for {endpoint} after repeated failures; retry in {blocked:.0f}s."
+            )
+
+    def _record_outcome(self, endpoint: str, success: bool):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if success:
+                    conn.execute("DELETE FROM breakers WHERE endpoint = ?", (endpoint,))
+                else:
+                    row = conn.execute(
+                        "SELECT failures, opened_until FROM breakers WHERE endpoint = ?", (endpoint,)
+                    ).fetchone()
+                    failures, opened_until = (row[0] + 1, row[1]) if row else (1, 0.0)
+                    # A failed probe (circuit was already open) reopens it immediately
+                    if failures >= self.breaker_threshold or opened_until > 0:
+                        opened_until = now + self.breaker_cooldown
+                        print(f"    Circuit breaker opened for {endpoint} for {self.breaker_cooldown:.0f}s.")
+                    conn.execute(
+                        "INSERT OR REPLACE INTO breakers (endpoint, failures, opened_until, probe_until)"
+                        " VALUES (?, ?, ?, 0)",
+                        (endpoint, failures, opened_until),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # Hedging
+
+    def _observe_latency(self, model: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        """The model's recent latency quantile, or None while hedging is off or there are too few samples."""
+        if not self.hedge_quantile:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(self.hedge_quantile * len(samples)))]
+
+    def _call_hedged(self, model: str, fn: Callable, delay: float, tokens: int):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+        # Each attempt runs in a copy of the caller's context so metrics still attribute it
+        first = self._executor.submit(contextvars.copy_context().run, fn)
+        done, _ = wait([first], timeout=delay)
+        if done or self._try_acquire(model, tokens) > 0:
+            return first.result()
+        print(f"    {model} call exceeded {delay:.1f}s; sending a hedged duplicate request.")
+        second = self._executor.submit(contextvars.copy_context().run, fn)
+        futures = [first, second]
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None or not futures:
+                    # The slower request is left to finish in the background; its result is discarded
+                    return future.result()
+
+    async def _call_hedged_async(self, model: str, fn: Callable[[], Awaitable], delay: float, tokens: int):
+        first = asyncio.ensure_future(fn())
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or await asyncio.to_thread(self._try_acquire, model, tokens) > 0:
+            return await first
+        print(f"    {model} call exceeded {delay:.1f}s; sending a hedged duplicate request.")
+        pending = {first, asyncio.ensure_future(fn())}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None or not pending:
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # Calls
+
+    def _backoff(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None if the error should not be retried."""
+        if not _is_retryable(error) or attempt + 1 >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        requested = retry_after(error)
+        if requested is not None:
+            if requested > MAX_RETRY_AFTER:
+                return None
+            delay = requested + random.uniform(0, BACKOFF_BASE / 2)
+        return delay
+
+    def _after_failure(self, endpoint: str, model: str, error: Exception, attempt: int) -> Optional[float]:
+        if _is_transient(error):
+            self._record_outcome(endpoint, False)
+        delay = self._backoff(error, attempt)
+        if delay is not None:
+            print(f"    {model} call failed ({type(error).__name__}); retry {attempt+1} in {delay:.1f}s...")
+        return delay
+
+    def call(self, endpoint: str, model: str, fn: Callable, tokens: int = 0, hedge: bool = True):
+        """
+        Runs `fn` (one model request) under the rate limits, retry policy,
+        hedging and circuit breaker.
+
+        Args:
+            endpoint: The API base URL, which scopes the circuit breaker.
+            model: The model, which selects the rate limits and latency history.
+            fn: Performs the request and returns its result.
+            tokens: Tokens the request counts against the model's TPM limit.
+            hedge: Whether a slow call may be raced against a duplicate; only
+                   safe for requests whose result is returned whole.
+
+        Returns:
+            The result of the first successful attempt.
+
+        Raises:
+            CircuitOpenError: If the endpoint's circuit breaker is open.
+            Exception: The last error once retries are exhausted or for
+                       non-retryable errors.
+        """
+        if not self.enabled:
+            return fn()
+        attempt = 0
+        while True:
+            self._check_breaker(endpoint)
+            self.acquire(model, tokens)
+            start = time.perf_counter()
+            delay = self._hedge_delay(model) if hedge else None
+            try:
+                result = self._call_hedged(model, fn, delay, tokens) if delay else fn()
+            except Exception as e:
+                wait_seconds = self._after_failure(endpoint, model, e, attempt)
+                if wait_seconds is None:
+                    raise
+                time.sleep(wait_seconds)
+                attempt += 1
+                continue
+            self._record_outcome(endpoint, True)
+            self._observe_latency(model, time.perf_counter() - start)
+            return result
+
+    async def call_async(
+        self,
+        endpoint: str,
+        model: str,
+        fn: Callable[[], Awaitable],
+        tokens: int = 0,
+        hedge: bool = True,
+    ):
+        """
+        Async counterpart of call; `fn` returns a new awaitable for each attempt.
+        Breaker and limiter transactions run in threads, off the event loop.
+        """
+        if not self.enabled:
+            return await fn()
+        attempt = 0
+        while True:
+            await asyncio.to_thread(self._check_breaker, endpoint)
+            await self.acquire_async(model, tokens)
+            start = time.perf_counter()
+            delay = self._hedge_delay(model) if hedge else None
+            try:
+                result = await (self._call_hedged_async(model, fn, delay, tokens) if delay else fn())
+            except Exception as e:
+                wait_seconds = await asyncio.to_thread(self._after_failure, endpoint, model, e, attempt)
+                if wait_seconds is None:
+                    raise
+                await asyncio.sleep(wait_seconds)
+                attempt += 1
+                continue
+            await asyncio.to_thread(self._record_outcome, endpoint, True)
+            self._observe_latency(model, time.perf_counter() - start)
+            return result
+
+def create_completion(client, hedge: bool = True, **request):
+    """
+    Sends chat.completions.create(**request) through the shared scheduler,
+    scoped to the client's endpoint. Streaming requests are never hedged, and
+    only opening the stream is retried.
+    """
+    return get_scheduler().call(
+        str(client.base_url),
+        request["model"],
+        lambda: client.chat.completions.create(**request),
+        request_tokens(request["messages"], request.get("max_tokens")),
+        hedge=hedge and not request.get("stream"),
+    )
+
+async def create_completion_async(client, hedge: bool = True, **request):
+    """Async counterpart of create_completion for AsyncOpenAI clients."""
+    return await get_scheduler().call_async(
+        str(client.base_url),
+        request["model"],
+        lambda: client.chat.completions.create(**request),
+        request_tokens(request["messages"], request.get("max_tokens")),
+        hedge=hedge and not request.get("stream"),
+    )
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def parse_rate_limits(text: str) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """
+    Parses "model=RPM:TPM,..." (either part may be empty for unlimited).
+    The item "tier1" adds TIER1_RATE_LIMITS; "none" disables every limit.
+    """
+    limits: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+    if text.strip().lower() == "none":
+        return limits
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        if item.strip().lower() == "tier1":
+            limits.update(TIER1_RATE_LIMITS)
+            continue
+        model, _, values = item.partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (float(rpm) if rpm.strip() else None, float(tpm) if tpm.strip() else None)
+    return limits
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def get_scheduler() -> ModelScheduler:
+    """
+    Returns the process-wide scheduler, creating it on first use.
+
+    The scheduler is configured from the environment: RESEARCH_SCHEDULER
+    (set to "off" to call the APIs directly, with the client library's own
+    retries), RESEARCH_SCHEDULER_DIR, RESEARCH_RATE_LIMITS (none by default; see
+    parse_rate_limits), RESEARCH_MAX_ATTEMPTS, RESEARCH_HEDGE_QUANTILE
+    (0 disables hedging), RESEARCH_BREAKER_THRESHOLD and RESEARCH_BREAKER_COOLDOWN.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            limits_text = os.getenv("RESEARCH_RATE_LIMITS", "")
+            if limits_text.strip().lower() == "none":
+                limits = {}
+            else:
+                limits = dict(DEFAULT_RATE_LIMITS)
+                limits.update(parse_rate_limits(limits_text))
+            _scheduler = ModelScheduler(
+                directory=os.getenv("RESEARCH_SCHEDULER_DIR", DEFAULT_SCHEDULER_DIR),
+                limits=limits,
+                max_attempts=int(_env_float("RESEARCH_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+                hedge_quantile=_env_float("RESEARCH_HEDGE_QUANTILE", DEFAULT_HEDGE_QUANTILE),
+                breaker_threshold=int(_env_float("RESEARCH_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD)),
+                breaker_cooldown=_env_float("RESEARCH_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN),
+                enabled=os.getenv("RESEARCH_SCHEDULER", "on").lower() != "off",
+            )
+        return _scheduler
+
+def configure_scheduler(limits: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+                        directory: Optional[str] = None):
+    """
+    Overrides the process-wide scheduler settings, e.g. to lift the rate
+    limits when talking to a local mock server.
+
+    Args:
+        limits: Per-model (RPM, TPM) limits replacing the current ones.
+        directory: Directory holding the shared limiter state.
+    """
+    global _scheduler
+    scheduler = get_scheduler()
+    with _scheduler_lock:
+        _scheduler = ModelScheduler(
+            directory=directory or scheduler.directory,
+            limits=scheduler.limits if limits is None else limits,
+            max_attempts=scheduler.max_attempts,
+            hedge_quantile=scheduler.hedge_quantile,
+            breaker_threshold=scheduler.breaker_threshold,
+            breaker_cooldown=scheduler.breaker_cooldown,
+            enabled=scheduler.enabled,
+        )
+
+# Example Usage (optional, can be run directly)
+if __name__ == "__main__":
+    demo = ModelScheduler(directory=DEFAULT_SCHEDULER_DIR, limits={"demo-model": (120, None)}, hedge_quantile=0)
+    start = time.perf_counter()
+    for i in range(130):
+        demo.acquire("demo-model", 0)
+    # 120 requests fit the initial burst; the rest wait for the bucket to refill at 2 per second
+    print(f"130 requests admitted in {time.perf_counter() - start:.1f}s under a 120 RPM limit")
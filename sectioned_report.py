@@ -0,0 +1,306 @@
+# sectioned_report.py
+import re
+import json
+import html
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+from report_generator import complete_report_request
+from research_corpus import ResearchCorpus, render_corpus
+
+report_model = "gpt-4.1"
+# Output limit for the outline call
+OUTLINE_MAX_TOKENS = 1000
+# Output limit for each section; the whole report is no longer capped by one completion
+SECTION_MAX_TOKENS = 1500
+# Output limit for the introduction and the conclusion
+FRAME_MAX_TOKENS = 600
+# Upper bound on the number of body sections requested in the outline
+MAX_SECTIONS = 8
+# Maximum number of section calls in flight at once
+DEFAULT_SECTION_WORKERS = 8
+
+outline_instructions = (
+    "Task: plan a detailed research report on the topic using the research findings above and the "
+    "preliminary analysis below. Return only a JSON object of the form "
+    '{"title": "...", "sections": [{"heading": "...", "focus": "...", "queries": [1, 2]}]} where '
+    f"'sections' lists between 3 and {MAX_SECTIONS} body sections in reading order (do not include an "
+    "introduction or conclusion), 'focus' says in one sentence what the section covers, and 'queries' "
+    "lists the numbers of the queries whose results the section draws on."
+)
+
+section_system_prompt = (
+    "You are an expert research writer producing one part of a larger HTML research report. "
+    "Write only the requested part as an HTML fragment, with no <html>, <head>, <body> or <h1> tags "
+    "and no Markdown. Use <h3>, <p>, <ul>, <li> and <strong> for structure, maintain a formal and "
+    "objective tone, and base everything *only* on the provided input data."
+)
+
+section_instructions = (
+    "Task: write the report section described below as an HTML fragment that starts with "
+    "<h2>{heading}</h2>. Cover: {focus} Draw on the research data above and the preliminary analysis, "
+    "and avoid repeating material that belongs to the other sections.\n\n"
+    "Report outline:\n{outline}\n"
+)
+
+introduction_instructions = (
+    "Task: write the introduction of the report outlined below as an HTML fragment of one to three "
+    "<p> paragraphs with no heading. Set the context of the topic and preview the sections.\n\n"
+    "Report outline:\n{outline}\n"
+)
+
+conclusion_instructions = (
+    "Task: write the conclusion of the report outlined below as an HTML fragment that starts with "
+    "<h2>Conclusion</h2> and summarizes the key insights derived from the research.\n\n"
+    "Report outline:\n{outline}\n"
+)
+
+# Elements that never have a closing tag
+_VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# Wrappers and title elements owned by the assembled document, not by fragments
+_DOCUMENT_ELEMENTS = {"html", "head", "body", "title", "h1", "meta", "link", "style", "script"}
+
+class _FragmentBalancer(HTMLParser):
+    """
+    Re-emits an HTML fragment with document-level elements removed, stray
+    closing tags dropped and unclosed tags closed, so a truncated or sloppy
+    section cannot break the assembled document.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.parts: List[str] = []
+        self.stack: List[str] = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _DOCUMENT_ELEMENTS:
+            if tag in ("title", "h1", "style", "script"):
+                self.skip_depth += 1
+            return
+        if self.skip_depth:
+            return
+        self.parts.append(self.get_starttag_text())
+        if tag not in _VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in _DOCUMENT_ELEMENTS and not self.skip_depth:
+            self.parts.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if tag in _DOCUMENT_ELEMENTS:
+            if tag in ("title", "h1", "style", "script") and self.skip_depth:
+                self.skip_depth -= 1
+            return
+        if self.skip_depth or tag not in self.stack:
+            return
+        while self.stack:
+            open_tag = self.stack.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def handle_entityref(self, name):
+        if not self.skip_depth:
+            self.parts.append(f"&{name};")
+
+    def handle_charref(self, name):
+        if not self.skip_depth:
+            self.parts.append(f"&#{name};")
+
+    def result(self) -> str:
+        self.close()
+        return "".join(self.parts) + "".join(f"</{tag}>" for tag in reversed(self.stack))
+
+def clean_fragment(text: str) -> str:
+    """Strips Markdown code fences and document-level markup from a generated fragment and balances its tags."""
+    text = re.sub(r"^\s*```(?:html)?\s*|\s*```\s*$", "", text.strip())
+    text = re.sub(r"<!DOCTYPE[^>]*>", "", text, flags=re.IGNORECASE)
+    balancer = _FragmentBalancer()
+    balancer.feed(text)
+    return balancer.result().strip()
+
+def parse_outline(text: str, query_count: int) -> Optional[dict]:
+    """
+    Parses the outline JSON returned by the model.
+
+    Returns:
+        A dict with 'title' and 'sections' (each with 'heading', 'focus' and
+        in-range 'queries'), or None if the text holds no usable outline.
+    """
+    match = re.search(r"\{.*\}", text, flags=re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    sections = []
+    for entry in data.get("sections") or []:
+        if not isinstance(entry, dict) or not str(entry.get("heading", "")).strip():
+            continue
+        queries = []
+        for number in entry.get("queries") or []:
+            try:
+                number = int(number)
+            except (TypeError, ValueError):
+                continue
+            if 1 <= number <= query_count and number not in queries:
+                queries.append(number)
+        sections.append({
+            "heading": str(entry["heading"]).strip(),
+            "focus": str(entry.get("focus", "")).strip(),
+            "queries": queries,
+        })
+    if not sections:
+        return None
+    return {"title": str(data.get("title") or "").strip(), "sections": sections[:MAX_SECTIONS]}
+
+def _format_outline(outline: dict) -> str:
+    lines = [f"Title: {outline['title']}"]
+    for i, section in enumerate(outline["sections"]):
+        lines.append(f"{i+1}. {section['heading']}: {section['focus']}")
+    return "\n".join(lines)
+
+def _request(messages: List[Dict[str, str]], max_tokens: int, model: str = report_model, **params) -> dict:
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.6,
+        "max_tokens": max_tokens,
+        "top_p": 1,
+        **params,
+    }
+
+def _analysis_block(analysis: str) -> str:
+    return "\nIntermediate Analysis (from previous step):\n" + "-"*20 + "\n" + analysis + "\n" + "-"*20 + "\n"
+
+def _section_request(
+    corpus: ResearchCorpus, outline: dict, section: dict, analysis: str, model: str = report_model
+) -> dict:
+    """Builds the request for one body section from the results it draws on."""
+    by_number = {item["number"]: item for item in corpus.results}
+    # Sections without usable query references fall back to the whole corpus
+    subset = [by_number[n] for n in sorted(section["queries"])] or corpus.results
+    instructions = section_instructions.format(
+        heading=html.escape(section["heading"]), focus=section["focus"], outline=_format_outline(outline)
+    )
+    messages = [
+        {"role": "system", "content": section_system_prompt},
+        {"role": "user", "content": render_corpus(corpus.topic, subset)},
+        {"role": "user", "content": instructions + _analysis_block(analysis)},
+    ]
+    return _request(messages, SECTION_MAX_TOKENS, model)
+
+def _frame_request(topic: str, outline: dict, analysis: str, instructions: str, model: str = report_model) -> dict:
+    """Builds the request for the introduction or conclusion, which rely on the analysis rather than raw data."""
+    messages = [
+        {"role": "system", "content": section_system_prompt},
+        {"role": "user", "content": f"Research Topic: {topic}\n" + _analysis_block(analysis)},
+        {"role": "user", "content": instructions.format(outline=_format_outline(outline))},
+    ]
+    return _request(messages, FRAME_MAX_TOKENS, model)
+
+def assemble_report(title: str, introduction: str, sections: List[str], conclusion: str) -> str:
+    """Assembles cleaned fragments into a complete HTML document."""
+    parts = [
+        "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n",
+        f"<title>{html.escape(title)}</title>\n</head>\n<body>\n",
+        f"<h1>{html.escape(title)}</h1>\n",
+    ]
+    for fragment in [introduction] + sections + [conclusion]:
+        if fragment:
+            parts.append(fragment + "\n")
+    parts.append("</body>\n</html>")
+    return "".join(parts)
+
+def generate_sectioned_report(
+    topic: str,
+    results: List[Dict[str, str]],
+    analysis: str,
+    corpus: Optional[ResearchCorpus] = None,
+    max_workers: int = DEFAULT_SECTION_WORKERS,
+    model: str = report_model,
+) -> str:
+    """
+    Generates the HTML report from an outline whose sections are written in
+    parallel, so wall time is bounded by the slowest section rather than by
+    the length of the whole report.
+
+    The outline (title, sections and the queries each draws on) is generated
+    first. Each body section is then written from its subset of the results
+    and the analysis, concurrently with the introduction and conclusion, and
+    the fragments are assembled into one HTML document.
+
+    Args:
+        topic: The original research topic.
+        results: A list of dictionaries, where each dictionary contains
+                 a 'query' and its corresponding 'result'.
+        analysis: The synthesized analysis previously generated by o3-mini.
+        corpus: The run's already rendered corpus; built from `topic` and
+                `results` when omitted.
+        max_workers: Maximum number of section calls in flight at once.
+        model: The OpenAI model for the outline and every section.
+
+    Returns:
+        The report HTML, or an error message string if the outline or every
+        section fails.
+    """
+    print(f"\nGenerating report outline using OpenAI {model}...")
+    corpus = corpus or ResearchCorpus(topic, results)
+    # The outline sees the full corpus, reusing the prefix shared with the analysis prompt
+    outline_text = complete_report_request(_request(
+        corpus.messages(outline_instructions + "\n" + _analysis_block(analysis)),
+        OUTLINE_MAX_TOKENS,
+        model,
+        temperature=0.3,
+        response_format={"type": "json_object"},
+    ))
+    if outline_text.startswith("Error:"):
+        return outline_text
+    outline = parse_outline(outline_text, len(corpus.results))
+    if outline is None:
+        return "Error: Could not parse the report outline."
+    outline["title"] = outline["title"] or f"Research Report: {topic}"
+
+    requests = [_frame_request(topic, outline, analysis, introduction_instructions, model)]
+    requests += [_section_request(corpus, outline, section, analysis, model) for section in outline["sections"]]
+    requests.append(_frame_request(topic, outline, analysis, conclusion_instructions, model))
+    print(f"Writing the introduction, {len(outline['sections'])} sections and the conclusion in parallel...")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(requests)))) as executor:
+        fragments = list(executor.map(complete_report_request, requests))
+
+    failed = [f for f in fragments if f.startswith("Error:")]
+    body = [clean_fragment(f) for f in fragments[1:-1] if not f.startswith("Error:")]
+    if not body:
+        return failed[0]
+    if failed:
+        print(f"Warning: {len(failed)} of {len(fragments)} report parts failed and were left out.")
+
+    def frame(fragment: str) -> str:
+        return "" if fragment.startswith("Error:") else clean_fragment(fragment)
+
+    return assemble_report(outline["title"], frame(fragments[0]), body, frame(fragments[-1]))
+
+# Example Usage (optional, for testing this module directly)
+if __name__ == "__main__":
+    test_topic = "AI in Education"
+    test_results = [
+        {"query": "AI tutoring systems effectiveness", "result": "Studies show AI tutors can improve test scores..."},
+        {"query": "AI for personalized learning paths", "result": "AI analyzes student data to adapt curriculum..."},
+        {"query": "Ethical considerations of AI in schools", "result": "Concerns include data privacy and algorithmic bias..."}
+    ]
+    test_analysis = "AI shows promise in personalizing education via tutoring systems and adaptive curricula, but ethical challenges like privacy and bias need addressing."
+
+    print(f"Generating sectioned report for topic: \"{test_topic}\"")
+    report = generate_sectioned_report(test_topic, test_results, test_analysis)
+    print("\nFinal HTML Report:")
+    print(report)
@@ -0,0 +1,399 @@
+# server.py
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import dataclasses
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from clients import load_environment
+
+# Load environment variables from .env file
+load_environment()
+
+from run_store import RunStore, DEFAULT_RUNS_DIR
+from pipeline import PipelineOptions, run_pipeline
+from metrics import get_recorder
+from model_router import ROUTING_POLICIES, DEFAULT_ROUTING_POLICY
+
+# Research jobs running at the same time
+DEFAULT_MAX_IN_FLIGHT = 2
+# Jobs waiting for a worker; submissions beyond this are rejected with 429
+DEFAULT_MAX_QUEUED = 20
+# Finished jobs kept in memory for status queries; older ones are forgotten
+MAX_FINISHED_JOBS = 500
+# Seconds between keep-alive comments on idle event streams
+HEARTBEAT_INTERVAL = 15.0
+TERMINAL_STATUSES = ("completed", "failed")
+# Per-job settings a client may override, with their expected types
+JOB_OPTIONS = {
+    "report_mode": str,
+    "model_routing": str,
+    "novelty_threshold": float,
+    "min_queries": int,
+    "max_queries": int,
+    "compact": bool,
+}
+
+class Job:
+    """One research request, its status and the progress events emitted so far."""
+
+    def __init__(self, store: RunStore, options: PipelineOptions):
+        self.id = store.run_id
+        self.store = store
+        self.options = options
+        self.status = "queued"
+        self.report_path: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.events: List[dict] = []
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def emit(self, event: str, data: dict):
+        """Appends a progress event and wakes up every event stream waiting on this job."""
+        with self._condition:
+            self.events.append({"id": len(self.events), "event": event, "time": time.time(), "data": data})
+            self._condition.notify_all()
+
+    def set_status(self, status: str, **data):
+        # Under the condition, so a stream never sees the final status without its event
+        with self._condition:
+            self.status = status
+            self.emit("status", {"status": status, **data})
+
+    def wait_for_events(self, after: int, timeout: float) -> List[dict]:
+        """Returns the events after index `after`, waiting up to `timeout` seconds for new ones."""
+        with self._condition:
+            if len(self.events) <= after and not self.finished:
+                self._condition.wait(timeout)
+            return self.events[after:]
+
+    def to_dict(self) -> dict:
+        report_name = os.path.basename(self.report_path) if self.report_path else None
+        return {
+            "id": self.id,
+            "topic": self.store.topic,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": len(self.events),
+            "events_url": f"/jobs/{self.id}/events",
+            "report_url": f"/reports/{report_name}" if report_name else None,
+        }
+
+class ResearchService:
+    """
+    Runs research jobs from a bounded queue on a fixed number of worker
+    threads, sharing one process's API clients, connection pools, response
+    cache and research memory.
+    """
+
+    def __init__(
+        self,
+        options: PipelineOptions,
+        runs_dir: str = DEFAULT_RUNS_DIR,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+    ):
+        self.options = options
+        self.runs_dir = runs_dir
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue: "queue.Queue[Job]" = queue.Queue(maxsize=max(1, max_queued))
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.running = 0
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.max_in_flight):
+            worker = threading.Thread(target=self._work, name=f"research-worker-{i+1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, topic: str, overrides: Optional[Dict[str, object]] = None) -> Optional[Job]:
+        """
+        Queues a research job.
+
+        Returns:
+            The queued job, or None if the queue is full.
+        """
+        with self._lock:
+            if self.queue.full():
+                return None
+            store = RunStore.create(topic, self.runs_dir)
+            job = Job(store, dataclasses.replace(self.options, **(overrides or {})))
+            job.options.on_event = job.emit
+            self.jobs[job.id] = job
+            job.set_status("queued", position=self.queue.qsize() + 1)
+            self.queue.put_nowait(job)
+            self._forget_finished()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queued": self.queue.qsize(), "running": self.running,
+                    "max_in_flight": self.max_in_flight, "max_queued": self.queue.maxsize}
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            with self._lock:
+                self.running += 1
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                self.queue.task_done()
+
+    def _run(self, job: Job):
+        job.started_at = time.time()
+        job.set_status("running")
+        try:
+            job.report_path = run_pipeline(job.store, job.options)
+            if job.report_path is None:
+                job.error = "The run did not complete; see the server log."
+        except Exception as e:
+            # One failing job must not take its worker down
+            job.error = str(e)
+        job.finished_at = time.time()
+        if job.error is None:
+            job.set_status("completed", report_url=job.to_dict()["report_url"])
+        else:
+            job.set_status("failed", error=job.error)
+
+def parse_job_request(body: bytes) -> Tuple[Optional[str], Dict[str, object], Optional[str]]:
+    """
+    Parses a job submission of the form {"topic": "...", "options": {...}}.
+
+    Returns:
+        The topic, the validated option overrides, and an error message
+        (None when the request is valid).
+    """
+    try:
+        payload = json.loads(body or b"{}")
+    except json.JSONDecodeError:
+        return None, {}, "Request body must be JSON."
+    topic = str(payload.get("topic") or "").strip() if isinstance(payload, dict) else ""
+    if not topic:
+        return None, {}, "A non-empty 'topic' is required."
+    options = payload.get("options") or {}
+    if not isinstance(options, dict):
+        return None, {}, "'options' must be an object."
+    overrides = {}
+    for name, value in options.items():
+        if name not in JOB_OPTIONS:
+            return None, {}, f"Unknown option '{name}'. Allowed: {', '.join(JOB_OPTIONS)}."
+        expected = JOB_OPTIONS[name]
+        try:
+            if value is not None and (expected is bool) != isinstance(value, bool):
+                raise ValueError(name)
+            # int() would truncate 2.7 to 2; only whole numbers are accepted
+            if expected is int and isinstance(value, float) and not value.is_integer():
+                raise ValueError(name)
+            overrides[name] = expected(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None, {}, f"Invalid value for option '{name}'."
+    if overrides.get("report_mode", "single") not in ("single", "sections"):
+        return None, {}, "report_mode must be 'single' or 'sections'."
+    if overrides.get("model_routing", DEFAULT_ROUTING_POLICY) not in ROUTING_POLICIES:
+        return None, {}, f"model_routing must be one of: {', '.join(sorted(ROUTING_POLICIES))}."
+    return topic, overrides, None
+
+class ResearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the research service:
+
+        POST /jobs                 submit {"topic": ..., "options": {...}}; 202, or 429 when full
+        GET  /jobs                 list known jobs
+        GET  /jobs/<id>            job status
+        GET  /jobs/<id>/events     progress as Server-Sent Events (supports Last-Event-ID)
+        GET  /reports/<file>       finished report HTML
+        GET  /health               queue and worker counts
+        GET  /metrics              model call metrics in Prometheus text format
+    """
+
+    service: ResearchService = None
+    reports_dir: str = "generated_reports"
+
+    def log_message(self, format, *args):
+        print(f"[server] {self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, payload: object, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status: int, text: str, content_type: str):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "Not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        topic, overrides, error = parse_job_request(self.rfile.read(length))
+        if error:
+            self._send_json(400, {"error": error})
+            return
+        job = self.service.submit(topic, overrides)
+        if job is None:
+            self._send_json(429, {"error": "Too many queued jobs; retry later.", **self.service.stats()},
+                            {"Retry-After": "30"})
+            return
+        self._send_json(202, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if parts == ["health"]:
+            self._send_json(200, {"status": "ok", **self.service.stats()})
+        elif parts == ["metrics"]:
+            self._send_text(200, get_recorder().to_prometheus(), "text/plain; version=0.0.4")
+        elif parts == ["jobs"]:
+            self._send_json(200, [job.to_dict() for job in self.service.list()])
+        elif len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.service.get(parts[1])
+            if job is None:
+                self._send_json(404, {"error": f"No job '{parts[1]}'."})
+            elif len(parts) == 2:
+                self._send_json(200, job.to_dict())
+            elif parts[2] == "events":
+                self._stream_events(job)
+            else:
+                self._send_json(404, {"error": "Not found"})
+        elif len(parts) == 2 and parts[0] == "reports":
+            self._send_report(parts[1])
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def _send_report(self, name: str):
+        # Only plain file names inside the reports directory are served
+        path = os.path.join(self.reports_dir, name)
+        if name != os.path.basename(name) or not name.endswith(".html") or not os.path.isfile(path):
+            self._send_json(404, {"error": "Report not found."})
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            self._send_text(200, f.read(), "text/html; charset=utf-8")
+
+    def _stream_events(self, job: Job):
+        """Replays the job's events, then streams new ones until the job finishes."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        last_event_id = self.headers.get("Last-Event-ID")
+        cursor = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+        try:
+            while True:
+                events = job.wait_for_events(cursor, HEARTBEAT_INTERVAL)
+                if not events:
+                    if job.finished:
+                        break
+                    self.wfile.write(b": keep-alive\n\n")
+                for event in events:
+                    payload = json.dumps({"time": event["time"], **event["data"]})
+                    self.wfile.write(f"id: {event['id']}\nevent: {event['event']}\ndata: {payload}\n\n".encode("utf-8"))
+                cursor += len(events)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; the job keeps running
+            pass
+
+def start_server(service: ResearchService, host: str, port: int, reports_dir: str) -> ThreadingHTTPServer:
+    """Starts the service's workers and returns the HTTP server, ready for serve_forever()."""
+    handler = type("ConfiguredResearchRequestHandler", (ResearchRequestHandler,),
+                   {"service": service, "reports_dir": reports_dir})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    service.start()
+    return server
+
+def parse_args(argv=None):
+    """Parses command-line options for server mode."""
+    from mock_openai_server import add_config_arguments
+
+    parser = argparse.ArgumentParser(description="Run the research agent as an HTTP service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help=f"Research jobs running at the same time (default: {DEFAULT_MAX_IN_FLIGHT}).")
+    parser.add_argument("--max-queued", type=int, default=DEFAULT_MAX_QUEUED,
+                        help=f"Jobs waiting for a worker before new ones are rejected with 429 "
+                             f"(default: {DEFAULT_MAX_QUEUED}).")
+    parser.add_argument("--runs-dir", default=DEFAULT_RUNS_DIR,
+                        help=f"Directory holding per-run checkpoints (default: {DEFAULT_RUNS_DIR}).")
+    parser.add_argument("--reports-dir", default="generated_reports",
+                        help="Directory where reports are written and served from (default: generated_reports).")
+    parser.add_argument("--mock", action="store_true",
+                        help="Start the mock OpenAI/Perplexity server in-process and send every model call to it.")
+    add_config_arguments(parser.add_argument_group("mock server (with --mock)"))
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Entry point for server mode."""
+    args = parse_args(argv)
+    if args.mock:
+        from mock_openai_server import start_mock_server, config_from_args
+
+        mock_server, mock_url = start_mock_server(config_from_args(args))
+        os.environ["OPENAI_BASE_URL"] = mock_url
+        os.environ["PERPLEXITY_BASE_URL"] = mock_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        os.environ.setdefault("PERPLEXITY_API_KEY", "mock")
+        print(f"Mock model server listening on {mock_url}")
+        from scheduler import configure_scheduler
+
+        configure_scheduler(limits={})
+
+    # Progress lines from concurrent jobs would interleave, so stages do not stream to the console
+    service = ResearchService(
+        PipelineOptions(stream=False, reports_dir=args.reports_dir),
+        runs_dir=args.runs_dir,
+        max_in_flight=args.max_in_flight,
+        max_queued=args.max_queued,
+    )
+    server = start_server(service, args.host, args.port, args.reports_dir)
+    print(f"Research service listening on http://{args.host}:{server.server_address[1]} "
+          f"({service.max_in_flight} jobs in flight, {service.queue.maxsize} queued at most)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# streaming.py
+import os
+import sys
+import time
+from typing import Callable, Iterable, Optional
+
+class StreamProgress:
+    """
+    Prints live progress for a streamed completion on a single terminal line
+    and records the time to first token.
+    """
+
+    def __init__(self, label: str, stream=None, refresh_interval: float = 0.1):
+        self.label = label
+        self.stream = stream or sys.stdout
+        self.refresh_interval = refresh_interval
+        self.start_time = None
+        self.first_token_time = None
+        self.end_time = None
+        self.chars = 0
+        self.chunks = 0
+        self._last_render = 0.0
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Seconds from the start of the request to the first content chunk."""
+        if self.start_time is None or self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        """Seconds from the start of the request to the end of the stream."""
+        if self.start_time is None:
+            return None
+        return (self.end_time or time.perf_counter()) - self.start_time
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._render(force=True)
+
+    def update(self, text: str):
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.chars += len(text)
+        self.chunks += 1
+        self._render()
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+        self._render(force=True)
+        self.stream.write("\n")
+        self.stream.flush()
+
+    def _render(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._last_render < self.refresh_interval:
+            return
+        self._last_render = now
+        if self.first_token_time is None:
+            status = f"waiting for first token... {now - self.start_time:.1f}s"
+        else:
+            status = f"{self.chars} chars received, first token after {self.ttft:.2f}s, {self.elapsed:.1f}s elapsed"
+        self.stream.write(f"\r    {self.label}: {status}")
+        self.stream.flush()
+
+def consume_stream(
+    chunks: Iterable,
+    on_text: Callable[[str], None],
+    on_usage: Optional[Callable[[object], None]] = None,
+) -> str:
+    """
+    Reads a streamed chat completion, passing each piece of content to
+    `on_text` as it arrives.
+
+    Args:
+        chunks: The stream returned by chat.completions.create(stream=True).
+        on_text: Called with each non-empty content delta.
+        on_usage: Called with the usage object of the final chunk, which is
+                  sent when the request sets stream_options={"include_usage": True}.
+
+    Returns:
+        The full concatenated content.
+    """
+    parts = []
+    for chunk in chunks:
+        usage = getattr(chunk, "usage", None)
+        if usage is not None and on_usage is not None:
+            on_usage(usage)
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content
+        if text:
+            parts.append(text)
+            on_text(text)
+    return "".join(parts)
+
+class AtomicFileWriter:
+    """
+    Writes to a temporary file next to `path` and renames it into place on
+    commit, so readers never see a partially written file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.temp_path = f"{path}.part"
+        self._file = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.temp_path, "w", encoding="utf-8")
+        return self
+
+    def write(self, text: str):
+        self._file.write(text)
+        # Flush each chunk so the partial file can be followed while streaming
+        self._file.flush()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.temp_path, self.path)
+        else:
+            os.remove(self.temp_path)
+        return False
@@ -0,0 +1,56 @@
+# token_budget.py
+from typing import List
+
+# Rough characters-per-token ratio for English text with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a piece of text.
+
+    Args:
+        text: The text to measure.
+
+    Returns:
+        An approximate token count (rounded up).
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def split_text(text: str, max_tokens: int) -> List[str]:
+    """
+    Splits text into pieces of at most roughly `max_tokens` tokens,
+    preferring paragraph and then line boundaries.
+
+    Args:
+        text: The text to split.
+        max_tokens: The approximate size limit for each piece.
+
+    Returns:
+        A list of text pieces that together contain the original text.
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return [text]
+
+    pieces: List[str] = []
+    current = ""
+    for block in text.split("\n\n"):
+        # Blocks that are too big on their own are cut at line, then character, boundaries
+        parts = [block] if len(block) <= max_chars else block.split("\n")
+        for part in parts:
+            if len(part) > max_chars and current:
+                # Flush first so the cut pieces stay in document order
+                pieces.append(current)
+                current = ""
+            while len(part) > max_chars:
+                pieces.append(part[:max_chars])
+                part = part[max_chars:]
+            candidate = f"{current}\n\n{part}" if current else part
+            if len(candidate) <= max_chars:
+                current = candidate
+            else:
+                pieces.append(current)
+                current = part
+    if current:
+        pieces.append(current)
+    return pieces
@@ -0,0 +1,293 @@
+# worker.py
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import dataclasses
+import multiprocessing
+from typing import Dict, List
+from clients import load_environment
+
+# Load environment variables from .env file
+load_environment()
+
+from query_dedup import DEFAULT_SIMILARITY_THRESHOLD
+from research_memory import memory_mode_for
+from model_router import ModelRouter, ROUTING_POLICIES, DEFAULT_ROUTING_POLICY
+from token_budget import estimate_tokens
+from perplexity_researcher import research_query_perplexity
+from run_store import RunStore, DEFAULT_RUNS_DIR, is_error
+from job_store import JobStore, DEFAULT_JOB_DB, DEFAULT_LEASE_SECONDS
+from pipeline import (
+    PipelineOptions,
+    run_query_stage,
+    collect_results,
+    build_corpus,
+    run_analysis_stage,
+    run_report_stage,
+)
+
+# Worker processes started by `worker.py work`
+DEFAULT_PROCESSES = 4
+# Seconds an idle worker waits before looking for work again
+POLL_INTERVAL = 0.5
+
+class LeaseHeartbeat:
+    """Renews a task's lease in the background while the worker is busy with it."""
+
+    def __init__(self, jobs: JobStore, task: Dict[str, object], owner: str):
+        self.jobs = jobs
+        self.task = task
+        self.owner = owner
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.jobs.lease_seconds / 3):
+            if not self.jobs.renew(self.task["id"], self.owner):
+                self.lost = True
+                print(f"Lost the lease on task {self.task['id']}; another worker has reclaimed it.")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def _options(task: Dict[str, object]) -> PipelineOptions:
+    # Progress lines from several workers would interleave, so nothing is streamed
+    return dataclasses.replace(PipelineOptions(**task["options"]), stream=False)
+
+def run_task(jobs: JobStore, task: Dict[str, object], runs_dir: str) -> List[dict]:
+    """
+    Performs one leased task against the run's checkpoints. Completed work
+    is found in the checkpoints and skipped, so a task reclaimed after a
+    crash picks up where it stopped.
+
+    Returns:
+        The routing decisions made by a research task (empty otherwise).
+
+    Raises:
+        RuntimeError: If the task failed and should be retried.
+    """
+    store = RunStore.open(task["run_id"], runs_dir)
+    options = _options(task)
+
+    if task["kind"] == "queries":
+        queries = run_query_stage(store, options)
+        if not queries:
+            raise RuntimeError("Failed to generate queries.")
+        pending = [i for i in range(len(queries)) if is_error((store.load_result(i) or {}).get("result"))]
+        jobs.enqueue_research(store.run_id, pending)
+        print(f"[{store.run_id}] Queued {len(pending)} research tasks.")
+        return []
+
+    if task["kind"] == "research":
+        index = task["query_index"]
+        query = store.load_queries()[index]
+        existing = store.load_result(index)
+        if existing is not None and not is_error(existing["result"]):
+            return []
+        router = ModelRouter(options.model_routing)
+        result = router.run(
+            "research", estimate_tokens(query), lambda model: research_query_perplexity(query, model)
+        )
+        store.save_result(index, query, result)
+        if is_error(result):
+            raise RuntimeError(result)
+        print(f"[{store.run_id}] Researched query {index+1}.")
+        return router.decisions
+
+    # finalize: gather every research result, then analyze and write the report
+    queries = store.load_queries()
+    log = store.load_routing_log()
+    if not any(decision["stage"] == "research" for decision in log):
+        store.save_routing_log(log + jobs.research_routing(store.run_id))
+    corpus = build_corpus(store, collect_results(store, queries), options)
+    analysis = run_analysis_stage(store, corpus, options)
+    if analysis is None:
+        raise RuntimeError("Analysis failed.")
+    report_path = store.report_path or run_report_stage(store, corpus, analysis, options)
+    if report_path is None:
+        raise RuntimeError("Report generation failed.")
+    jobs.finish_run(store.run_id, report_path)
+    return []
+
+def work(db: str, runs_dir: str, lease_seconds: float = DEFAULT_LEASE_SECONDS, exit_when_idle: bool = False) -> int:
+    """
+    Leases and runs tasks until interrupted or, with `exit_when_idle`, until
+    no task is pending or leased anywhere.
+
+    Returns:
+        The number of tasks this worker completed.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    jobs = JobStore(db, lease_seconds)
+    completed = 0
+    while True:
+        task = jobs.lease(owner)
+        if task is None:
+            if exit_when_idle and jobs.is_idle():
+                return completed
+            time.sleep(POLL_INTERVAL)
+            continue
+        with LeaseHeartbeat(jobs, task, owner) as heartbeat:
+            try:
+                routing = run_task(jobs, task, runs_dir)
+            except Exception as e:
+                print(f"[{task['run_id']}] {task['kind']} task {task['id']} failed (attempt {task['attempts']}): {e}")
+                if not heartbeat.lost:
+                    jobs.release(task, owner, str(e))
+                continue
+        if jobs.complete(task, owner, routing):
+            completed += 1
+
+def _work_process(db: str, runs_dir: str, lease_seconds: float, exit_when_idle: bool, counts):
+    counts.put(work(db, runs_dir, lease_seconds, exit_when_idle))
+
+def run_workers(processes: int, db: str, runs_dir: str, lease_seconds: float, exit_when_idle: bool) -> int:
+    """Runs `processes` worker processes and waits for them; returns the tasks they completed."""
+    # Spawned rather than forked, so no process inherits another's connections or threads
+    context = multiprocessing.get_context("spawn")
+    counts = context.Queue()
+    workers = [
+        context.Process(target=_work_process, args=(db, runs_dir, lease_seconds, exit_when_idle, counts))
+        for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
+    return sum(counts.get() for process in workers if process.exitcode == 0)
+
+def submit_topics(topics: List[str], db: str, runs_dir: str, options: PipelineOptions) -> List[str]:
+    """Creates a run per topic and queues it; returns the run IDs."""
+    jobs = JobStore(db)
+    fields = {k: v for k, v in dataclasses.asdict(options).items() if k != "on_event"}
+    run_ids = []
+    for topic in topics:
+        store = RunStore.create(topic, runs_dir)
+        jobs.submit(store.run_id, topic, fields)
+        run_ids.append(store.run_id)
+    return run_ids
+
+def print_status(db: str):
+    """Prints run and task counts and the state of every run."""
+    jobs = JobStore(db)
+    counts = jobs.counts()
+    print("Runs:  " + ", ".join(f"{status} {n}" for status, n in sorted(counts["runs"].items())))
+    print("Tasks: " + ", ".join(f"{key} {n}" for key, n in sorted(counts["tasks"].items())))
+    for run in jobs.runs():
+        detail = run["report_path"] or run["error"] or ""
+        print(f"  {run['run_id']}  {run['status']:<9}  {run['topic'][:50]:<50}  {detail}")
+
+def parse_args(argv=None):
+    """Parses command-line options for distributed mode."""
+    from mock_openai_server import add_config_arguments
+
+    parser = argparse.ArgumentParser(description="Distributed research workers sharing a SQLite job store.")
+    parser.add_argument("--db", default=DEFAULT_JOB_DB, help=f"Job store database (default: {DEFAULT_JOB_DB}).")
+    parser.add_argument("--runs-dir", default=DEFAULT_RUNS_DIR,
+                        help=f"Directory holding per-run checkpoints (default: {DEFAULT_RUNS_DIR}).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Queue topics, one per line (plain text or JSON with a 'topic').")
+    submit.add_argument("input", nargs="?", default="-", help="File with one topic per line, or '-' for stdin.")
+    submit.add_argument("--dedup-threshold", type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                        help=f"Similarity at which generated queries are merged (default: {DEFAULT_SIMILARITY_THRESHOLD}).")
+    submit.add_argument("--no-compact", action="store_true",
+                        help="Paste research results into the prompts without removing duplicated text.")
+    submit.add_argument("--report-mode", choices=["single", "sections"], default="single",
+                        help="'single' writes each report in one completion (default); 'sections' plans an "
+                             "outline and writes its sections in parallel.")
+    submit.add_argument("--model-routing", choices=sorted(ROUTING_POLICIES), default=DEFAULT_ROUTING_POLICY,
+                        help="'fixed' uses one model per stage (default); 'tiered' tries faster models first.")
+
+    run = commands.add_parser("work", help="Run worker processes that pull tasks from the job store.")
+    run.add_argument("--processes", type=int, default=DEFAULT_PROCESSES,
+                     help=f"Worker processes on this host (default: {DEFAULT_PROCESSES}).")
+    run.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS,
+                     help=f"Lease length; a dead worker's tasks are reclaimed after it (default: {DEFAULT_LEASE_SECONDS:.0f}).")
+    run.add_argument("--exit-when-idle", action="store_true",
+                     help="Stop once no task is pending or leased, e.g. at the end of a nightly sweep.")
+    run.add_argument("--memory", choices=["use", "store", "off"], default=None,
+                     help="Research memory of earlier runs: 'use' (default), 'store' (default with "
+                          "--refresh-cache) or 'off' (default with --no-cache).")
+    cache_group = run.add_mutually_exclusive_group()
+    cache_group.add_argument("--no-cache", action="store_true", help="Do not read or write the response cache.")
+    cache_group.add_argument("--refresh-cache", action="store_true",
+                             help="Ignore cached responses but store the fresh ones.")
+    run.add_argument("--mock", action="store_true",
+                     help="Start the mock OpenAI/Perplexity server in this process and send every worker's calls to it.")
+    add_config_arguments(run.add_argument_group("mock server (with --mock)"))
+
+    commands.add_parser("status", help="Show run and task counts.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Entry point for distributed mode."""
+    args = parse_args(argv)
+    if args.command == "status":
+        print_status(args.db)
+        return
+
+    if args.command == "submit":
+        from batch_runner import read_topics
+
+        if args.input == "-":
+            topics = read_topics(sys.stdin.readlines())
+        else:
+            with open(args.input, "r", encoding="utf-8") as f:
+                topics = read_topics(f.readlines())
+        options = PipelineOptions(
+            dedup_threshold=args.dedup_threshold,
+            stream=False,
+            compact=not args.no_compact,
+            report_mode=args.report_mode,
+            model_routing=args.model_routing,
+        )
+        run_ids = submit_topics(topics, args.db, args.runs_dir, options)
+        print(f"Queued {len(run_ids)} topics in {args.db}.")
+        return
+
+    # Worker processes are spawned with this environment, so settings travel through it
+    cache_mode = "bypass" if args.no_cache else "refresh" if args.refresh_cache else None
+    if cache_mode:
+        os.environ["RESEARCH_CACHE_MODE"] = cache_mode
+    memory_mode = memory_mode_for(cache_mode, args.memory)
+    if memory_mode:
+        os.environ["RESEARCH_MEMORY_MODE"] = memory_mode
+    mock_server = None
+    if args.mock:
+        from mock_openai_server import start_mock_server, config_from_args
+
+        mock_server, mock_url = start_mock_server(config_from_args(args))
+        os.environ["OPENAI_BASE_URL"] = mock_url
+        os.environ["PERPLEXITY_BASE_URL"] = mock_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        os.environ.setdefault("PERPLEXITY_API_KEY", "mock")
+        # Account rate limits do not apply to the mock
+        os.environ["RESEARCH_RATE_LIMITS"] = "none"
+        print(f"Mock model server listening on {mock_url}")
+
+    print(f"Starting {args.processes} workers on {args.db}...")
+    start = time.perf_counter()
+    completed = run_workers(args.processes, args.db, args.runs_dir, args.lease_seconds, args.exit_when_idle)
+    elapsed = time.perf_counter() - start
+    print(f"\n{completed} tasks completed in {elapsed:.1f}s ({completed / elapsed:.2f} tasks/s).")
+    print_status(args.db)
+    if mock_server is not None:
+        mock_server.shutdown()
+
+if __name__ == "__main__":
+    main()